@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+import tkinter
+import statistics
+import customtkinter as ctk
+from PIL import Image
+
+from cambridge_booklist import VirtualBookList
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def make_books(count, thumbs, thumb_dir):
+    """Synthetic library: count books sharing `thumbs` distinct 60x90 cover thumbnails."""
+    paths = []
+    for i in range(thumbs):
+        path = os.path.join(thumb_dir, f"{i}.thumb.jpg")
+        Image.new("RGB", (60, 90), (random.randrange(256), random.randrange(256), random.randrange(256))).save(path)
+        paths.append(path)
+    return [{'id': 100000 + i, 'title': f"Synthetic Book {i} - Cambridge International AS & A Level",
+             'status': 'Cloud', 'cover_thumb': paths[i % thumbs]} for i in range(count)]
+
+def positive(value):
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return n
+
+def frame_stats(times):
+    times = sorted(t * 1000 for t in times)
+    return (f"mean {statistics.mean(times):.1f} ms, p95 {times[int(len(times) * 0.95) - 1]:.1f} ms, "
+            f"max {times[-1]:.1f} ms over {len(times)} frames")
+
+def scroll_frames(root, canvas, frames, step_units=3):
+    """Scrolls down step_units per frame (bouncing at the ends) and times each redraw."""
+    times = []
+    direction = 1
+    for _ in range(frames):
+        top, bottom = canvas.yview()
+        if bottom >= 1.0: direction = -1
+        elif top <= 0.0: direction = 1
+        start = time.perf_counter()
+        canvas.yview_scroll(direction * step_units, "units")
+        root.update()
+        times.append(time.perf_counter() - start)
+    return times
+
+def jump_frames(root, canvas, frames):
+    """Random jumps anywhere in the list (scrollbar drags): every visible row is re-bound."""
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        canvas.yview_moveto(random.random())
+        root.update()
+        times.append(time.perf_counter() - start)
+    return times
+
+def bench_virtual(root, books, frames):
+    view = VirtualBookList(root, label_text="Available Books")
+    view.pack(fill="both", expand=True)
+    root.update()
+    start = time.perf_counter()
+    view.set_books(books)
+    root.update()
+    logger.info(f"[virtual] render {len(books)} books: {(time.perf_counter() - start) * 1000:.0f} ms "
+                f"({len(view._rows)} row widgets)")
+    logger.info(f"[virtual] scroll: {frame_stats(scroll_frames(root, view._canvas, frames))}")
+    logger.info(f"[virtual] jumps:  {frame_stats(jump_frames(root, view._canvas, frames // 4 or 1))}")
+    view.destroy()
+
+def bench_cards(root, books, frames):
+    """The previous layout: one CTkFrame card (checkbox, cover, two labels) per book."""
+    frame = ctk.CTkScrollableFrame(root, label_text="Available Books")
+    frame.pack(fill="both", expand=True)
+    root.update()
+    start = time.perf_counter()
+    for book in books:
+        card = ctk.CTkFrame(frame)
+        card.pack(fill="x", pady=5)
+        ctk.CTkCheckBox(card, text="", variable=ctk.IntVar(), width=24).pack(side="left", padx=(10, 0))
+        pil_img = Image.open(book['cover_thumb'])
+        cover_img = ctk.CTkImage(light_image=pil_img, dark_image=pil_img, size=pil_img.size)
+        ctk.CTkLabel(card, text="", image=cover_img).pack(side="left", padx=10, pady=5)
+        info = ctk.CTkFrame(card, fg_color="transparent")
+        info.pack(side="left", fill="both", expand=True, padx=10)
+        ctk.CTkLabel(info, text=book['title'], font=("Roboto Medium", 14), anchor="w").pack(anchor="w", pady=(5, 0))
+        ctk.CTkLabel(info, text=f"Status: {book['status']}", text_color="gray", font=("Roboto", 12)).pack(anchor="w")
+    root.update()
+    logger.info(f"[cards]   render {len(books)} books: {(time.perf_counter() - start) * 1000:.0f} ms")
+    logger.info(f"[cards]   scroll: {frame_stats(scroll_frames(root, frame._parent_canvas, frames, 60))}")
+    frame.destroy()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render and scroll benchmark of the library list.")
+    parser.add_argument("--books", type=positive, default=5000, help="Synthetic library size (default: 5000)")
+    parser.add_argument("--thumbs", type=positive, default=500, help="Distinct cover thumbnails (default: 500)")
+    parser.add_argument("--frames", type=positive, default=400, help="Scroll frames to time (default: 400)")
+    parser.add_argument("--cards", type=int, default=0,
+                        help="Also time the old one-card-per-book list with this many books (slow)")
+    args = parser.parse_args()
+
+    random.seed(1)
+    try:
+        root = ctk.CTk()
+    except tkinter.TclError as e:
+        logger.error(f"No display to benchmark on ({e}); on a headless machine run it under xvfb-run")
+        sys.exit(1)
+    root.geometry("1000x800")
+    with tempfile.TemporaryDirectory() as thumb_dir:
+        books = make_books(args.books, min(args.thumbs, args.books), thumb_dir)
+        bench_virtual(root, books, args.frames)
+        if args.cards:
+            bench_cards(root, books[:args.cards], args.frames)
+    root.destroy()
+    sys.exit(0)
@@ -8,7 +8,7 @@ def install_package(package):
     subprocess.check_call([sys.executable, "-m", "pip", "install", package])
 
 def check_dependencies():
-    required = ['customtkinter', 'requests', 'pyinstaller', 'Pillow']
+    required = ['customtkinter', 'requests', 'aiohttp', 'pyinstaller', 'Pillow']
     for package in required:
         try:
             if package == 'Pillow':
@@ -1,18 +1,115 @@
 import requests
 import json
+import codecs
 import logging
 import os
 import time
+import hashlib
 import re
-import xml.etree.ElementTree as ET
+import queue
+import threading
+import posixpath
+import mimetypes
 import zipfile
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
 from urllib.parse import unquote
+from cambridge_packager import EpubPackager, ArchiveSidecar, ZipEntryRef
+from cambridge_store import AssetStore, BlobRef
+from cambridge_journal import JobJournal
+from cambridge_transfer import RangedDownloader, TransferCancelled, AdaptiveConcurrency, RetryPolicy, ByteBudget, BodyReader
+from cambridge_async import AsyncTransport, fetch_sync
+from cambridge_progress import ProgressTracker
+from cambridge_opf import OpfPackage
+from cambridge_refs import ReferenceScanner
+from cambridge_resolver import UrlResolver
+from cambridge_httpcache import HttpCache
+from cambridge_discovery import PendingResources, DiscoveryPrefetcher, HIGH, LOW
+from cambridge_validate import ContentValidators, S3_ERROR
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class IncompleteBookError(Exception):
+    """Raised when assets are still missing after the retry budget (the job stays resumable)."""
+
+
+# Bodies the HTTP cache may keep (error pages also come back with a 200)
+OPF_ROOT = re.compile(rb'<(?:[\w.-]+:)?package[\s>]')
+
+def _is_opf(response):
+    return bool(OPF_ROOT.search(response.content[:4096]))
+
+def _is_json(response):
+    try:
+        json.loads(response.content.decode('utf-8-sig'))
+    except ValueError:
+        return False
+    return True
+
+def _is_listing(response):
+    return "Server Error" not in response.text and S3_ERROR not in response.content[:1024]
+
+def _iter_json_books(chunks):
+    """
+    Incremental parser for the bookshelf body (chunks of bytes): a JSON array of books is
+    decoded object by object as the chunks arrive. The {"books": [...]} form is parsed
+    once complete. Raises json.JSONDecodeError on malformed input.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    chunks = iter(chunks)
+    buf, pos, done = "", 0, False
+
+    def more():
+        nonlocal buf, pos, done
+        chunk = next(chunks, None)
+        if chunk is None:
+            done = True
+            buf = buf[pos:] + utf8.decode(b'', final=True)
+        else:
+            buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+
+    def skip(chars):
+        # Advances past whitespace/separators; False once the input is exhausted
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf): return True
+            if done: return False
+            more()
+
+    if not skip('\ufeff \t\r\n'):
+        return
+    if buf[pos] != '[':
+        while not done:
+            more()
+        data = json.loads(buf[pos:])
+        yield from (data.get("books") or []) if isinstance(data, dict) else []
+        return
+    pos += 1
+    while skip(' \t\r\n,'):
+        if buf[pos] == ']':
+            return
+        try:
+            book, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # Object not complete yet
+            if done: raise
+            more()
+            continue
+        if end >= len(buf) and not done:
+            # A bare value cut at the chunk boundary (e.g. a number) may continue
+            more()
+            continue
+        pos = end
+        yield book
+    raise json.JSONDecodeError("Unterminated book list", buf, pos)
+
+
 class CambridgeAPI:
     """
     Client for interacting with the Cambridge/Elevate API.
@@ -21,9 +118,53 @@ class CambridgeAPI:
     
     BASE_URL = "https://elevate.cambridge.org/Openpageservices/BookService.svc"
     S3_BASE_URL = "https://elevate-s3.cambridge.org" # deduced from logs
+    # AIMD bounds for in-flight asset fetches (see AdaptiveConcurrency)
+    ASSET_WORKERS_MIN = 2
+    ASSET_WORKERS = 10
+    ASSET_WORKERS_MAX = 64
+    # Asset bodies above STREAM_THRESHOLD are streamed to disk; smaller ones held in
+    # memory count against MEMORY_BUDGET (shared by every book of this client)
+    STREAM_THRESHOLD = 1024 * 1024
+    MEMORY_BUDGET = 128 * 1024 * 1024
+    # Resources (answer keys, enrichments) downloaded side by side per book; alt_url is
+    # raced against url if url has not produced a valid first chunk after RESOURCE_HEDGE_DELAY
+    RESOURCE_WORKERS = 6
+    RESOURCE_HEDGE_DELAY = 2.0
+    # Library scan: books whose resources are discovered at once, and the time each may take
+    DISCOVERY_WORKERS = 16
+    # Threads discovering pending resources in the background (see prefetch_resources)
+    PREFETCH_WORKERS = 2
+    DISCOVERY_TIMEOUT = 30
     
-    def __init__(self):
+    def __init__(self, store_dir="asset_store"):
         self.session = requests.Session()
+        # Connection pool sized for the largest concurrency window
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=self.ASSET_WORKERS_MAX)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Adaptive (AIMD) limit on in-flight asset fetches, shared by every book
+        self.concurrency = AdaptiveConcurrency(self.ASSET_WORKERS, self.ASSET_WORKERS_MIN, self.ASSET_WORKERS_MAX)
+        # Per-asset retry budget and backoff
+        self.retry_policy = RetryPolicy()
+        self.byte_budget = ByteBudget(self.MEMORY_BUDGET)
+        self.body_reader = BodyReader(self.byte_budget, lambda: self.store.spool_path(), self.STREAM_THRESHOLD)
+        # Byte-level progress of every download, published as one coalesced stream
+        self.progress = ProgressTracker(in_flight=self.concurrency.in_flight_for,
+                                        window=lambda: self.concurrency.window)
+        # Background resource discovery; library-wide prefetching waits while books download
+        self.prefetcher = DiscoveryPrefetcher(self.PREFETCH_WORKERS, busy=self.progress.busy)
+        # Content-addressed cache of EPUB assets, shared across books and book versions
+        self.store = AssetStore(store_dir)
+        # Range-resumable / segmented transfers for large resources
+        self.downloader = RangedDownloader(self.session)
+        # First-bytes checks per expected type (PDF, ZIP, images, XHTML...) for assets and resources
+        self.validators = ContentValidators.with_defaults()
+        # Which listing locations and resource URL patterns work, learned across runs
+        self.resolver = UrlResolver(os.path.join(store_dir, "resolver.json"))
+        # RFC 9111 cache for metadata GETs (OPF, enrichments.json, listings)
+        self.http_cache = HttpCache(os.path.join(store_dir, "http_cache"))
+        # Optional shared event-loop transport (see enable_async_transport)
+        self.transport = None
         # Header simulation (mimic Chrome/App)
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/59.0.3071.115 Safari/537.36',
@@ -36,6 +177,8 @@ class CambridgeAPI:
         self.user_id = None
         self.access_token = None
         self.user_data = {}
+        # Whether the last iter_books() read the whole bookshelf
+        self.bookshelf_complete = False
 
     def login(self, username, password):
         """
@@ -79,13 +222,38 @@ class CambridgeAPI:
         except requests.exceptions.RequestException as e:
             return False, f"Connection error: {e}"
 
-    def get_books(self):
+    def get_books(self, needs_discovery=None, lazy=True):
         """
         Fetches the list of books from the bookshelf endpoint.
+        needs_discovery(book) -> bool picks the books whose resources are scanned
+        (default: all of them), e.g. to skip books the library catalog already knows.
+        lazy=True: those books get a PendingResources handle (book['resources_pending'])
+        and are only scanned when resolved (see resolve_resources / prefetch_resources).
+        lazy=False scans them all before returning.
+        """
+        if lazy:
+            return list(self.iter_books(needs_discovery))
+        books = list(self.iter_books(lambda b: False))
+        if books:
+            logger.info("Scanning for resources...")
+            # Enhance books with resources
+            self._enhance_books_with_resources(
+                [b for b in books if needs_discovery is None or needs_discovery(b)])
+        return books
+
+    def iter_books(self, needs_discovery=None):
         """
+        Streams the bookshelf: yields each book as soon as its JSON object has arrived
+        and been parsed, while the rest of the response is still downloading.
+        Books for which needs_discovery(book) is True (default: all) get a
+        PendingResources handle, exactly like get_books(lazy=True).
+        self.bookshelf_complete is True once the whole list was read; it stays False
+        when the response failed or broke off (the books yielded are then only a part).
+        """
+        self.bookshelf_complete = False
         if not self.is_authenticated or not self.user_id:
             logger.error("Cannot get books: Not authenticated.")
-            return []
+            return
 
         endpoint = f"{self.BASE_URL}/user/{self.user_id}/bookshelf/"
         
@@ -98,138 +266,195 @@ class CambridgeAPI:
         
         payload = {"books": []}
 
+        count = pending = 0
         try:
-            response = self.session.post(endpoint, json=payload, headers=headers, timeout=15)
-            
-            if response.status_code == 200:
-                try:
-                    text = response.text.lstrip('\ufeff')
-                    data = json.loads(text)
-                    
-                    books = []
-                    if isinstance(data, list):
-                        books = data
-                    elif isinstance(data, dict) and "books" in data:
-                        books = data["books"]
-                    
-                    if books:
-                        logger.info(f"Retrieved {len(books)} books. Scanning for resources...")
-                        # Enhance books with resources
-                        self._enhance_books_with_resources(books)
-                        return books
-                    
-                    return []
-                except json.JSONDecodeError:
-                    logger.error("Failed to parse book list JSON.")
-                    return []
-            else:
-                logger.error(f"Bookshelf fetch failed: {response.status_code}")
-                return []
-                
+            with self.session.post(endpoint, json=payload, headers=headers, timeout=15, stream=True) as response:
+                if response.status_code != 200:
+                    logger.error(f"Bookshelf fetch failed: {response.status_code}")
+                    return
+                # Small reads: a read returns once it is full, so large ones would hold
+                # back books that already arrived (a book entry is well under 1 KB)
+                for book in _iter_json_books(response.iter_content(chunk_size=1024)):
+                    count += 1
+                    if needs_discovery is None or needs_discovery(book):
+                        pending += 1
+                        self.defer_resources(book)
+                    yield book
+            self.bookshelf_complete = True
+        except json.JSONDecodeError:
+            logger.error(f"Failed to parse book list JSON (after {count} books).")
         except Exception as e:
             logger.error(f"Error fetching books: {e}")
-            return []
+        if count:
+            logger.info(f"Retrieved {count} books ({pending} with resources pending).")
 
     def _enhance_books_with_resources(self, books):
         """
         Checks opcr_url for supplemental resources (Answer Keys, etc)
+        All books are scanned at once on DISCOVERY_WORKERS threads. Each book gets
+        DISCOVERY_TIMEOUT seconds; one that runs out keeps whatever was found so far
+        and is flagged with book['resources_partial'].
+        """
+        if books:
+            with ThreadPoolExecutor(max_workers=min(self.DISCOVERY_WORKERS, len(books))) as executor:
+                futures = [executor.submit(self._discover_resources, book) for book in books]
+                for book, future in zip(books, futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.warning(f"Failed to check resources for {book.get('title')}: {e}")
+        self.resolver.save()
+
+    def defer_resources(self, book, on_resolved=None):
+        """Attaches (and returns) a PendingResources handle; discovery runs when it is resolved."""
+        handle = book.get('resources_pending')
+        if handle is None:
+            handle = book['resources_pending'] = PendingResources(book, self._discover_pending, on_resolved)
+        elif on_resolved:
+            handle.on_resolved = on_resolved
+        return handle
+
+    def resolve_resources(self, book):
+        """book's resources, discovering them first if still pending (blocks)."""
+        handle = book.get('resources_pending')
+        return handle.resolve() if handle else book.get('resources', [])
+
+    def prefetch_resources(self, books, priority=LOW):
+        """
+        Discovers pending resources in the background. LOW (library-wide prefetch) waits
+        while any book downloads; NORMAL/HIGH (selected or queued books) run right away.
         """
         for book in books:
-            opcr_url = book.get("opcr_url")
-            if opcr_url:
-                try:
-                    # Scan TWO locations: 
-                    # 1. The resources folder (opcr_url)
-                    # 2. The parent folder (book root)
-                    
-                    urls_to_scan = [opcr_url]
-                    # Generate parent URL
-                    if opcr_url.endswith('/'):
-                        # e.g. .../resources/ -> .../
-                        parent = opcr_url.rstrip('/').rpartition('/')[0] + '/'
-                    else:
-                        parent = os.path.dirname(opcr_url) + '/'
-                    urls_to_scan.append(parent)
+            self.prefetcher.submit(book.get('resources_pending'), priority)
+
+    def _discover_pending(self, book):
+        self._discover_resources(book)
+        self.resolver.save()
+
+    def _discover_resources(self, book):
+        """Enrichment manifest plus directory listings for one book (sets book['resources'])."""
+        book.pop('resources_partial', None)
+        opcr_url = book.get("opcr_url")
+        if opcr_url:
+            deadline = time.monotonic() + self.DISCOVERY_TIMEOUT
+            book_resources = []
+            try:
+                # Scan TWO locations: 
+                # 1. The resources folder (opcr_url)
+                # 2. The parent folder (book root)
+                
+                urls_to_scan = [('listing:opcr', opcr_url)]
+                # Generate parent URL
+                if opcr_url.endswith('/'):
+                    # e.g. .../resources/ -> .../
+                    parent = opcr_url.rstrip('/').rpartition('/')[0] + '/'
+                else:
+                    parent = os.path.dirname(opcr_url) + '/'
+                urls_to_scan.append(('listing:parent', parent))
+                
+                # 3. The src_url (extracted_books)
+                src_url = book.get("src_url")
+                if src_url:
+                    if not src_url.endswith('/'): src_url += '/'
+                    urls_to_scan.append(('listing:src', src_url))
+
+
+                # 0. Fetch Official Enrichment Manifest (High Priority)
+                enrichments = self._fetch_enrichments(book, timeout=min(10, self.DISCOVERY_TIMEOUT))
+                if enrichments:
+                    book_resources.extend(enrichments)
+                
+                for kind, scan_url in urls_to_scan:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.warning(f"Resource scan for {book.get('title')} timed out, keeping what was found")
+                        book['resources_partial'] = True
+                        break
+                    # Listings that keep answering with error pages are skipped (see UrlResolver)
+                    if self.resolver.is_dead(kind, scan_url):
+                        logger.info(f"Skipping dead listing: {scan_url}")
+                        continue
+                    logger.info(f"Scanning for resources at: {scan_url}")
                     
-                    # 3. The src_url (extracted_books)
-                    src_url = book.get("src_url")
-                    if src_url:
-                        if not src_url.endswith('/'): src_url += '/'
-                        urls_to_scan.append(src_url)
+                    # Blind Probe - DISABLED to prevent false positives (ghost files / 3KB HTML)
+                    # The enrichment manifest is the source of truth now.
+                    # candidates = []
+                    # isbn = book.get('isbn')
+                    # if isbn:
+                    #     candidates.append(f"{isbn}_Answer_Key.zip")
+                    #     candidates.append(f"{isbn}_Answers.zip")
+                    #     candidates.append(f"{isbn}_Resources.zip")
+                    #     candidates.append(f"{isbn}_Teacher_Resources.zip")
                     
-                    book_resources = []
+                    # # Specific fix for user report
+                    # candidates.append("asal_physics_cb_answers.zip")
+                    # candidates.append("asal_chemistry_cb_answers.zip")
+                    # candidates.append("Answer_Key.zip")
+                    # candidates.append("Answers.zip")
 
-                    # 0. Fetch Official Enrichment Manifest (High Priority)
-                    enrichments = self._fetch_enrichments(book)
-                    if enrichments:
-                        book_resources.extend(enrichments)
-                    
-                    for scan_url in urls_to_scan:
-                        logger.info(f"Scanning for resources at: {scan_url}")
-                        
-                        # Blind Probe - DISABLED to prevent false positives (ghost files / 3KB HTML)
-                        # The enrichment manifest is the source of truth now.
-                        # candidates = []
-                        # isbn = book.get('isbn')
-                        # if isbn:
-                        #     candidates.append(f"{isbn}_Answer_Key.zip")
-                        #     candidates.append(f"{isbn}_Answers.zip")
-                        #     candidates.append(f"{isbn}_Resources.zip")
-                        #     candidates.append(f"{isbn}_Teacher_Resources.zip")
-                        
-                        # # Specific fix for user report
-                        # candidates.append("asal_physics_cb_answers.zip")
-                        # candidates.append("asal_chemistry_cb_answers.zip")
-                        # candidates.append("Answer_Key.zip")
-                        # candidates.append("Answers.zip")
-
-                        # for probe_file in candidates:
-                        #     probe_url = scan_url.rstrip('/') + '/' + probe_file
-                        #     try:
-                        #         # Use HEAD to check if exists
-                        #         ph = self.session.head(probe_url, timeout=5)
-                        #         if ph.status_code == 200:
-                        #             logger.info(f"[PROBE HIT] Found {probe_file}")
-                        #             # Check if HTML/Fake
-                        #             if 'html' not in ph.headers.get('Content-Type', '').lower():
-                        #                  if not any(r['url'] == probe_url for r in book_resources):
-                        #                      book_resources.append({'name': probe_file, 'url': probe_url})
-                        #     except: pass
-
-                        # 2. Try Standard Directory Listing (in case it works for some books)
-                        resp = self.session.get(scan_url, timeout=5)
-                        if resp.status_code == 200:
-                            raw_html = resp.text
-                            # Only parse if it looks like a directory listing
-                            if "Server Error" not in raw_html:
-                                links = re.findall(r'href=["\']([^"\']+)["\']', raw_html)
-                                logger.info(f"Directory listing active. Links found: {len(links)}")
-                                
-                                for link in links:
-                                    if link == "../" or link.endswith("/"): continue
-                                    if link.startswith("?"): continue
-                                    
-                                    # Clean filename
-                                    name = link
-                                    url = scan_url.rstrip('/') + '/' + link
-                                    
-                                    # Filter
-                                    if name.lower().endswith(('.zip', '.pdf', '.docx', '.pptx', '.xlsx')):
-                                        if not any(r['url'] == url for r in book_resources):
-                                            book_resources.append({'name': name, 'url': url})
-                                            logger.info(f"-> ACCEPTED: {name}")
-                        else:
-                             logger.info(f"Scan failed {resp.status_code} for {scan_url}")
+                    # for probe_file in candidates:
+                    #     probe_url = scan_url.rstrip('/') + '/' + probe_file
+                    #     try:
+                    #         # Use HEAD to check if exists
+                    #         ph = self.session.head(probe_url, timeout=5)
+                    #         if ph.status_code == 200:
+                    #             logger.info(f"[PROBE HIT] Found {probe_file}")
+                    #             # Check if HTML/Fake
+                    #             if 'html' not in ph.headers.get('Content-Type', '').lower():
+                    #                  if not any(r['url'] == probe_url for r in book_resources):
+                    #                      book_resources.append({'name': probe_file, 'url': probe_url})
+                    #     except: pass
 
-                    if book_resources:
-                        book['resources'] = book_resources
-                        logger.info(f"Found {len(book_resources)} total resources.")
+                    # 2. Try Standard Directory Listing (in case it works for some books)
+                    try:
+                        resp = self._metadata_get(scan_url, timeout=min(5, remaining), accept=_is_listing)
+                    except Exception as e:
+                        if time.monotonic() >= deadline:
+                            # Cut off by this book's time budget: says nothing about the listing
+                            logger.warning(f"Resource scan for {book.get('title')} timed out, keeping what was found")
+                            book['resources_partial'] = True
+                            break
+                        logger.info(f"Scan failed for {scan_url}: {e}")
+                        self.resolver.record(kind, scan_url, False, book_id=book.get('id'))
+                        # A network error says nothing about the listing either
+                        book['resources_partial'] = True
+                        continue
+                    listed = resp.status_code == 200 and "Server Error" not in resp.text
+                    self.resolver.record(kind, scan_url, listed, book_id=book.get('id'))
+                    if resp.status_code == 200:
+                        raw_html = resp.text
+                        # Only parse if it looks like a directory listing
+                        if "Server Error" not in raw_html:
+                            links = re.findall(r'href=["\']([^"\']+)["\']', raw_html)
+                            logger.info(f"Directory listing active. Links found: {len(links)}")
+                            
+                            for link in links:
+                                if link == "../" or link.endswith("/"): continue
+                                if link.startswith("?"): continue
+                                
+                                # Clean filename
+                                name = link
+                                url = scan_url.rstrip('/') + '/' + link
+                                
+                                # Filter
+                                if name.lower().endswith(('.zip', '.pdf', '.docx', '.pptx', '.xlsx')):
+                                    if not any(r['url'] == url for r in book_resources):
+                                        book_resources.append({'name': name, 'url': url})
+                                        logger.info(f"-> ACCEPTED: {name}")
                     else:
-                        logger.info("No valid resource files found.")
-                except Exception as e:
-                    logger.warning(f"Failed to check resources for {book.get('title')}: {e}")
+                         logger.info(f"Scan failed {resp.status_code} for {scan_url}")
+            except Exception as e:
+                logger.warning(f"Failed to check resources for {book.get('title')}: {e}")
+                book['resources_partial'] = True
+
+            # Set even when empty: the key marks the book as scanned
+            book['resources'] = book_resources
+            if book_resources:
+                logger.info(f"Found {len(book_resources)} total resources for {book.get('title')}.")
+            else:
+                logger.info(f"No valid resource files found for {book.get('title')}.")
 
-    def _fetch_enrichments(self, book):
+    def _fetch_enrichments(self, book, timeout=10):
         """
         Fetches enrichments.json from the book's source directory manifest.
         Reverse-engineered from catalog.min.js
@@ -254,7 +479,7 @@ class CambridgeAPI:
             manifest_url = f"{base}{doc_dir}/enrichments.json"
             logger.info(f"Fetching enrichment manifest: {manifest_url}")
             
-            response = self.session.get(manifest_url, timeout=10)
+            response = self._metadata_get(manifest_url, timeout=timeout, accept=_is_json)
             if response.status_code == 200:
                 text = response.text.lstrip('\ufeff')
                 data = json.loads(text)
@@ -316,108 +541,567 @@ class CambridgeAPI:
                 return resources
             else:
                 logger.info(f"No enrichment manifest found (HTTP {response.status_code})")
+                if response.status_code >= 500 or response.status_code == 429:
+                    # Temporary: discover again next time instead of trusting an empty result
+                    book['resources_partial'] = True
                 return []
                 
         except Exception as e:
             logger.warning(f"Error fetching enrichments: {e}")
+            book['resources_partial'] = True
             return []
 
-    def download_book(self, book_metadata, output_dir, progress_callback=None):
+    def download_book(self, book_metadata, output_dir, progress_callback=None, refresh=False):
         """
         Downloads a book using Direct EPUB URL (Preferred) or S3 Reconstruction (Fallback).
         Also downloads supplemental resources.
+        refresh=True revalidates a previous download instead of re-mirroring it.
+        Progress is reported in bytes to self.progress; progress_callback(percent)
+        receives the same coalesced stream for this book.
         """
+        book_id = book_metadata.get('id')
+        self.progress.start_book(book_id, book_metadata.get('title'))
+        def relay(snapshot):
+            book = snapshot['books'].get(book_id)
+            if book and book['state'] == 'running':
+                progress_callback(book['percent'])
+        if progress_callback: self.progress.subscribe(relay)
+        success = False
+        try:
+            success = self._download_book(book_metadata, output_dir, progress_callback, refresh)
+            return success
+        finally:
+            if progress_callback: self.progress.unsubscribe(relay)
+            self.progress.finish_book(book_id, success)
+
+    def _download_book(self, book_metadata, output_dir, progress_callback=None, refresh=False):
         title = book_metadata.get('title', 'Unknown Book')
         safe_title = "".join([c for c in title if c.isalpha() or c.isdigit() or c==' ']).strip()
         epub_path = os.path.join(output_dir, f"{safe_title}.epub")
+        book_id = book_metadata.get('id')
         
         logger.info(f"Starting download for: {title}")
+        # Filled in below with whatever could not be fetched (read by callers)
+        book_metadata['missing_assets'] = []
+        book_metadata['missing_resources'] = []
+        # Resources still pending are discovered while the book itself downloads
+        self.prefetch_resources([book_metadata], HIGH)
         
         # 1. Use Reconstruction (Asset Mirroring)
         # Direct download_url provides an obfuscated blob (custom Cambridge format), not a valid EPUB.
         # We must reconstruct from unencrypted S3 assets.
         logger.info("Starting Download (Reconstructing from S3 assets)...")
-        success = self._download_via_reconstruction(book_metadata, output_dir, progress_callback)
+        success = self._download_via_reconstruction(book_metadata, output_dir, refresh)
         if not success:
              return False
+        # Archive written but some items may have been refused for good (404/403): keep going
 
         # 3. Download Resources (Answer Keys)
-        resources = book_metadata.get('resources', [])
+        resources = self.resolve_resources(book_metadata)
+        self.progress.expect(book_id, 'resource', len(resources))
         if resources:
             logger.info(f"Downloading {len(resources)} separate resources...")
             res_dir = os.path.join(output_dir, f"{safe_title}_Resources")
             if not os.path.exists(res_dir):
                 os.makedirs(res_dir)
                 
-            for i, res in enumerate(resources):
-                try:
-                    r_path = os.path.join(res_dir, res['name'])
-                    
-                    # Logic: Try primary URL first. If fails, try alt_url.
-                    urls_to_try = [res['url']]
-                    if res.get('alt_url'):
-                        urls_to_try.append(res.get('alt_url'))
-                        
-                    download_success = False
-                    
-                    for url_candidate in urls_to_try:
-                        if download_success: break
-                        
-                        try:
-                            # Use stream to check headers first
-                            with self.session.get(url_candidate, stream=True, timeout=30) as r:
-                                if r.status_code == 200:
-                                    # VALIDATION: Check for "Fake" Zip/PDF (Redirect to Book EPUB or HTML Error)
-                                    
-                                    # Check 1: Content-Type header
-                                    ctype = r.headers.get('Content-Type', '').lower()
-                                    if 'html' in ctype:
-                                         logger.warning(f"Skipping candidate {url_candidate}: Content-Type is html (likely error page)")
-                                         continue
-                                    if 'epub' in ctype:
-                                         logger.warning(f"Skipping candidate {url_candidate}: Content-Type is epub (likely book redirect)")
-                                         continue
-                                    
-                                    # Read first chunk to check headers/content
-                                    chunk_iter = r.iter_content(chunk_size=1024)
-                                    first_chunk = next(chunk_iter, None)
-                                    
-                                    if not first_chunk:
-                                        logger.warning(f"Empty resource: {res['name']}")
-                                        continue
-
-                                    # Check 2: Content Sniffing
-                                    if b'<!DOCTYPE html>' in first_chunk or b'<html' in first_chunk:
-                                        logger.warning(f"Skipping candidate {url_candidate}: HTML content detected")
-                                        continue
-                                    if b'mimetypeapplication/epub+zip' in first_chunk:
-                                        logger.warning(f"Skipping candidate {url_candidate}: EPUB signature detected")
-                                        continue
-                                        
-                                    # If Valid, write chunk and continue
-                                    with open(r_path, 'wb') as f:
-                                        f.write(first_chunk)
-                                        for chunk in chunk_iter:
-                                            f.write(chunk)
-                                            
-                                    logger.info(f"Downloaded resource to: {r_path}")
-                                    download_success = True
-                                else:
-                                    logger.warning(f"Resource request failed {r.status_code} for {url_candidate}")
-                        except Exception as e:
-                            logger.warning(f"Error downloading {url_candidate}: {e}")
-                            
-                    if not download_success:
-                        logger.error(f"Failed to download resource {res['name']} after trying all candidates.")
-
-                except Exception as e:
-                    logger.error(f"Failed to download resource {res['name']}: {e}")
+            # Bounded pool: each resource races its url against alt_url (see _download_resource).
+            # Resources sharing a file name run one after another (same target file, last one wins).
+            by_name = {}
+            for res in resources:
+                by_name.setdefault(res['name'], []).append(res)
+            # Validators of the resource files are kept in the book's sidecar for the next refresh
+            sidecar = ArchiveSidecar.load(epub_path) or ArchiveSidecar(epub_path, book_id, book_metadata.get('src_url'))
+            run_group = lambda group: [self._download_resource(book_id, res, res_dir, sidecar, refresh) for res in group]
+            with ThreadPoolExecutor(max_workers=self.RESOURCE_WORKERS) as executor:
+                futures = {name: executor.submit(run_group, group) for name, group in by_name.items()}
+                for name, future in futures.items():
+                    try:
+                        ok = all(future.result())
+                    except Exception as e:
+                        logger.error(f"Failed to download resource {name}: {e}")
+                        ok = False
+                    if not ok:
+                        book_metadata['missing_resources'].append(name)
+            self.resolver.save()
+            try:
+                sidecar.save()
+            except OSError as e:
+                logger.warning(f"Could not save resource validators for {title}: {e}")
                     
         if progress_callback: progress_callback(100)
+        return not (book_metadata['missing_assets'] or book_metadata['missing_resources'])
+
+    def _download_resource(self, book_id, res, res_dir, sidecar=None, refresh=False):
+        """
+        Downloads one resource. Returns True on success.
+        Its URL and ETag/Last-Modified go into sidecar.resources; with refresh=True the file
+        already on disk is revalidated with a conditional GET and kept if it is unchanged.
+        Hedged: the primary url starts first; alt_url starts as soon as the primary fails,
+        or after RESOURCE_HEDGE_DELAY if the primary has not delivered a valid first chunk.
+        The first candidate to write a byte wins and the other is cancelled (its partial
+        file removed). A winner that breaks off midway falls back to the other candidate.
+        """
+        r_path = os.path.join(res_dir, res['name'])
+        kinds = {res['url']: 'resource:url'}
+        if res.get('alt_url') and res['alt_url'] != res['url']:
+            kinds[res['alt_url']] = 'resource:alt_url'
+        # The pattern that has worked most often for this host goes first
+        candidates = [url for _, url in self.resolver.order([(k, u) for u, k in kinds.items()])]
+        # Only the URL the file on disk came from is asked whether it changed
+        known = sidecar.resources.get(res['name']) if sidecar and refresh and os.path.exists(r_path) else None
+        conditional = {}
+        if known and known.get('url') in candidates:
+            if known.get('etag'): conditional['If-None-Match'] = known['etag']
+            if known.get('last_modified'): conditional['If-Modified-Since'] = known['last_modified']
+        revalidated = known['url'] if conditional else None
+        # Each candidate gets its own target so the two never share a .part file
+        # (the one being revalidated writes over the file it may keep)
+        primary = revalidated or candidates[0]
+        targets = {url: r_path if url == primary else f"{r_path}.alt{i}" for i, url in enumerate(candidates)}
+        metas = {url: {} for url in candidates}
+        token = self.progress.transfer_started(book_id, 'resource')
+        race = {'winner': None}
+        results = {}
+        lock = threading.Lock()
+        decided = threading.Event()
+
+        def attempt(url):
+            def on_progress(nbytes, total, cached=False):
+                with lock:
+                    if race['winner'] is None:
+                        race['winner'] = url
+                        decided.set()
+                if race['winner'] != url:
+                    raise TransferCancelled(url)
+                self.progress.transfer_bytes(token, nbytes, total, cached)
+
+            def validate(r, first_chunk):
+                # A candidate arriving after the race is decided is not even validated: it is
+                # cancelled (not failed), so it is neither counted against its URL pattern
+                # nor excluded from the retry if the winner breaks off
+                if race['winner'] not in (None, url): raise TransferCancelled(url)
+                return self._validate_resource(r, first_chunk, url, res['name'])
+
+            try:
+                with self._transfer_slot():
+                    results[url] = self.downloader.download(url, targets[url], validate, on_progress,
+                                                            conditional if url == revalidated else None, metas[url])
+            except TransferCancelled:
+                results[url] = 'cancelled'
+            except Exception as e:
+                logger.warning(f"Error downloading {url}: {e}")
+                results[url] = False
+            finally:
+                if url == candidates[0]: decided.set()
+            if results[url] != 'cancelled':
+                self.resolver.record(kinds[url], url, results[url], remember_url=False, book_id=book_id)
+
+        def finish(url):
+            meta = metas[url]
+            if sidecar is not None:
+                sidecar.record_resource(res['name'], url, meta.get('etag'), meta.get('last_modified'),
+                                        os.path.getsize(targets[url]))
+            if meta.get('not_modified'):
+                logger.info(f"Resource unchanged, kept: {r_path}")
+                return True
+            return self._finish_resource(targets[url], r_path)
+
+        try:
+            hedge = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="resource-hedge")
+            try:
+                futures = {candidates[0]: hedge.submit(attempt, candidates[0])}
+                if len(candidates) > 1:
+                    decided.wait(self.RESOURCE_HEDGE_DELAY)
+                    if race['winner'] is None:
+                        if not futures[candidates[0]].done():
+                            logger.info(f"{res['name']}: no data from primary after {self.RESOURCE_HEDGE_DELAY}s, racing alt_url")
+                        futures[candidates[1]] = hedge.submit(attempt, candidates[1])
+                # Wait for the winner only: the loser is abandoned at its next chunk
+                while True:
+                    winner = race['winner']
+                    if winner is not None and futures[winner].done(): break
+                    pending = [f for f in futures.values() if not f.done()]
+                    if not pending: break
+                    wait(pending, return_when=FIRST_COMPLETED)
+
+                # A zero-byte body never reports progress, so it cannot claim the race
+                winner = race['winner'] or next((u for u in candidates if results.get(u) is True), None)
+                if winner and results.get(winner) is True:
+                    return finish(winner)
+                # Winner broke off (or everyone failed): retry candidates that were cancelled or never started
+                wait(futures.values())
+            finally:
+                hedge.shutdown(wait=False)
+            for url in candidates:
+                if url in futures and results.get(url) != 'cancelled': continue
+                race['winner'] = None
+                attempt(url)
+                if results.get(url) is True:
+                    return finish(url)
+            logger.error(f"Failed to download resource {res['name']} after trying all candidates.")
+            return False
+        finally:
+            self.progress.transfer_done(token)
+
+    def _finish_resource(self, target, r_path):
+        if target != r_path:
+            os.replace(target, r_path)
+        logger.info(f"Downloaded resource to: {r_path}")
         return True
 
-    def _download_via_reconstruction(self, book_metadata, output_dir, progress_callback=None):
-        """Original logic for reconstructing from OPF/assets."""
+    def _validate_resource(self, r, first_chunk, url_candidate, name):
+        """
+        VALIDATION: Check for "Fake" Zip/PDF (Redirect to Book EPUB or HTML Error).
+        Called with the response and its first chunk before anything is written.
+        """
+        if not first_chunk:
+            logger.warning(f"Empty resource: {name}")
+            return False
+        # Resources are downloads, never pages: unknown extensions get the generic binary checks
+        media_type = None if self.validators.kind_for(name) else 'application/octet-stream'
+        reason = self.validators.check(name, first_chunk, media_type, r.headers.get('Content-Type'))
+        if reason:
+            logger.warning(f"Skipping candidate {url_candidate}: {reason}")
+            return False
+        return True
+
+    def _http_get(self, url, headers=None, timeout=20, reader=None, validate=None):
+        """
+        GET through the async transport when enabled, otherwise the blocking session.
+        With a BodyReader the body is streamed (byte budget, large bodies spooled to disk)
+        and validate(headers, head) can reject it after its first bytes (response.rejected).
+        """
+        if self.transport:
+            return self.transport.submit(url, headers, timeout, reader, validate).result()
+        return fetch_sync(self.session, url, headers, timeout, reader, validate)
+
+    def _metadata_get(self, url, timeout=20, accept=None):
+        """
+        GET of a small metadata document through the HTTP cache (see HttpCache).
+        accept(response) -> bool: only bodies it accepts are cached.
+        """
+        return self.http_cache.get(url, lambda headers: self._http_get(url, headers=headers, timeout=timeout), accept)
+
+    def _transfer_slot(self):
+        """Budget slot for a long streaming transfer (no-op without the async transport)."""
+        return self.transport.slot() if self.transport else nullcontext()
+
+    def enable_async_transport(self, max_in_flight=256):
+        """
+        Routes OPF, asset, enrichment, cover and listing fetches through one AsyncTransport.
+        All books downloaded by this client then share a single in-flight request budget.
+        """
+        if self.transport is None:
+            self.transport = AsyncTransport(self.session, max_in_flight)
+        return self.transport
+
+    def _asset_results(self, hrefs, opf_dir_url, local_asset, key=None, validate_for=None):
+        """
+        Fetches hrefs and yields (href, body, meta) on the calling thread, which is the
+        only ZIP writer. local_asset(href) resolves journal/store hits before any network.
+        Thread mode: blocking workers gated by the AIMD window, bounded queue.
+        Async mode: one feeder thread hands network misses to the shared event loop;
+        each fetch future is settled here. On failure meta carries status/error/retry_after.
+        key identifies the book when several share the AIMD window (fair share per key).
+        The caller may append to hrefs while iterating (discovered references); new
+        entries are queued behind the current ones and yielded as well.
+        validate_for(href) -> validate(headers, head) checks each fetched body as it streams in.
+        """
+        results = queue.Queue() if self.transport else queue.Queue(maxsize=self.concurrency.maximum * 2)
+        cancelled = threading.Event()
+        # Orders put() against cancellation so nothing holding budget is queued after the final drain
+        lock = threading.Lock()
+
+        def discard(item):
+            """Frees what an unconsumed result holds (AIMD slot, memory budget, spool file)."""
+            href, body, meta, pending = item
+            self.byte_budget.release(meta.get('held', 0))
+            self._unpin(body)
+            if meta.get('progress'):
+                self.progress.transfer_done(meta['progress'])
+            if pending:
+                future, _, _, _, (started, finished), token, _ = pending
+                self.progress.transfer_done(token)
+                self.concurrency.release(None, key=key)
+                r = future.result() if not future.exception() else None
+                if r is not None:
+                    self.byte_budget.release(getattr(r, 'held', 0))
+                    if getattr(r, 'spool', None):
+                        self._remove_spool(r.spool[0])
+
+        def put(item):
+            # Never block forever on a writer that has gone away
+            while True:
+                with lock:
+                    if cancelled.is_set():
+                        discard(item)
+                        return
+                    try:
+                        results.put_nowait(item)
+                        return
+                    except queue.Full:
+                        pass
+                time.sleep(0.05)
+
+        def hold_local(body, meta):
+            # Store/journal hits are in memory too: they count against the byte budget
+            if isinstance(body, bytes):
+                self.byte_budget.acquire(len(body))
+                meta['held'] = len(body)
+
+        def download_asset(href):
+            body, meta, token = None, {}, None
+            try:
+                asset_url, validators, body, meta = local_asset(href)
+                hold_local(body, meta)
+                if body is None and not meta.get('not_modified'):
+                    headers, peer = self._asset_request(asset_url, validators)
+                    # The AIMD window decides how many of the workers may be on the network
+                    self.concurrency.acquire(key)
+                    token, reader = self._asset_progress(key)
+                    started = time.monotonic()
+                    try:
+                        r = self._http_get(asset_url, headers=headers, timeout=20, reader=reader,
+                                           validate=validate_for(href) if validate_for else None)
+                    except Exception:
+                        self.concurrency.release(time.monotonic() - started, error=True, key=key)
+                        raise
+                    self._report_fetch(r, started, time.monotonic(), key)
+                    body, meta = self._settle_response(asset_url, r, validators, peer, reader)
+            except Exception as e:
+                body, meta = None, {'error': str(e) or type(e).__name__}
+            if token:
+                meta['progress'] = token
+            put((href, body, meta, None))
+
+        def feed_async(batch):
+            for href in batch:
+                if cancelled.is_set(): return
+                token = None
+                try:
+                    asset_url, validators, body, meta = local_asset(href)
+                    if body is not None or meta.get('not_modified'):
+                        hold_local(body, meta)
+                        put((href, body, meta, None))
+                        continue
+                    headers, peer = self._asset_request(asset_url, validators)
+                    # Slot is held until the writer consumes the body (bounds buffered bodies too)
+                    self.concurrency.acquire(key)
+                    token, reader = self._asset_progress(key)
+                    timing = [time.monotonic(), None]
+                    future = self.transport.submit(asset_url, headers, 20, reader,
+                                                   validate_for(href) if validate_for else None)
+                    pending = (future, asset_url, validators, peer, timing, token, reader)
+                    def on_done(f, h=href, p=pending):
+                        p[4][1] = time.monotonic()
+                        with lock:
+                            if not cancelled.is_set():
+                                results.put((h, None, {}, p))
+                                return
+                        discard((h, None, {}, p))
+                    future.add_done_callback(on_done)
+                except Exception as e:
+                    put((href, None, {'error': str(e) or type(e).__name__, 'progress': token}, None))
+
+        executor = ThreadPoolExecutor(max_workers=1 if self.transport else self.concurrency.maximum)
+        submitted = 0
+
+        def submit_new():
+            nonlocal submitted
+            batch = hrefs[submitted:]
+            submitted += len(batch)
+            if not batch: return
+            if self.transport:
+                executor.submit(feed_async, batch)
+            else:
+                for href in batch:
+                    executor.submit(download_asset, href)
+
+        try:
+            submit_new()
+            received = 0
+            while received < len(hrefs):
+                href, body, meta, pending = results.get()
+                received += 1
+                if pending:
+                    future, asset_url, validators, peer, (started, finished), token, reader = pending
+                    try:
+                        r = future.result()
+                    except Exception as e:
+                        self.concurrency.release(finished - started, error=True, key=key)
+                        r, meta = None, {'error': str(e) or type(e).__name__}
+                    if r is not None:
+                        self._report_fetch(r, started, finished, key)
+                        body, meta = self._settle_response(asset_url, r, validators, peer, reader)
+                    meta['progress'] = token
+                try:
+                    yield href, body, meta
+                finally:
+                    # The writer has packaged the body (or failed on it): its memory is free again
+                    self.byte_budget.release(meta.get('held', 0))
+                    self._unpin(body)
+                submit_new()
+        finally:
+            with lock:
+                cancelled.set()
+            while True:
+                try:
+                    discard(results.get_nowait())
+                except queue.Empty:
+                    break
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _settle_response(self, asset_url, r, validators=None, peer=None, reader=None):
+        """_settle_asset that never raises; meta['held'] is the body's byte-budget reservation."""
+        held = getattr(r, 'held', 0)
+        try:
+            body, meta = self._settle_asset(asset_url, r, validators, peer, reader)
+        except Exception as e:
+            self.byte_budget.release(held)
+            if getattr(r, 'spool', None):
+                self._remove_spool(r.spool[0])
+            return None, {'error': str(e) or type(e).__name__}
+        meta['held'] = held + meta.get('held', 0)
+        return body, meta
+
+    @staticmethod
+    def _remove_spool(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _report_fetch(self, r, started, finished, key=None):
+        """Feeds one completed fetch (latency, size, status, Retry-After) to the AIMD controller."""
+        retry_after = None
+        if r.status_code in (429, 503):
+            retry_after = AdaptiveConcurrency.parse_retry_after(r.headers.get('Retry-After'))
+        nbytes = r.size if hasattr(r, 'size') else len(r.content or b'')
+        self.concurrency.release(finished - started, nbytes, r.status_code, retry_after=retry_after, key=key)
+
+    def _asset_progress(self, book_id):
+        """Progress token for one asset fetch, and a body reader reporting each chunk to it."""
+        token = self.progress.transfer_started(book_id, 'asset')
+        return token, self.body_reader.reporting(lambda n, total: self.progress.transfer_bytes(token, n, total))
+
+    def _cached_asset(self, asset_url, validators=None):
+        """Store lookup (no network). Returns (body, meta); body is None on a miss."""
+        meta = {'etag': None, 'last_modified': None, 'not_modified': False, 'sha256': None}
+        if not validators:
+            entry = self.store.entry(asset_url)
+            if entry:
+                body = self.store.load(entry[0], self.STREAM_THRESHOLD)
+                if body is not None:
+                    meta['sha256'], meta['etag'], meta['last_modified'] = entry
+                    meta['cached'] = True
+                    return body, meta
+        return None, meta
+
+    def _asset_request(self, asset_url, validators=None):
+        """Request headers for an asset fetch, plus the (hash, etag) peer used for If-None-Match."""
+        headers = dict(validators or {})
+        peer = None if validators else self.store.lookup_peer(asset_url)
+        if peer:
+            headers['If-None-Match'] = peer[1]
+        return headers, peer
+
+    def _settle_asset(self, asset_url, r, validators=None, peer=None, reader=None):
+        """Turns an asset response into (body, meta), storing new bodies in the asset store."""
+        meta = {'etag': None, 'last_modified': None, 'not_modified': False, 'sha256': None}
+        meta['etag'] = r.headers.get('ETag') or (validators or {}).get('If-None-Match')
+        meta['last_modified'] = r.headers.get('Last-Modified') or (validators or {}).get('If-Modified-Since')
+        if r.status_code == 304 and validators:
+            meta['not_modified'] = True
+            return None, meta
+        if r.status_code == 304 and peer:
+            body = self.store.load(peer[0], self.STREAM_THRESHOLD)
+            if body is not None:
+                meta['sha256'], meta['etag'] = peer
+                meta['cached'] = True
+                if isinstance(body, bytes):
+                    # The stored blob is in memory now: count its actual size
+                    self.byte_budget.hold(len(body))
+                    meta['held'] = len(body)
+                self.store.link(asset_url, peer[0], peer[1], meta['last_modified'])
+                return body, meta
+            # Blob evicted under us: fetch unconditionally
+            r = self._http_get(asset_url, timeout=20, reader=reader or self.body_reader)
+            meta['held'] = getattr(r, 'held', 0)
+            meta['etag'], meta['last_modified'] = r.headers.get('ETag'), r.headers.get('Last-Modified')
+        if r.status_code != 200:
+            meta['status'] = r.status_code
+            meta['retry_after'] = AdaptiveConcurrency.parse_retry_after(r.headers.get('Retry-After'))
+            return None, meta
+        if getattr(r, 'rejected', None):
+            # Error page (or wrong file) served with a 200: not retried, reported as missing
+            logger.warning(f"Rejected {asset_url}: {r.rejected}")
+            meta['status'] = r.status_code
+            meta['error'] = f"invalid content: {r.rejected}"
+            return None, meta
+        if getattr(r, 'spool', None):
+            # Large body already streamed to disk (and hashed): move it into the store
+            path, size, digest = r.spool
+            # Pinned before it is indexed, so it cannot be evicted before the writer has packaged it
+            self.store.pin(digest)
+            try:
+                self.store.put_file(asset_url, path, digest, size, meta['etag'], meta['last_modified'])
+            except Exception:
+                self.store.unpin(digest)
+                raise
+            meta['sha256'] = digest
+            return BlobRef(self.store.blob_path(digest), size, digest), meta
+        body = r.content
+        try:
+            meta['sha256'] = self.store.put(asset_url, body, meta['etag'], meta['last_modified'])
+        except Exception as e:
+            logger.warning(f"Asset store write failed for {asset_url}: {e}")
+        return body, meta
+
+    def _unpin(self, body):
+        """Lets the store evict a streamed body's blob again (see AssetStore.load)."""
+        if isinstance(body, BlobRef):
+            self.store.unpin(body.sha256)
+
+    @staticmethod
+    def _sha256(body):
+        """sha256 of bytes or of a streamed body (BlobRef), read in 1 MB blocks."""
+        if isinstance(body, bytes):
+            return hashlib.sha256(body).hexdigest()
+        h = hashlib.sha256()
+        with body.open() as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        return h.hexdigest()
+
+    def _read_journaled(self, record):
+        """
+        Returns (body, meta) for an asset completed by an interrupted run, or (None, None)
+        if its blob is gone or does not hash to the journaled sha256 (never reuse a truncated body).
+        """
+        digest, size = record.get('sha256'), record.get('size')
+        if not digest or not self.store.has(digest, size):
+            return None, None
+        body = self.store.load(digest, self.STREAM_THRESHOLD)
+        if body is None: return None, None
+        if self._sha256(body) != digest:
+            logger.warning(f"Journaled asset failed its hash check, refetching: {record.get('url')}")
+            self._unpin(body)
+            self.store.discard(digest)
+            return None, None
+        return body, {'etag': record.get('etag'), 'last_modified': record.get('last_modified'),
+                      'not_modified': False, 'sha256': digest, 'cached': True}
+
+    def _download_via_reconstruction(self, book_metadata, output_dir, refresh=False):
+        """
+        Reconstructs the EPUB from the OPF and its manifest assets.
+        Worker threads hand finished asset bodies to a single ZIP writer; nothing is staged on disk.
+        With refresh=True and a previous download (EPUB + sidecar) present, every asset is
+        revalidated with a conditional GET and unchanged entries are copied from the old archive.
+        Progress is journaled per asset, so a job killed midway resumes with only the missing assets.
+        Failed assets are retried with backoff (RetryPolicy); book_metadata['missing_assets'] lists
+        what is still missing. Transient failures leave no EPUB (the journal is kept for resume).
+        """
         title = book_metadata.get('title', 'Unknown Book')
         safe_title = "".join([c for c in title if c.isalpha() or c.isdigit() or c==' ']).strip()
         epub_path = os.path.join(output_dir, f"{safe_title}.epub")
@@ -427,140 +1111,186 @@ class CambridgeAPI:
         
         if not src_base_url or not opf_rel_path: return False
 
-        temp_dir = os.path.join(output_dir, "temp_" + safe_title)
-        if not os.path.exists(temp_dir): os.makedirs(temp_dir)
+        previous = ArchiveSidecar.load(epub_path) if refresh and os.path.exists(epub_path) else None
+        old_zip = None
+        sidecar = ArchiveSidecar(epub_path, book_metadata.get('id'), src_base_url)
+        # Resource files live outside the archive: their validators outlive the rebuild
+        earlier = previous or ArchiveSidecar.load(epub_path)
+        if earlier: sidecar.resources = earlier.resources
+        journal = JobJournal(epub_path)
 
         try:
+            journal.open(book_metadata.get('id'), src_base_url)
+            if previous:
+                old_zip = zipfile.ZipFile(epub_path)
+                logger.info(f"Refreshing {title} against previous download ({len(previous.entries)} entries)")
+
             # 1. OPF
             opf_url = src_base_url + opf_rel_path
-            opf_resp = self.session.get(opf_url)
+            opf_resp = self._metadata_get(opf_url, timeout=30, accept=_is_opf)
             if opf_resp.status_code != 200: return False
+            opf_bytes = opf_resp.content
             
             local_opf_rel = opf_rel_path.lstrip('/')
-            local_opf_path = os.path.join(temp_dir, local_opf_rel)
-            os.makedirs(os.path.dirname(local_opf_path), exist_ok=True)
-            with open(local_opf_path, "wb") as f: f.write(opf_resp.content)
+            opf_dir = posixpath.dirname(local_opf_rel.replace("\\", "/"))
             
-            # 2. Parse
-            root = ET.fromstring(opf_resp.content)
-            manifest_items = []
-            for elem in root.iter():
-                if 'manifest' in elem.tag:
-                    for item in elem:
-                        if 'href' in item.attrib:
-                            manifest_items.append(item.attrib['href'])
-                    break
+            # 2. Parse (once; the model drives scheduling, compression and cover injection)
+            opf = OpfPackage.parse(opf_bytes)
+            manifest_items = opf.fetch_order()
             
             total_items = len(manifest_items)
-            opf_dir_url = src_base_url + "/" + os.path.dirname(local_opf_rel).replace("\\", "/")
+            self.progress.expect(book_metadata.get('id'), 'asset', total_items)
+            opf_dir_url = src_base_url + "/" + opf_dir
             
-            # 3. Download Assets
-            def download_asset(href):
-                try:
+            with EpubPackager(epub_path) as packager:
+                # 3. Download Assets
+                old_names = set(old_zip.namelist()) if old_zip else set()
+
+                def local_asset(href):
+                    """Journal and asset-store lookups. Returns (url, validators, body, meta)."""
                     asset_url = f"{opf_dir_url}/{href}"
-                    local_asset_path = os.path.join(temp_dir, os.path.dirname(local_opf_rel), href)
-                    os.makedirs(os.path.dirname(local_asset_path), exist_ok=True)
-                    if os.path.exists(local_asset_path): return True
-                    r = self.session.get(asset_url, timeout=20)
-                    if r.status_code == 200:
-                        with open(local_asset_path, "wb") as f: f.write(r.content)
-                        return True
-                    return False
-                except: return False
-
-            completed = 0
-            with ThreadPoolExecutor(max_workers=10) as executor:
-                futures = {executor.submit(download_asset, item): item for item in manifest_items}
-                for future in as_completed(futures):
-                    completed += 1
-                    if progress_callback: progress_callback((completed / total_items) * 90)
-
-            # 3b. INJECT COVER IMAGE
-            # Download the high-res cover from metadata and inject it into the EPUB
-            cover_url = book_metadata.get('cover')
-            if cover_url:
-                try:
-                    logger.info("Injecting Cover Image...")
-                    cover_resp = self.session.get(cover_url, timeout=10)
-                    if cover_resp.status_code == 200:
-                        # Save to OEBPS/cover.jpg (or same dir as OPF)
-                        opf_dir = os.path.dirname(local_opf_path)
-                        cover_filename = "cover.jpg"
-                        cover_path = os.path.join(opf_dir, cover_filename)
-                        
-                        with open(cover_path, "wb") as f:
-                            f.write(cover_resp.content)
-                            
-                        # Update OPF XML
-                        # 1. Add item to manifest
-                        # 2. Add meta to metadata
-                        ns = {'opf': 'http://www.idpf.org/2007/opf'}
-                        ET.register_namespace('', ns['opf'])
-                        
-                        # We need to parse again or reuse 'root'
-                        # Let's re-parse to be safe with namespaces
-                        tree = ET.parse(local_opf_path)
-                        root = tree.getroot()
-                        
-                        # Find Manifest
-                        manifest = root.find('{http://www.idpf.org/2007/opf}manifest')
-                        metadata = root.find('{http://www.idpf.org/2007/opf}metadata')
-                        
-                        if manifest is not None and metadata is not None:
-                            # Check if item exists, if not add it
-                            cover_id = "cover-image-injected"
-                            
-                            # Add item
-                            item = ET.Element('{http://www.idpf.org/2007/opf}item', {
-                                'id': cover_id,
-                                'href': cover_filename,
-                                'media-type': 'image/jpeg'
-                            })
-                            manifest.append(item)
-                            
-                            # Update/Add Meta
-                            # Remove existing cover meta if any to avoid conflict?
-                            # Or just add ours.
-                            meta = ET.Element('{http://www.idpf.org/2007/opf}meta', {
-                                'name': 'cover',
-                                'content': cover_id
-                            })
-                            metadata.append(meta)
-                            
-                            tree.write(local_opf_path, encoding='UTF-8', xml_declaration=True)
-                            logger.info("Cover injected into OPF.")
-                except Exception as e:
-                    logger.warning(f"Failed to inject cover: {e}")
+                    name = posixpath.normpath(posixpath.join(opf_dir, href))
+                    validators = previous.validators(name) if previous and name in old_names else None
+                    body, meta = None, {}
+                    record = journal.completed.get(asset_url)
+                    if record:
+                        body, meta = self._read_journaled(record)
+                    if body is None:
+                        body, meta = self._cached_asset(asset_url, validators)
+                    return asset_url, validators, body, meta
 
-            # 4. Valid EPUB Gen (Mimetype + Container)
-            mimetype_path = os.path.join(temp_dir, "mimetype")
-            with open(mimetype_path, "w", encoding="utf-8") as f: f.write("application/epub+zip")
-                
-            meta_inf_dir = os.path.join(temp_dir, "META-INF")
-            os.makedirs(meta_inf_dir, exist_ok=True)
-            container_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
-<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
-    <rootfiles>
-        <rootfile full-path="{local_opf_rel.replace(os.path.sep, '/')}" media-type="application/oebps-package+xml"/>
-    </rootfiles>
-</container>"""
-            with open(os.path.join(meta_inf_dir, "container.xml"), "w", encoding="utf-8") as f: f.write(container_xml)
-
-            # 5. Zip
-            with zipfile.ZipFile(epub_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                zf.write(mimetype_path, "mimetype", compress_type=zipfile.ZIP_STORED)
-                for root_dir, _, files in os.walk(temp_dir):
-                    for file in files:
-                        if file == "mimetype": continue
-                        full = os.path.join(root_dir, file)
-                        zf.write(full, os.path.relpath(full, temp_dir))
-            
-            try:
-                import shutil
-                shutil.rmtree(temp_dir)
-            except: pass
-            
+                reused = 0
+                failures = {}
+                manifest_set = set(manifest_items)
+                # Resources the content refers to but the manifest omits are fetched in the same run
+                scanner = ReferenceScanner(opf_dir_url, manifest_items)
+                discovered = []
+                # Bodies are checked against their media-type as they stream in (error pages served as 200)
+                validate_for = lambda href: self.validators.for_body(href, opf.media_type(href))
+                pending_hrefs = list(manifest_items)
+                for attempt in range(1, self.retry_policy.max_attempts + 1):
+                    if attempt > 1:
+                        # Re-queue only the failed assets that are worth another try
+                        retryable = [h for h in pending_hrefs if self.retry_policy.is_retryable(**failures[h])]
+                        if not retryable: break
+                        delay = self.retry_policy.delay(attempt - 1, max((failures[h].get('retry_after') or 0) for h in retryable))
+                        logger.info(f"Retrying {len(retryable)} failed assets in {delay:.1f}s (attempt {attempt}/{self.retry_policy.max_attempts})")
+                        time.sleep(delay)
+                        pending_hrefs = retryable
+
+                    failed_now = []
+                    for href, body, meta in self._asset_results(pending_hrefs, opf_dir_url, local_asset,
+                                                                book_metadata.get('id'), validate_for):
+                        media_type = opf.media_type(href) or mimetypes.guess_type(href)[0]
+                        name = posixpath.normpath(posixpath.join(opf_dir, href))
+                        # Network fetches report their bytes as they stream in (see _asset_progress)
+                        token = meta.get('progress')
+                        if body is None and meta.get('not_modified'):
+                            body = ZipEntryRef(old_zip, name)
+                            if len(body) <= self.STREAM_THRESHOLD:
+                                body = old_zip.read(name)
+                            meta['cached'] = True
+                            reused += 1
+                        if body is None:
+                            if token:
+                                self.progress.transfer_done(token)
+                                # Still expected: a retry takes it again
+                                self.progress.expect(book_metadata.get('id'), 'asset', 1)
+                            failures[href] = {'status': meta.get('status'), 'error': meta.get('error'),
+                                              'retry_after': meta.get('retry_after')}
+                            failed_now.append(href)
+                            continue
+                        failures.pop(href, None)
+                        new_refs = scanner.scan(href, body, media_type)
+                        if new_refs:
+                            # Fetched by this same pass (the results iterator picks up appended hrefs)
+                            discovered.extend(new_refs)
+                            pending_hrefs.extend(new_refs)
+                            self.progress.expect(book_metadata.get('id'), 'asset', len(new_refs))
+                        if href not in manifest_set:
+                            # Declare it so the rebuilt EPUB's manifest covers every file it contains
+                            opf.add_item("res-discovered", href, media_type or 'application/octet-stream')
+                        if packager.add(name, body, media_type, meta.get('sha256')):
+                            asset_url = f"{opf_dir_url}/{href}"
+                            sidecar.record(name, asset_url, meta.get('etag'), meta.get('last_modified'), len(body))
+                            if meta.get('sha256') and asset_url not in journal.completed:
+                                journal.record(asset_url, name, len(body), meta['sha256'],
+                                               meta.get('etag'), meta.get('last_modified'))
+                        if token is None:
+                            self.progress.add_transfer(book_metadata.get('id'), 'asset', len(body),
+                                                       cached=meta.get('cached', False))
+                        else:
+                            if meta.get('cached'):
+                                # 304: the body came from the store or the previous EPUB
+                                self.progress.transfer_bytes(token, len(body), cached=True)
+                            self.progress.transfer_done(token)
+                    pending_hrefs = failed_now
+                    if not pending_hrefs: break
+
+                if discovered:
+                    logger.info(f"Found {len(discovered)} resources missing from the manifest, "
+                                f"{len(discovered) - sum(1 for h in failures if h not in manifest_set)} fetched")
+                    lost = [h for h in failures if h not in manifest_set]
+                    if lost:
+                        logger.warning(f"Referenced but not fetched: {lost[:10]}")
+
+                # Completeness: every manifest item must be in the archive (discovered ones are best effort)
+                missing = [{'href': h, **failure} for h, failure in failures.items() if h in manifest_set]
+                book_metadata['missing_assets'] = missing
+                if missing:
+                    transient = [m for m in missing if self.retry_policy.is_retryable(m['status'], m['error'])]
+                    logger.error(f"{len(missing)} of {total_items} assets missing for {title} "
+                                 f"({len(transient)} transient): {[m['href'] for m in missing[:10]]}")
+                    if transient:
+                        # Keep the journal: the next run re-fetches only these assets
+                        raise IncompleteBookError(f"{len(transient)} assets could not be fetched")
+                    sidecar.missing = missing
+                if previous:
+                    # reused counts discovered entries too
+                    logger.info(f"Refresh: {reused} unchanged, {total_items + len(discovered) - reused} fetched")
+
+                # 3b. INJECT COVER IMAGE
+                # Download the high-res cover from metadata and inject it into the EPUB
+                cover_url = book_metadata.get('cover')
+                if cover_url:
+                    try:
+                        logger.info("Injecting Cover Image...")
+                        cover_resp = self._http_get(cover_url, timeout=10)
+                        if cover_resp.status_code == 200:
+                            # Save to OEBPS/cover.jpg (or same dir as OPF)
+                            cover_filename = "cover.jpg"
+                            cover_name = posixpath.join(opf_dir, cover_filename)
+                            if packager.add(cover_name, cover_resp.content, 'image/jpeg'):
+                                sidecar.record(cover_name, cover_url, cover_resp.headers.get('ETag'),
+                                               cover_resp.headers.get('Last-Modified'), len(cover_resp.content))
+                                
+                            # Register it in the OPF model (spliced into the OPF when it is written)
+                            if opf.add_cover(cover_filename):
+                                logger.info("Cover injected into OPF.")
+                    except Exception as e:
+                        logger.warning(f"Failed to inject cover: {e}")
+
+                # 4. Valid EPUB Gen (Container + OPF; mimetype was written first by the packager)
+                packager.add_container(local_opf_rel)
+                opf_bytes = opf.serialize()
+                packager.add(local_opf_rel, opf_bytes, 'application/oebps-package+xml')
+                sidecar.record(local_opf_rel, opf_url, opf_resp.headers.get('ETag'),
+                               opf_resp.headers.get('Last-Modified'), len(opf_bytes))
+                # The old archive must be closed before the new one replaces it
+                if old_zip:
+                    old_zip.close()
+
+            sidecar.integrity = packager.manifest()
+            sidecar.save()
+            journal.finish()
             return True
+        except IncompleteBookError as e:
+            logger.error(f"Reconstruction incomplete, job kept for resume: {e}")
+            return False
         except Exception as e:
             logger.error(f"Reconstruction failed: {e}")
             return False
+        finally:
+            journal.close()
+            if old_zip:
+                old_zip.close()
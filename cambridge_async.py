@@ -0,0 +1,174 @@
+import atexit
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from requests import Request
+from requests.cookies import get_cookie_header
+from requests.structures import CaseInsensitiveDict
+from cambridge_validate import ContentRejected
+
+try:
+    import aiohttp
+except ImportError:  # optional: falls back to the requests session on worker threads
+    aiohttp = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class FetchResponse:
+    """
+    Minimal requests.Response look-alike returned by the aiohttp backend and by
+    streamed (BodyReader) fetches. A large body is not in `content` but in the
+    spool file `spool` = (path, size, sha256); `held` is its ByteBudget reservation.
+    `rejected` is the validator's reason when the body was abandoned after its first bytes.
+    """
+
+    def __init__(self, status_code, headers, content, url, spool=None, held=0, rejected=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.spool = spool
+        self.held = held
+        self.rejected = rejected
+
+    @property
+    def size(self):
+        return self.spool[1] if self.spool else len(self.content or b'')
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+
+def fetch_sync(session, url, headers=None, timeout=20, reader=None, validate=None):
+    """
+    Blocking GET with the requests session; bodies go through reader when one is given.
+    A body rejected by validate is dropped with its connection (the rest is never read).
+    """
+    if reader is None:
+        return session.get(url, headers=headers, timeout=timeout)
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as r:
+        if r.status_code != 200:
+            return FetchResponse(r.status_code, r.headers, r.content, r.url)
+        try:
+            content, spool, held = reader.read_sync(r, validate)
+        except ContentRejected as e:
+            return FetchResponse(r.status_code, r.headers, None, r.url, rejected=str(e))
+        return FetchResponse(r.status_code, r.headers, content, r.url, spool, held)
+
+
+class AsyncTransport:
+    """
+    Runs HTTP GETs as coroutines on one background event loop.
+    A single semaphore caps in-flight requests across every book that shares the
+    transport, so many books can be fetched at once without one OS thread per request.
+    Uses aiohttp when it is installed; otherwise each coroutine runs the blocking
+    requests session on a worker thread (same API, same budget).
+    """
+
+    def __init__(self, session, max_in_flight=256):
+        self.session = session
+        self.max_in_flight = max_in_flight
+        self.backend = "aiohttp" if aiohttp else "threads"
+        self.loop = None
+        self._budget = None
+        self._client = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the event loop thread (idempotent)."""
+        with self._lock:
+            if self.loop is not None: return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            threading.Thread(target=run, name="cambridge-async", daemon=True).start()
+            ready.wait()
+            asyncio.run_coroutine_threadsafe(self._setup(), loop).result()
+            self.loop = loop
+            atexit.register(self.close)
+            logger.info(f"Async transport started ({self.backend}, {self.max_in_flight} in flight)")
+
+    async def _setup(self):
+        self._budget = asyncio.Semaphore(self.max_in_flight)
+        if aiohttp:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=0)
+            # Headers and cookies come from the requests session on every request (see
+            # _request_headers), so a later login also applies to this client
+            self._client = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=min(self.max_in_flight, 64),
+                                                thread_name_prefix="cambridge-fetch")
+
+    def _request_headers(self, url, headers):
+        merged = {k: v for k, v in self.session.headers.items() if k.lower() != 'content-type'}
+        cookie = get_cookie_header(self.session.cookies, Request('GET', url))
+        if cookie:
+            merged['Cookie'] = cookie
+        merged.update(headers or {})
+        return merged
+
+    async def fetch(self, url, headers=None, timeout=20, reader=None, validate=None):
+        """
+        Coroutine: GET url under the global budget. Returns a response with status_code/headers/content.
+        With a BodyReader, 200 bodies are read through it (byte budget, spooling of large bodies)
+        and checked by validate(headers, head) as they arrive (see fetch_sync).
+        """
+        async with self._budget:
+            if self._client is not None:
+                # timeout bounds connecting and each read, not the whole body (large assets
+                # may stream for minutes), as with requests
+                client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+                async with self._client.get(url, headers=self._request_headers(url, headers),
+                                            timeout=client_timeout) as r:
+                    if reader is not None and r.status == 200:
+                        try:
+                            content, spool, held = await reader.read_async(r, validate)
+                        except ContentRejected as e:
+                            r.close()
+                            return FetchResponse(r.status, CaseInsensitiveDict(r.headers), None, str(r.url), rejected=str(e))
+                        return FetchResponse(r.status, CaseInsensitiveDict(r.headers), content, str(r.url), spool, held)
+                    content = await r.read()
+                    return FetchResponse(r.status, CaseInsensitiveDict(r.headers), content, str(r.url))
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, lambda: fetch_sync(self.session, url, headers, timeout, reader, validate))
+
+    def submit(self, url, headers=None, timeout=20, reader=None, validate=None):
+        """Schedules a GET from any thread. Returns a concurrent.futures.Future."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.fetch(url, headers, timeout, reader, validate), self.loop)
+
+    def get(self, url, headers=None, timeout=20):
+        """Blocking GET for callers on ordinary threads."""
+        return self.submit(url, headers, timeout).result()
+
+    @contextmanager
+    def slot(self):
+        """Holds one unit of the global budget from a thread (e.g. for a long streaming transfer)."""
+        self.start()
+        asyncio.run_coroutine_threadsafe(self._budget.acquire(), self.loop).result()
+        try:
+            yield
+        finally:
+            self.loop.call_soon_threadsafe(self._budget.release)
+
+    def close(self):
+        with self._lock:
+            if self.loop is None: return
+            loop, self.loop = self.loop, None
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.close(), loop).result()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        loop.call_soon_threadsafe(loop.stop)
@@ -0,0 +1,259 @@
+import os
+import sys
+import math
+import tkinter
+import logging
+from collections import OrderedDict
+import customtkinter as ctk
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class SelectionModel:
+    """
+    Which books are ticked, as a set of IDs (no Tk variable per book).
+    Listeners are called as listener(book_id) after a change (book_id None: many changed).
+    """
+
+    def __init__(self):
+        self._ids = set()
+        self.listeners = []
+
+    def __len__(self):
+        return len(self._ids)
+
+    def is_selected(self, book_id):
+        return book_id in self._ids
+
+    def set(self, book_id, selected):
+        if selected: self._ids.add(book_id)
+        else: self._ids.discard(book_id)
+        self._changed(book_id)
+
+    def toggle(self, book_id):
+        self.set(book_id, book_id not in self._ids)
+        return book_id in self._ids
+
+    def select_all(self, book_ids):
+        self._ids.update(book_ids)
+        self._changed(None)
+
+    def clear(self):
+        self._ids.clear()
+        self._changed(None)
+
+    def retain(self, book_ids):
+        """Forgets selected books that are no longer listed."""
+        self._ids.intersection_update(book_ids)
+        self._changed(None)
+
+    def selected_in(self, books):
+        """Selected IDs in the order of books."""
+        return [b['id'] for b in books if b['id'] in self._ids]
+
+    def _changed(self, book_id):
+        for listener in self.listeners:
+            listener(book_id)
+
+
+class VirtualBookList(ctk.CTkFrame):
+    """
+    Scrolling list of book rows that only creates widgets for the rows on screen.
+    A fixed pool of rows (one screen plus one) sits on a canvas as tall as the whole
+    library; while scrolling, the row that leaves the view is moved to the slot that
+    enters it and re-bound to that book (row k always shows a book with index = k mod pool),
+    so a scroll step touches at most the rows that changed. Ticks live in `selection`
+    (SelectionModel); cover thumbnails are loaded on demand into a small LRU cache.
+    on_select(book_id) is called when a book gets ticked.
+    """
+
+    ROW_HEIGHT = 104
+    ROW_GAP = 6
+    THUMB_SIZE = (60, 90)
+    IMAGE_CACHE = 256
+
+    def __init__(self, master, on_select=None, label_text=None, empty_text="No books found.", **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_select = on_select
+        self.books = []
+        self.selection = SelectionModel()
+        self.selection.listeners.append(self._on_selection)
+        self._rows = []
+        self._images = OrderedDict()
+        self._blank = ctk.CTkImage(Image.new("RGBA", self.THUMB_SIZE, (0, 0, 0, 0)), size=self.THUMB_SIZE)
+        self._row_px = round(self._apply_widget_scaling(self.ROW_HEIGHT))
+        self._gap_px = round(self._apply_widget_scaling(self.ROW_GAP))
+        self._width = 1
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
+        if label_text:
+            ctk.CTkLabel(self, text=label_text).grid(row=0, column=0, columnspan=2, pady=(4, 0))
+        self._canvas = tkinter.Canvas(self, highlightthickness=0, yscrollincrement=20,
+                                      bg=self._apply_appearance_mode(self.cget("fg_color")))
+        self._canvas.grid(row=1, column=0, sticky="nsew", padx=(6, 0), pady=6)
+        self._scrollbar = ctk.CTkScrollbar(self, command=self._canvas.yview)
+        self._scrollbar.grid(row=1, column=1, sticky="ns", pady=6)
+        self._canvas.configure(yscrollcommand=self._on_yscroll)
+        self._canvas.bind("<Configure>", self._on_resize)
+        self._empty = ctk.CTkLabel(self, text=empty_text)
+
+        self.bind_all("<MouseWheel>", self._on_wheel, add=True)
+        if "linux" in sys.platform:
+            self.bind_all("<Button-4>", self._on_wheel, add=True)
+            self.bind_all("<Button-5>", self._on_wheel, add=True)
+
+    def _set_appearance_mode(self, mode_string):
+        super()._set_appearance_mode(mode_string)
+        self._canvas.configure(bg=self._apply_appearance_mode(self.cget("fg_color")))
+
+    # --- Data ---
+
+    def set_books(self, books):
+        """Shows books (list of book dicts). Ticks of books still listed are kept."""
+        self.books = list(books)
+        self.selection.retain({b['id'] for b in books})
+        for row in self._rows:
+            row.index = None
+        self._update_extent()
+
+    def add_books(self, books):
+        """Appends books (a library streaming in); rows already on screen are left alone."""
+        self.books.extend(books)
+        self._update_extent()
+
+    def refresh(self):
+        """Re-binds the visible rows (after book entries changed in place)."""
+        for row in self._rows:
+            row.index = None
+        self._layout()
+
+    def refresh_book(self, book_id):
+        """Re-binds the row of one book if it is on screen (e.g. its cover arrived)."""
+        for row in self._rows:
+            if row.index is not None and row.book_id == book_id:
+                self._images.pop(self.books[row.index].get('cover_thumb'), None)
+                self._bind_row(row, row.index)
+
+    def _update_extent(self):
+        self._canvas.configure(scrollregion=(0, 0, self._width, max(1, len(self.books) * self._row_px)))
+        if self.books:
+            self._empty.place_forget()
+        else:
+            self._empty.place(relx=0.5, rely=0.2, anchor="n")
+        self._layout()
+
+    # --- Rows ---
+
+    def _make_row(self):
+        row = ctk.CTkFrame(self._canvas)
+        row.index = None
+        row.book_id = None
+        row.check = ctk.CTkCheckBox(row, text="", width=24, command=lambda r=row: self._on_check(r))
+        row.check.pack(side="left", padx=(10, 0))
+        row.cover = ctk.CTkLabel(row, text="", image=self._blank, width=self.THUMB_SIZE[0])
+        row.cover.pack(side="left", padx=10, pady=5)
+        info = ctk.CTkFrame(row, fg_color="transparent")
+        info.pack(side="left", fill="both", expand=True, padx=10)
+        row.title = ctk.CTkLabel(info, text="", font=("Roboto Medium", 14), anchor="w")
+        row.title.pack(anchor="w", pady=(5, 0))
+        row.meta = ctk.CTkLabel(info, text="", text_color="gray", font=("Roboto", 12))
+        row.meta.pack(anchor="w")
+        row.window = self._canvas.create_window(0, 0, anchor="nw", window=row, state="hidden",
+                                                width=self._width, height=self._row_px - self._gap_px)
+        return row
+
+    def _bind_row(self, row, index):
+        book = self.books[index]
+        row.index = index
+        row.book_id = book['id']
+        row.title.configure(text=book.get('title', ''))
+        meta_text = f"Status: {book.get('status', 'Unknown')}"
+        if book.get('offline'):
+            meta_text += f" | Size: {book.get('size', 0) / (1024 * 1024):.1f} MB"
+        row.meta.configure(text=meta_text)
+        if self.selection.is_selected(row.book_id): row.check.select()
+        else: row.check.deselect()
+        row.cover.configure(image=self._thumbnail(book.get('cover_thumb')))
+        self._canvas.coords(row.window, 0, index * self._row_px)
+        self._canvas.itemconfigure(row.window, state="normal")
+
+    def _thumbnail(self, path):
+        if not path:
+            return self._blank
+        image = self._images.get(path)
+        if image is not None:
+            self._images.move_to_end(path)
+            return image
+        if not os.path.exists(path):
+            # Not fetched yet (refresh_book() redraws the row when it arrives)
+            return self._blank
+        image = self._blank
+        try:
+            with Image.open(path) as pil_img:
+                pil_img.load()
+                image = ctk.CTkImage(light_image=pil_img, dark_image=pil_img, size=pil_img.size)
+        except Exception:
+            pass # Fallback to no image
+        self._images[path] = image
+        if len(self._images) > self.IMAGE_CACHE:
+            self._images.popitem(last=False)
+        return image
+
+    def _layout(self):
+        """Binds each on-screen slot to its book; rows already showing the right book are left alone."""
+        if not self._rows: return
+        first = max(0, int(self._canvas.canvasy(0) // self._row_px))
+        for slot in range(first, first + len(self._rows)):
+            row = self._rows[slot % len(self._rows)]
+            if slot >= len(self.books):
+                if row.index is not None or self._canvas.itemcget(row.window, "state") != "hidden":
+                    row.index = None
+                    self._canvas.itemconfigure(row.window, state="hidden")
+            elif row.index != slot:
+                self._bind_row(row, slot)
+
+    # --- Events ---
+
+    def _on_resize(self, event):
+        self._width = event.width
+        needed = math.ceil(event.height / self._row_px) + 1
+        while len(self._rows) < needed:
+            self._rows.append(self._make_row())
+        for row in self._rows:
+            # Slot assignment depends on the pool size: re-bind everything after a change
+            row.index = None
+            self._canvas.itemconfigure(row.window, width=event.width)
+        self._canvas.configure(scrollregion=(0, 0, event.width, max(1, len(self.books) * self._row_px)))
+        self._layout()
+
+    def _on_yscroll(self, first, last):
+        self._scrollbar.set(first, last)
+        self._layout()
+
+    def _on_check(self, row):
+        if row.book_id is None: return
+        if self.selection.toggle(row.book_id) and self.on_select:
+            self.on_select(row.book_id)
+
+    def _on_selection(self, book_id):
+        for row in self._rows:
+            if row.index is not None and (book_id is None or row.book_id == book_id):
+                if self.selection.is_selected(row.book_id): row.check.select()
+                else: row.check.deselect()
+
+    def _on_wheel(self, event):
+        # bind_all: only scroll when the pointer is over this list
+        widget = event.widget
+        while widget is not None and widget is not self._canvas:
+            widget = getattr(widget, "master", None)
+        if widget is None or self._canvas.yview() == (0.0, 1.0):
+            return
+        if sys.platform.startswith("win"):
+            self._canvas.yview_scroll(-int(event.delta / 40), "units")
+        elif sys.platform == "darwin":
+            self._canvas.yview_scroll(-event.delta, "units")
+        else:
+            self._canvas.yview_scroll(-3 if event.num == 4 else 3, "units")
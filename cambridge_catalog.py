@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    isbn TEXT,
+    title TEXT,
+    position INTEGER,
+    data TEXT NOT NULL,
+    seen_at REAL,
+    discovered_at REAL,
+    discovery_key TEXT,
+    partial INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS books_isbn ON books (user_id, isbn);
+CREATE TABLE IF NOT EXISTS resources (
+    user_id TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, book_id, position)
+);
+"""
+
+# Discovery results (stored in their own table) and state of a download in progress
+TRANSIENT_KEYS = ('resources', 'resources_partial', 'resources_pending', 'missing_assets', 'missing_resources')
+
+class LibraryCatalog:
+    """
+    On-disk catalog ('library.db', SQLite) of each user's bookshelf: the book entries,
+    their discovered resources and when the discovery ran.
+    - books() returns the last known library in bookshelf order, without any network I/O,
+      so it can be shown at startup while a refresh runs in the background.
+    - merge() stores a fresh bookshelf: changed entries are updated, books no longer on
+      the shelf are dropped (only when the whole bookshelf was read). Returns (added, removed) ids.
+    - record_discovery() stores the resources found for one book.
+    - Discovery results younger than DISCOVERY_TTL, complete, and for the same listing
+      URLs are fresh: books() and reuse_discovery() fill them in as book['resources'];
+      a book without that key still needs discovery.
+    A connection is opened per call, so any thread may use the catalog.
+    """
+
+    DISCOVERY_TTL = 24 * 3600
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._ready:
+            with self._lock:
+                conn.executescript(SCHEMA)
+                self._ready = True
+        return conn
+
+    @staticmethod
+    def _discovery_key(book):
+        # Resources found for other listing URLs say nothing about these ones
+        return f"{book.get('opcr_url') or ''}|{book.get('src_url') or ''}"
+
+    @staticmethod
+    def _data(book):
+        return json.dumps({k: v for k, v in book.items() if k not in TRANSIENT_KEYS})
+
+    def _fresh(self, book, discovered_at, discovery_key, partial):
+        return (discovered_at is not None and not partial and discovery_key == self._discovery_key(book)
+                and time.time() - discovered_at <= self.DISCOVERY_TTL)
+
+    def books(self, user_id):
+        """The cached library of user_id ([] when never scanned)."""
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            logger.warning(f"Library catalog unavailable: {e}")
+            return []
+        try:
+            rows = conn.execute("SELECT id, data, discovered_at, discovery_key, partial FROM books "
+                                "WHERE user_id = ? ORDER BY position", (str(user_id),)).fetchall()
+            resources = {}
+            for book_id, data in conn.execute(
+                    "SELECT book_id, data FROM resources WHERE user_id = ? ORDER BY book_id, position",
+                    (str(user_id),)):
+                resources.setdefault(book_id, []).append(json.loads(data))
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Could not read library catalog: {e}")
+            return []
+        finally:
+            conn.close()
+
+        books = []
+        for book_id, data, discovered_at, discovery_key, partial in rows:
+            book = json.loads(data)
+            if self._fresh(book, discovered_at, discovery_key, partial):
+                book['resources'] = resources.get(book_id, [])
+            books.append(book)
+        return books
+
+    def reuse_discovery(self, user_id, book):
+        """Sets book['resources'] from the catalog if still fresh. Returns True when reused."""
+        try:
+            conn = self._connect()
+        except sqlite3.Error:
+            return False
+        try:
+            row = conn.execute("SELECT discovered_at, discovery_key, partial FROM books "
+                               "WHERE user_id = ? AND id = ?", (str(user_id), str(book.get('id')))).fetchone()
+            if not row or not self._fresh(book, *row):
+                return False
+            book['resources'] = [json.loads(data) for (data,) in conn.execute(
+                "SELECT data FROM resources WHERE user_id = ? AND book_id = ? ORDER BY position",
+                (str(user_id), str(book.get('id'))))]
+            return True
+        except (sqlite3.Error, ValueError):
+            return False
+        finally:
+            conn.close()
+
+    def merge(self, user_id, books, complete=True):
+        """
+        Replaces user_id's library with books (a fresh bookshelf). Returns (added, removed).
+        complete=False (the bookshelf broke off): books are added/updated, nothing is removed.
+        """
+        user_id = str(user_id)
+        now = time.time()
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            logger.warning(f"Library catalog unavailable: {e}")
+            return [], []
+        try:
+            with conn:
+                rows = conn.execute("SELECT id, seen_at FROM books WHERE user_id = ?", (user_id,)).fetchall()
+                # Rows a discovery added before this merge (seen_at NULL) still count as new
+                known = {book_id for book_id, seen_at in rows if seen_at is not None}
+                fresh = [str(b.get('id')) for b in books]
+                removed = sorted({book_id for book_id, _ in rows} - set(fresh)) if complete else []
+                for book_id in removed:
+                    conn.execute("DELETE FROM books WHERE user_id = ? AND id = ?", (user_id, book_id))
+                    conn.execute("DELETE FROM resources WHERE user_id = ? AND book_id = ?", (user_id, book_id))
+
+                for position, book in enumerate(books):
+                    book_id = str(book.get('id'))
+                    data = self._data(book)
+                    conn.execute(
+                        "INSERT INTO books (user_id, id, isbn, title, position, data, seen_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (user_id, id) DO UPDATE SET isbn = excluded.isbn, "
+                        "title = excluded.title, position = excluded.position, "
+                        "data = excluded.data, seen_at = excluded.seen_at",
+                        (user_id, book_id, str(book.get('isbn') or '') or None, book.get('title'),
+                         position, data, now))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not update library catalog: {e}")
+            return [], []
+        finally:
+            conn.close()
+        return sorted(set(fresh) - known), removed
+
+    def record_discovery(self, user_id, book):
+        """Stores book['resources'] (possibly none) as the result of a discovery run now."""
+        user_id, book_id = str(user_id), str(book.get('id'))
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            logger.warning(f"Library catalog unavailable: {e}")
+            return
+        try:
+            with conn:
+                # The book may still be streaming in, before its merge()
+                conn.execute("INSERT OR IGNORE INTO books (user_id, id, isbn, title, data) VALUES (?, ?, ?, ?, ?)",
+                             (user_id, book_id, str(book.get('isbn') or '') or None, book.get('title'),
+                              self._data(book)))
+                conn.execute("DELETE FROM resources WHERE user_id = ? AND book_id = ?", (user_id, book_id))
+                conn.executemany(
+                    "INSERT INTO resources (user_id, book_id, position, name, data) VALUES (?, ?, ?, ?, ?)",
+                    [(user_id, book_id, i, res.get('name'), json.dumps(res))
+                     for i, res in enumerate(book.get('resources') or [])])
+                conn.execute("UPDATE books SET discovered_at = ?, discovery_key = ?, partial = ? "
+                             "WHERE user_id = ? AND id = ?",
+                             (time.time(), self._discovery_key(book), 1 if book.get('resources_partial') else 0,
+                              user_id, book_id))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record resources of {book.get('title')}: {e}")
+        finally:
+            conn.close()
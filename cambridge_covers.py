@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import uuid
+import logging
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class CoverCache:
+    """
+    Library cover cache ('covers/'): '<id>.jpg' is the cover as served, '<id>.thumb.jpg'
+    the THUMB_SIZE thumbnail the GUI shows, '<id>.json' the validators of the download.
+    refresh() fetches missing covers and revalidates those older than REVALIDATE_AFTER
+    (If-None-Match / If-Modified-Since) on a pool of WORKERS threads; thumbnails are made
+    on the same workers when a cover arrives, so the GUI only ever loads the small files.
+    submit() does the same for one book in the background (as books stream in).
+    fetch(url, headers) performs the GET (requests-like response).
+    """
+
+    WORKERS = 8
+    THUMB_SIZE = (60, 90)
+    REVALIDATE_AFTER = 24 * 3600
+
+    def __init__(self, root, fetch):
+        self.root = root
+        self.fetch = fetch
+        self._executor = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix="covers")
+        os.makedirs(self.root, exist_ok=True)
+
+    def paths(self, book_id):
+        base = os.path.join(self.root, str(book_id))
+        return base + ".jpg", base + ".thumb.jpg", base + ".json"
+
+    def refresh(self, books):
+        """Sets book['cover_local'] / book['cover_thumb'] and brings the files up to date."""
+        futures = [f for f in (self.submit(book) for book in books) if f]
+        wait(futures)
+
+    def submit(self, book, on_ready=None):
+        """
+        Sets the cover paths of book and refreshes its files in the background.
+        on_ready(book) is called (from a worker) when a new thumbnail was written.
+        Returns the Future, or None for a book without a cover.
+        """
+        if not book.get('cover'): return None
+        cover_path, thumb_path, _ = self.paths(book.get('id', 'unknown'))
+        book['cover_local'] = cover_path
+        book['cover_thumb'] = thumb_path
+        return self._executor.submit(self._refresh_safe, book, on_ready)
+
+    def _refresh_safe(self, book, on_ready):
+        try:
+            if self._refresh_one(book) and on_ready:
+                on_ready(book)
+        except Exception as e:
+            logger.warning(f"Failed to cache cover for {book.get('id')}: {e}")
+
+    def _load_meta(self, meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _refresh_one(self, book):
+        """Returns True when a new thumbnail was written."""
+        url = book['cover']
+        cover_path, thumb_path, meta_path = self.paths(book.get('id', 'unknown'))
+        meta = self._load_meta(meta_path) if os.path.exists(cover_path) else None
+        if meta and meta.get('url') != url:
+            meta = None
+
+        if meta and time.time() - meta.get('checked_at', 0) < self.REVALIDATE_AFTER:
+            if not os.path.exists(thumb_path):
+                return self._make_thumbnail(cover_path, thumb_path)
+            return False
+
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        made = False
+        if not meta and os.path.exists(cover_path):
+            # Cover from an older version of the cache: reuse it until the next revalidation
+            meta = {'url': url}
+            if not os.path.exists(thumb_path):
+                made = self._make_thumbnail(cover_path, thumb_path)
+
+        resp = self.fetch(url, headers or None)
+        if resp.status_code == 304 and meta:
+            meta['checked_at'] = time.time()
+            self._save_meta(meta_path, meta)
+            if not os.path.exists(thumb_path):
+                return self._make_thumbnail(cover_path, thumb_path)
+            return made
+        if resp.status_code != 200:
+            logger.warning(f"Cover for {book.get('id')} returned {resp.status_code}")
+            return made
+
+        # The thumbnail doubles as the check that the body really is an image
+        tmp = f"{cover_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(resp.content)
+        if not self._make_thumbnail(tmp, thumb_path):
+            os.remove(tmp)
+            return made
+        os.replace(tmp, cover_path)
+        self._save_meta(meta_path, {'url': url, 'etag': resp.headers.get('ETag'),
+                                    'last_modified': resp.headers.get('Last-Modified'),
+                                    'checked_at': time.time()})
+        return True
+
+    def _save_meta(self, meta_path, meta):
+        tmp = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp, meta_path)
+        except OSError as e:
+            logger.warning(f"Could not save cover metadata {meta_path}: {e}")
+
+    def _make_thumbnail(self, cover_path, thumb_path):
+        try:
+            with Image.open(cover_path) as img:
+                # JPEG covers are decoded straight at a reduced scale
+                img.draft('RGB', (self.THUMB_SIZE[0] * 2, self.THUMB_SIZE[1] * 2))
+                img = img.convert('RGB')
+                img.thumbnail(self.THUMB_SIZE)
+                buf = BytesIO()
+                img.save(buf, "JPEG", quality=90)
+        except Exception as e:
+            logger.warning(f"Cover {cover_path} is not a usable image: {e}")
+            return False
+        tmp = f"{thumb_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(buf.getvalue())
+        os.replace(tmp, thumb_path)
+        return True
@@ -0,0 +1,103 @@
+import heapq
+import itertools
+import logging
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Same scale as LibraryScheduler: lower runs first
+HIGH = 0
+NORMAL = 10
+LOW = 20
+
+class PendingResources:
+    """
+    "Resources pending" handle stored in book['resources_pending'] until the book's
+    resources are discovered. resolve() runs discover(book) once (concurrent callers
+    wait for the same run), removes the handle and returns book['resources'].
+    on_resolved(book) is called after a discovery, e.g. to store it in the catalog.
+    A discovery that raises keeps what it found and is flagged book['resources_partial'],
+    so it is never recorded as a complete (empty) result.
+    """
+
+    def __init__(self, book, discover, on_resolved=None):
+        self.book = book
+        self._discover = discover
+        self.on_resolved = on_resolved
+        self._lock = threading.Lock()
+        self.done = False
+
+    def resolve(self):
+        with self._lock:
+            if not self.done:
+                try:
+                    self._discover(self.book)
+                except Exception as e:
+                    logger.warning(f"Resource discovery failed for {self.book.get('title')}: {e}")
+                    self.book['resources_partial'] = True
+                    self.book.setdefault('resources', [])
+                finally:
+                    self.done = True
+                    if self.book.get('resources_pending') is self:
+                        del self.book['resources_pending']
+                if self.on_resolved:
+                    try:
+                        self.on_resolved(self.book)
+                    except Exception as e:
+                        logger.warning(f"Could not record resources of {self.book.get('title')}: {e}")
+        return self.book.get('resources', [])
+
+
+class DiscoveryPrefetcher:
+    """
+    Resolves PendingResources handles in the background on a few threads.
+    submit(handle, priority): HIGH/NORMAL requests (a book was selected or queued) run as
+    soon as a thread is free; LOW requests (the rest of the library) only while busy()
+    is False, so prefetching never competes with a download in progress. Handles that
+    were resolved in the meantime (by the download itself) are skipped.
+    """
+
+    IDLE_POLL = 0.5
+
+    def __init__(self, workers=2, busy=None):
+        self.workers = workers
+        self.busy = busy or (lambda: False)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+
+    def submit(self, handle, priority=LOW):
+        if handle is None or handle.done: return
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._seq), handle))
+            # Workers are started lazily and exit when the queue is empty
+            if self._running < min(self.workers, len(self._heap)):
+                self._running += 1
+                threading.Thread(target=self._worker, name=f"discovery-{self._running}", daemon=True).start()
+            self._cond.notify()
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0][2].done:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._running -= 1
+                    return None
+                if self._heap[0][0] < LOW or not self.busy():
+                    return heapq.heappop(self._heap)[2]
+                # Yield to the foreground until it goes quiet (or something urgent arrives)
+                self._cond.wait(self.IDLE_POLL)
+
+    def _worker(self):
+        while True:
+            handle = self._next()
+            if handle is None:
+                return
+            try:
+                handle.resolve()
+            except Exception as e:
+                logger.warning(f"Resource discovery failed for {handle.book.get('title')}: {e}")
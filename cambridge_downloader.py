@@ -1,11 +1,18 @@
 import os
+import sys
 import json
 import logging
 import requests
 from PIL import Image
 from io import BytesIO
+from concurrent.futures import wait
 from cambridge_api import CambridgeAPI
 from cambridge_offline import CambridgeOffline
+from cambridge_journal import JobJournal
+from cambridge_catalog import LibraryCatalog
+from cambridge_covers import CoverCache
+from cambridge_scheduler import LibraryScheduler
+from cambridge_progress import ProgressLogger, ConsoleProgress
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,17 +25,32 @@ class CambridgeDownloader:
     
     def __init__(self, download_dir="downloads"):
         self.api = CambridgeAPI()
+        # All network I/O of every book shares one event loop and in-flight budget
+        self.api.enable_async_transport()
         self.offline = CambridgeOffline()
         self.download_dir = download_dir
         self.use_online = True
         self.books = []
+        # find_book() lookups by ID and by ISBN
+        self._by_id = {}
+        self._by_isbn = {}
+        # Last known library per user, shown at startup while a scan refreshes it
+        self.catalog = LibraryCatalog(os.path.join(self.api.store.root, "library.db"))
+        # Discover pending resources of the whole library in the background while idle
+        self.prefetch_library = True
         self.covers_dir = "covers"
+        # Bulk downloads: several books at once under the API's shared fetch budget
+        self.scheduler = LibraryScheduler(self)
+        # One progress stream for every download (GUI, CLI and log subscribe to it)
+        self.progress = self.api.progress
+        self.progress.subscribe(ProgressLogger())
         
         if not os.path.exists(self.download_dir):
             os.makedirs(self.download_dir)
             
-        if not os.path.exists(self.covers_dir):
-            os.makedirs(self.covers_dir)
+        # Covers and their prepared thumbnails, fetched and revalidated in parallel
+        self.covers = CoverCache(self.covers_dir,
+                                 lambda url, headers: self.api.session.get(url, headers=headers, timeout=5))
 
     def set_download_dir(self, path):
         """Updates the download directory."""
@@ -53,29 +75,76 @@ class CambridgeDownloader:
         else:
             return False, msg
 
+    def cached_library(self):
+        """
+        Returns the library as of the last online scan, from the catalog (no network I/O).
+        Empty in offline mode, before login, or when this user was never scanned.
+        """
+        if not self.use_online or not self.api.user_id:
+            return []
+        books = self.catalog.books(self.api.user_id)
+        if books:
+            self._track_discovery(books)
+            self._set_books(books)
+            logger.info(f"Loaded {len(books)} books from the library catalog.")
+        return books
+
     def scan_library(self):
         """
         Scans for books.
         If Online: Fetches from API.
         If Offline: Scans local blobs.
+        Online results are merged into the library catalog; resources discovered
+        within LibraryCatalog.DISCOVERY_TTL are reused, the others are left pending
+        and discovered on demand (see _track_discovery).
+        Blocking form of iter_library().
+        """
+        for _ in self.iter_library():
+            pass
+        return self.books
+
+    def iter_library(self, on_update=None):
+        """
+        Streaming scan: yields each book as soon as the bookshelf response contains it,
+        already known to find_book() (so it can be queued for download right away).
+        Covers are fetched in the background; on_update(book) is called from a worker
+        thread when a book's thumbnail changed. Once the generator is exhausted,
+        self.books and the catalog hold the whole library, as after scan_library().
+        If the bookshelf breaks off, the books not received are yielded from the catalog.
         """
         raw_books = []
         
         # 1. Try Online
         if self.use_online:
             logger.info("Scanning Online Library...")
-            api_books = self.api.get_books()
-            if api_books:
+            user_id = self.api.user_id
+            covers = []
+            for b in self.api.iter_books(needs_discovery=lambda b: not self.catalog.reuse_discovery(user_id, b)):
                 # Mark as online
-                for b in api_books:
-                    b['source'] = 'online'
-                    b['status'] = 'Cloud'
-                    # Try to cache cover
-                    self._cache_cover(b)
-                raw_books.extend(api_books)
-                logger.info(f"Found {len(api_books)} books via API.")
-            else:
-                logger.warning("Online scan returned no books.")
+                b['source'] = 'online'
+                b['status'] = 'Cloud'
+                covers.append(self.covers.submit(b, on_update))
+                self._track_discovery([b], prefetch=False)
+                self._index_book(b)
+                raw_books.append(b)
+                yield b
+            complete = self.api.bookshelf_complete
+            if raw_books:
+                wait([f for f in covers if f])
+                # A bookshelf that broke off must not remove the books it did not get to
+                added, removed = self.catalog.merge(user_id, raw_books, complete=complete)
+                if self.prefetch_library:
+                    self.api.prefetch_resources(raw_books, LibraryScheduler.LOW)
+                logger.info(f"Found {len(raw_books)} books via API "
+                            f"({len(added)} new, {len(removed)} removed since the last scan).")
+            if not complete:
+                # Keep showing what we had for the rest of the library
+                received = {str(b.get('id')) for b in raw_books}
+                rest = [b for b in self.catalog.books(user_id) if str(b.get('id')) not in received]
+                raw_books.extend(self._track_discovery(rest))
+                logger.warning(f"Online scan incomplete ({len(received)} books received); "
+                               f"using {len(rest)} more from the catalog.")
+                yield from rest
         else:
             # 2. Try Offline ONLY if specifically in offline mode or if online failed
             logger.info("Scanning Local Storage...")
@@ -98,40 +167,89 @@ class CambridgeDownloader:
                 if b.get('source') == 'online':
                     unique_books[key] = b
                     
-        self.books = list(unique_books.values())
-        return self.books
+        self._set_books(list(unique_books.values()))
+        if not self.use_online:
+            yield from self.books
 
-    def _cache_cover(self, book):
-        """Downloads cover image to local cache if not exists."""
-        cover_url = book.get('cover')
-        if not cover_url: return
-        
-        # Unique filename
-        book_id = str(book.get('id', 'unknown'))
-        local_path = os.path.join(self.covers_dir, f"{book_id}.jpg")
-        
-        book['cover_local'] = local_path
-        
-        if os.path.exists(local_path):
-            return # Already cached
+    def _track_discovery(self, books, prefetch=True):
+        """
+        Books whose resources are not known yet get a pending handle; each discovery is
+        recorded in the catalog. With prefetch_library they are queued at LOW priority.
+        """
+        user_id = self.api.user_id
+        record = lambda book: self.catalog.record_discovery(user_id, book)
+        pending = [b for b in books if 'resources' not in b]
+        for b in pending:
+            self.api.defer_resources(b, on_resolved=record)
+        if prefetch and self.prefetch_library:
+            self.api.prefetch_resources(pending, LibraryScheduler.LOW)
+        return books
+
+    def select_book(self, book_id):
+        """A book was picked in the UI: discover its resources ahead of the download."""
+        book = self.find_book(book_id)
+        if book:
+            self.api.prefetch_resources([book], LibraryScheduler.NORMAL)
+
+    def _index_book(self, b):
+        # A book streaming in replaces the cached entry with the same ID/ISBN
+        self._by_id[str(b.get('id'))] = b
+        if b.get('isbn'):
+            self._by_isbn[str(b['isbn'])] = b
+
+    def _set_books(self, books):
+        by_id, by_isbn = {}, {}
+        for b in books:
+            by_id[str(b.get('id'))] = b
+            if b.get('isbn'):
+                by_isbn.setdefault(str(b['isbn']), b)
+        self.books, self._by_id, self._by_isbn = books, by_id, by_isbn
 
-        try:
-            # Download using authenticated session
-            resp = self.api.session.get(cover_url, timeout=5)
-            if resp.status_code == 200:
-                with open(local_path, "wb") as f:
-                    f.write(resp.content)
-        except Exception as e:
-            logger.warning(f"Failed to cache cover for {book_id}: {e}")
+    def pending_jobs(self):
+        """
+        Returns the IDs of books whose reconstruction was interrupted.
+        Downloading them again resumes from the assets still missing.
+        """
+        return [book_id for _, book_id in JobJournal.pending(self.download_dir) if book_id is not None]
+
+    def find_book(self, book_id):
+        """Returns the library entry for book_id (or ISBN), or None."""
+        # Search by string ID to be safe
+        key = str(book_id)
+        return self._by_id.get(key) or self._by_isbn.get(key)
+
+    def submit_download(self, book_id, progress_callback=None, refresh=False):
+        """
+        Queues one book without waiting (e.g. while iter_library() is still streaming).
+        progress_callback(book_id, percent) as for download_books.
+        Returns a Future resolving to (success, message).
+        """
+        book = self.find_book(book_id)
+        if book:
+            self.progress.queue_books([(book.get('id'), book.get('title'))])
+            self.api.prefetch_resources([book], LibraryScheduler.NORMAL)
+        return self.scheduler.submit(book_id, progress_callback=progress_callback, refresh=refresh)
+
+    def download_books(self, book_ids, progress_callback=None, refresh=False):
+        """
+        Downloads several books concurrently (see LibraryScheduler).
+        progress_callback(book_id, percent) reports per-book progress.
+        Returns [(book_id, success, message), ...].
+        """
+        queued = [b for b in (self.find_book(bid) for bid in book_ids) if b]
+        self.progress.queue_books([(b.get('id'), b.get('title')) for b in queued])
+        # Pending resources of queued books are discovered before their turn comes
+        self.api.prefetch_resources(queued, LibraryScheduler.NORMAL)
+        return self.scheduler.run(book_ids, progress_callback, refresh=refresh)
 
-    def download_book(self, book_id, progress_callback=None):
+    def download_book(self, book_id, progress_callback=None, refresh=False):
         """
         Downloads the book with the given ID.
         Routes to API or Offline extractor based on book source.
+        refresh=True only re-fetches assets that changed since the previous download.
         """
         # Find book
-        # Search by string ID to be safe
-        book = next((b for b in self.books if str(b.get('id')) == str(book_id)), None)
+        book = self.find_book(book_id)
         if not book:
             logger.error(f"Book ID {book_id} not found.")
             return False, "Book not found"
@@ -143,11 +261,78 @@ class CambridgeDownloader:
         
         success = False
         if source == 'online':
-            success = self.api.download_book(book, self.download_dir, progress_callback)
+            success = self.api.download_book(book, self.download_dir, progress_callback, refresh=refresh)
         else:
-            success = self.offline.download_book(book, self.download_dir, progress_callback)
+            # Offline extraction only knows percentages: forward them to the progress stream
+            self.progress.start_book(book.get('id'), book.get('title'))
+            def offline_progress(p):
+                self.progress.set_percent(book.get('id'), p)
+                if progress_callback: progress_callback(p)
+            try:
+                success = self.offline.download_book(book, self.download_dir, offline_progress)
+            finally:
+                self.progress.finish_book(book.get('id'), success)
             
         if success:
             return True, "Download successful"
-        else:
-            return False, "Download failed"
+        missing = book.get('missing_assets') or []
+        if missing or book.get('missing_resources'):
+            return False, (f"Incomplete: {len(missing)} book assets and "
+                           f"{len(book.get('missing_resources') or [])} resources missing")
+        return False, "Download failed"
+
+
+if __name__ == "__main__":
+    import argparse
+    import getpass
+
+    parser = argparse.ArgumentParser(description="Download Cambridge GO books from the command line.",
+                                     epilog="The password is read from CAMBRIDGE_PASSWORD, or prompted for.")
+    parser.add_argument("username")
+    parser.add_argument("--book", action="append", default=[], help="Book ID or ISBN to download (repeatable)")
+    parser.add_argument("--all", action="store_true", help="Download the whole library")
+    parser.add_argument("--out", default="downloads", help="Download directory")
+    parser.add_argument("--refresh", action="store_true", help="Only re-fetch what changed since the last download")
+    args = parser.parse_args()
+
+    # Never on the command line, where it shows up in ps output and shell history
+    password = os.environ.get("CAMBRIDGE_PASSWORD") or getpass.getpass(f"Password for {args.username}: ")
+    client = CambridgeDownloader(download_dir=args.out)
+    success, msg = client.login(args.username, password)
+    if not success:
+        sys.exit(f"Login failed: {msg}")
+    listing = not args.book and not args.all
+    cached = client.cached_library()
+    if listing:
+        # Print the catalog right away, then only what the scan changes
+        # (everything as it streams in when there is no catalog yet)
+        for b in cached:
+            print(f"{b.get('id')}\t{b.get('isbn', '')}\t{b.get('title')}")
+        known = {str(b.get('id')) for b in cached}
+        current = set()
+        for b in client.iter_library():
+            current.add(str(b.get('id')))
+            if str(b.get('id')) not in known:
+                print(f"{'+' if cached else ''}{b.get('id')}\t{b.get('isbn', '')}\t{b.get('title')}")
+        for b in cached:
+            if str(b.get('id')) not in current:
+                print(f"-{b.get('id')}\t{b.get('isbn', '')}\t{b.get('title')}")
+        sys.exit(0)
+
+    # Downloads start as soon as a wanted book streams in, while the rest is still read
+    wanted = {str(x) for x in args.book}
+    console = client.progress.subscribe(ConsoleProgress())
+    futures = []
+    for b in client.iter_library():
+        if args.all or str(b.get('id')) in wanted or str(b.get('isbn')) in wanted:
+            futures.append((b['id'], client.submit_download(b['id'], refresh=args.refresh)))
+    if not futures:
+        client.progress.unsubscribe(console)
+        sys.exit("No matching books.")
+
+    results = [(bid,) + tuple(future.result()) for bid, future in futures]
+    client.progress.unsubscribe(console)
+    print()
+    for bid, ok, message in results:
+        print(f"{bid}: {message}")
+    sys.exit(0 if all(ok for _, ok, _ in results) else 1)
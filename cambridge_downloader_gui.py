@@ -1,9 +1,12 @@
 import customtkinter as ctk
 import threading
+import time
+import multiprocessing
 import os
 from tkinter import messagebox
-from PIL import Image
 from cambridge_downloader import CambridgeDownloader
+from cambridge_progress import format_bytes, format_eta
+from cambridge_booklist import VirtualBookList
 
 # Configuration
 ctk.set_appearance_mode("System")
@@ -120,12 +123,14 @@ class LoginFrame(ctk.CTkFrame):
 
 
 class LibraryFrame(ctk.CTkFrame):
+    # Seconds between list updates while the library streams in
+    STREAM_INTERVAL = 0.1
+
     def __init__(self, master, client, on_logout):
         super().__init__(master)
         self.client = client
         self.on_logout = on_logout
         self.books = []
-        self.check_vars = {} # {book_id: IntVar}
         self.is_downloading = False
         
         # Top Bar
@@ -156,9 +161,11 @@ class LibraryFrame(ctk.CTkFrame):
                                                   fg_color="green", hover_color="darkgreen", command=self.download_selected)
         self.btn_download_selected.pack(side="right")
         
-        # Book List
-        self.scrollable_frame = ctk.CTkScrollableFrame(self, label_text="Available Books")
-        self.scrollable_frame.pack(fill="both", expand=True, padx=20, pady=10)
+        # Book List (only the visible rows exist as widgets; ticks live in self.selection)
+        # Ticking a book starts discovering its resources in the background
+        self.book_list = VirtualBookList(self, on_select=self.client.select_book, label_text="Available Books")
+        self.book_list.pack(fill="both", expand=True, padx=20, pady=10)
+        self.selection = self.book_list.selection
         
         # Status Bar / Progress
         self.status_bar = ctk.CTkFrame(self, height=40)
@@ -187,85 +194,65 @@ class LibraryFrame(ctk.CTkFrame):
             messagebox.showinfo("Folder Set", f"Downloads will be saved to:\n{new_dir}")
 
     def refresh_library(self):
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
-        self.check_vars = {}
-
-        self.label_status.configure(text="Scanning library...")
+        # Show the catalog from the last scan straight away, then refresh it
+        cached = self.client.cached_library()
+        if cached:
+            self.books = cached
+            self._render_books(status=f"{len(cached)} books (refreshing...)")
+        else:
+            self.label_status.configure(text="Scanning library...")
+        self.btn_refresh.configure(state="disabled")
         self.update()
         
         # Thread scan
         threading.Thread(target=self._scan_thread).start()
         
     def _scan_thread(self):
-        self.books = self.client.scan_library()
-        self.after(0, self._render_books)
-
-    def _render_books(self):
-        self.label_status.configure(text=f"Found {len(self.books)} books")
-        
-        if not self.books:
-             ctk.CTkLabel(self.scrollable_frame, text="No books found.").pack(pady=20)
-             return
-
-        for book in self.books:
-            self._create_book_card(book)
-
-    def _create_book_card(self, book):
-        card = ctk.CTkFrame(self.scrollable_frame)
-        card.pack(fill="x", pady=5)
-        
-        # Checkbox
-        var = ctk.IntVar()
-        self.check_vars[book['id']] = var
-        chk = ctk.CTkCheckBox(card, text="", variable=var, width=24)
-        chk.pack(side="left", padx=(10, 0))
-        
-        # Cover Image (if available)
-        if book.get('cover_local') and os.path.exists(book['cover_local']):
-            try:
-                # Load and Resize
-                pil_img = Image.open(book['cover_local'])
-                # Maintain Aspect Ratio roughly
-                pil_img.thumbnail((60, 90)) 
-                cover_img = ctk.CTkImage(light_image=pil_img, dark_image=pil_img, size=pil_img.size)
-                lbl_img = ctk.CTkLabel(card, text="", image=cover_img)
-                lbl_img.pack(side="left", padx=10, pady=5)
-            except:
-                pass # Fallback to no image
-        
-        # Info Column
-        info_frame = ctk.CTkFrame(card, fg_color="transparent")
-        info_frame.pack(side="left", fill="both", expand=True, padx=10)
-        
-        # Title
-        title_label = ctk.CTkLabel(info_frame, text=book['title'], font=("Roboto Medium", 14), anchor="w")
-        title_label.pack(anchor="w", pady=(5,0))
-        
-        # Metadata
-        status = book.get('status', 'Unknown')
-        color = "green" if status == "Cloud" else "orange"
-        meta_text = f"Status: {status}"
-        if book.get('offline'):
-             size_mb = book.get('size', 0) / (1024 * 1024)
-             meta_text += f" | Size: {size_mb:.1f} MB"
-             
-        meta_lbl = ctk.CTkLabel(info_frame, text=meta_text, text_color="gray", font=("Roboto", 12))
-        meta_lbl.pack(anchor="w")
+        # Without a cached view the list fills in as the bookshelf streams in,
+        # a batch per STREAM_INTERVAL; covers are redrawn as their thumbnails arrive
+        incremental = not self.books
+        if incremental:
+            self.after(0, lambda: self.book_list.set_books([]))
+        on_cover = lambda book: self.after(0, lambda: self.book_list.refresh_book(book['id']))
+        batch, last = [], time.monotonic()
+        for book in self.client.iter_library(on_update=on_cover):
+            if not incremental: continue
+            batch.append(book)
+            if time.monotonic() - last >= self.STREAM_INTERVAL:
+                self.after(0, lambda b=batch: self._add_streamed(b))
+                batch, last = [], time.monotonic()
+        books = self.client.books
+        def done():
+            self.btn_refresh.configure(state="normal")
+            self.books = books
+            self._render_books()
+        self.after(0, done)
+
+    def _add_streamed(self, books):
+        # Books that streamed in can already be ticked and downloaded
+        self.books.extend(books)
+        self.book_list.add_books(books)
+        self.label_status.configure(text=f"Loading library... {len(self.books)} books")
+
+    def _render_books(self, status=None):
+        # Ticks survive a re-render (the refresh after the cached view)
+        self.label_status.configure(text=status or f"Found {len(self.books)} books")
+        self.book_list.set_books(self.books)
 
     def select_all(self):
-        # Toggle based on first item
-        if not self.check_vars: return
-        new_val = 1 if list(self.check_vars.values())[0].get() == 0 else 0
-        for v in self.check_vars.values():
-            v.set(new_val)
+        # Toggle: clear when everything is already ticked
+        if not self.books: return
+        if len(self.selection) == len(self.books):
+            self.selection.clear()
+        else:
+            self.selection.select_all(b['id'] for b in self.books)
 
     def download_selected(self):
         if self.is_downloading:
              messagebox.showwarning("Busy", "Download in progress.")
              return
 
-        selected_ids = [bid for bid, var in self.check_vars.items() if var.get() == 1]
+        selected_ids = self.selection.selected_in(self.books)
         
         if not selected_ids:
             messagebox.showinfo("None Selected", "Please select books to download.")
@@ -283,22 +270,31 @@ class LibraryFrame(ctk.CTkFrame):
 
     def _bulk_download_thread(self, book_ids):
         total = len(book_ids)
-        success_count = 0
-        
-        for idx, bid in enumerate(book_ids):
-            # Update Status
-            title = next((b['title'] for b in self.books if b['id'] == bid), bid)
-            self.after(0, lambda t=title, i=idx: self.label_status.configure(text=f"Downloading ({i+1}/{total}): {t}..."))
-            
-            # Callback for per-book progress (optional, maybe just show overall items)
-            # For simpler UI, we just update progress bar per book completion
-            def sub_prog(p):
-                # Calculate global progress: ((idx * 100) + p) / (total * 100)
-                global_p = ((idx * 100) + p) / (total * 100)
-                self.after(0, lambda: self.progress.set(global_p))
-            
-            success, _ = self.client.download_book(bid, progress_callback=sub_prog)
-            if success: success_count += 1
+        selected = set(book_ids)
+
+        # Several books run at once (CambridgeDownloader.download_books). The progress
+        # stream is already coalesced, so this schedules at most a few Tk updates a second.
+        # Finished books are only in one snapshot: keep the last state of each here.
+        latest = {}
+        def on_progress(snapshot):
+            latest.update((bid, b) for bid, b in snapshot['books'].items() if bid in selected)
+            books = list(latest.values())
+            global_p = sum(b['percent'] for b in books) / (total * 100)
+            done = sum(1 for b in books if b['state'] in ('done', 'failed'))
+            active = [b['title'] for b in books if b['state'] == 'running']
+            status = (f"Downloading ({done}/{total} done, {len(active)} active)"
+                      f"{': ' + active[0] if active else ''} - {format_bytes(snapshot['rate'])}/s, "
+                      f"ETA {format_eta(snapshot['eta'])} "
+                      f"[{snapshot['in_flight']} in flight, window {snapshot['window']}]")
+            self.after(0, lambda: (self.progress.set(global_p), self.label_status.configure(text=status)))
+
+        self.after(0, lambda: self.label_status.configure(text=f"Downloading {total} books..."))
+        self.client.progress.subscribe(on_progress)
+        try:
+            results = self.client.download_books(book_ids)
+        finally:
+            self.client.progress.unsubscribe(on_progress)
+        success_count = sum(1 for _, success, _ in results if success)
             
         self.after(0, lambda: self._post_bulk(success_count, total))
 
@@ -350,5 +346,7 @@ class App(ctk.CTk):
         os._exit(0) # Ensure threads kill
 
 if __name__ == "__main__":
+    # Required for the EPUB deflate process pool inside the PyInstaller build
+    multiprocessing.freeze_support()
     app = App()
     app.mainloop()
@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from requests.structures import CaseInsensitiveDict
+
+from cambridge_async import FetchResponse
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Published book versions live under '<isbn>-<major>.<minor>.<patch>/' and never change
+VERSIONED_PATH = re.compile(r'/[^/?#]+-\d+\.\d+\.\d+/')
+
+def _http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+def _cache_control(headers):
+    directives = {}
+    for part in (headers.get('Cache-Control') or '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+class HttpCache:
+    """
+    Private HTTP cache (RFC 9111) on disk for small metadata GETs: OPFs, enrichments.json
+    and directory listings ('http_cache/', one body file plus a JSON header file per URL).
+    - Freshness comes from Cache-Control max-age, then Expires, then the usual heuristic
+      (HEURISTIC_FRACTION of the time since Last-Modified, at most HEURISTIC_MAX).
+      no-store and Vary: * are never stored; no-cache entries are always revalidated.
+    - 200 responses under a version-pinned path (VERSIONED_PATH) are immutable.
+    - Stale entries are revalidated with If-None-Match / If-Modified-Since; a 304
+      refreshes the stored headers and the cached body is returned. When revalidation
+      fails (network error or 5xx) the stale body is only served within the response's
+      stale-if-error allowance (RFC 9111 4.2.4, RFC 5861); otherwise the error stands.
+    - Successful bodies are only stored once the caller's accept(response) has checked
+      them, so an error page served with a 200 is never cached (let alone as immutable).
+    - Least recently used entries are evicted once the bodies exceed max_bytes.
+    """
+
+    HEURISTIC_FRACTION = 0.1
+    HEURISTIC_MAX = 24 * 3600
+    # Error statuses are only stored with explicit freshness information
+    CACHEABLE = (200, 203)
+    CACHEABLE_EXPLICIT = (404, 410)
+
+    def __init__(self, root="http_cache", max_bytes=64 * 1024 ** 2):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = None  # key -> [size, last_used]
+        self._total = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.root, key), os.path.join(self.root, key + ".json")
+
+    def _load_index(self):
+        # Called with the lock held
+        if self._entries is not None: return
+        self._entries, self._total = {}, 0
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".json"): continue
+            key = name[:-5]
+            try:
+                size = os.path.getsize(os.path.join(self.root, key))
+                used = os.path.getmtime(os.path.join(self.root, name))
+            except OSError:
+                continue
+            self._entries[key] = [size, used]
+            self._total += size
+
+    def _freshness(self, meta):
+        """Freshness lifetime in seconds (float('inf') for immutable entries)."""
+        if meta.get('immutable'):
+            return float('inf')
+        headers = meta['headers']
+        cc = _cache_control(headers)
+        if 'no-cache' in cc:
+            return 0
+        if 'max-age' in cc:
+            try:
+                return max(0, int(cc['max-age']))
+            except ValueError:
+                return 0
+        date = _http_date(headers.get('Date')) or meta['stored_at']
+        expires = headers.get('Expires')
+        if expires:
+            # An invalid Expires (e.g. "0") means already expired
+            return max(0, (_http_date(expires) or 0) - date)
+        last_modified = _http_date(headers.get('Last-Modified'))
+        if last_modified and meta['status'] in self.CACHEABLE:
+            return min(self.HEURISTIC_MAX, max(0, date - last_modified) * self.HEURISTIC_FRACTION)
+        return 0
+
+    def _age(self, meta):
+        try:
+            initial = max(0, int(meta['headers'].get('Age') or 0))
+        except ValueError:
+            initial = 0
+        return initial + max(0, time.time() - meta['stored_at'])
+
+    def _read(self, url):
+        """Returns (meta, body) for url, or (None, None)."""
+        key = self._key(url)
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get('url') != url: return None, None
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        if len(body) != meta.get('size'):
+            return None, None
+        with self._lock:
+            self._load_index()
+            if key in self._entries:
+                self._entries[key][1] = time.time()
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return meta, body
+
+    def _stale_if_error(self, meta):
+        """True when the stored response allows serving it stale after a failed revalidation."""
+        allowance = _cache_control(meta['headers']).get('stale-if-error')
+        if allowance is None:
+            return False
+        try:
+            return self._age(meta) - self._freshness(meta) <= int(allowance)
+        except ValueError:
+            return False
+
+    def _storable(self, url, response):
+        cc = _cache_control(response.headers)
+        if 'no-store' in cc or (response.headers.get('Vary') or '').strip() == '*':
+            return None
+        if response.status_code in self.CACHEABLE:
+            return True
+        if response.status_code in self.CACHEABLE_EXPLICIT:
+            return 'max-age' in cc or 'Expires' in response.headers
+        return False
+
+    def _write(self, url, status, headers, body):
+        key = self._key(url)
+        body_path, meta_path = self._paths(key)
+        meta = {'url': url, 'status': status, 'headers': dict(headers), 'size': len(body),
+                'stored_at': time.time(),
+                'immutable': status == 200 and bool(VERSIONED_PATH.search(url))}
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            # Unique names: two threads caching the same URL never share a temporary file
+            tmp = f"{body_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(body)
+            os.replace(tmp, body_path)
+            tmp = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp, meta_path)
+        except OSError as e:
+            logger.warning(f"Could not cache {url}: {e}")
+            return
+        with self._lock:
+            self._load_index()
+            old = self._entries.get(key)
+            if old: self._total -= old[0]
+            self._entries[key] = [len(body), time.time()]
+            self._total += len(body)
+            victims = []
+            if self._total > self.max_bytes:
+                for victim, (size, _) in sorted(self._entries.items(), key=lambda kv: kv[1][1]):
+                    if self._total <= self.max_bytes: break
+                    if victim == key: continue
+                    victims.append(victim)
+                    self._total -= size
+                    del self._entries[victim]
+        for victim in victims:
+            for path in self._paths(victim):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _update(self, url, meta, body, not_modified):
+        # RFC 9111 4.3.4: headers of the 304 replace the stored ones
+        headers = CaseInsensitiveDict(meta['headers'])
+        for name, value in not_modified.headers.items():
+            if name.lower() not in ('content-length', 'content-encoding', 'transfer-encoding'):
+                headers[name] = value
+        self._write(url, meta['status'], headers, body)
+        return headers
+
+    def get(self, url, fetch, accept=None):
+        """
+        fetch(headers) performs the GET (with the given conditional headers, or None).
+        accept(response) -> bool says whether a 200/203 body is what was asked for;
+        rejected bodies are returned but not stored.
+        Returns a requests-like response, served from the cache whenever it may be.
+        """
+        meta, body = self._read(url)
+        if meta and self._age(meta) < self._freshness(meta):
+            self.hits += 1
+            return FetchResponse(meta['status'], CaseInsensitiveDict(meta['headers']), body, url)
+
+        conditional = None
+        if meta:
+            conditional = {}
+            if meta['headers'].get('ETag'):
+                conditional['If-None-Match'] = meta['headers']['ETag']
+            if meta['headers'].get('Last-Modified'):
+                conditional['If-Modified-Since'] = meta['headers']['Last-Modified']
+        try:
+            response = fetch(conditional or None)
+        except Exception as e:
+            if meta is None or not self._stale_if_error(meta): raise
+            logger.warning(f"Revalidation of {url} failed ({e}), serving the cached copy")
+            self.hits += 1
+            return FetchResponse(meta['status'], CaseInsensitiveDict(meta['headers']), body, url)
+
+        if meta and response.status_code == 304:
+            self.revalidated += 1
+            return FetchResponse(meta['status'], self._update(url, meta, body, response), body, url)
+        if meta and response.status_code >= 500 and self._stale_if_error(meta):
+            logger.warning(f"Revalidation of {url} returned {response.status_code}, serving the cached copy")
+            self.hits += 1
+            return FetchResponse(meta['status'], CaseInsensitiveDict(meta['headers']), body, url)
+
+        self.misses += 1
+        if self._storable(url, response) and response.content is not None:
+            if response.status_code in self.CACHEABLE and accept and not accept(response):
+                logger.info(f"Not caching {url}: the body was rejected")
+                return response
+            self._write(url, response.status_code, response.headers, response.content)
+        return response
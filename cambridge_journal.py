@@ -0,0 +1,107 @@
+import os
+import glob
+import json
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class JobJournal:
+    """
+    Append-only journal ('<title>.epub.journal') of a reconstruction job in progress.
+    One JSON line per completed asset (url, size, sha256). Asset bodies live in the
+    AssetStore, so a restarted job reuses every journaled asset whose blob still hashes
+    correctly and only fetches the rest. The journal is removed once the EPUB is complete.
+    """
+
+    def __init__(self, epub_path):
+        self.path = epub_path + ".journal"
+        self.completed = {}
+        self._fh = None
+
+    def open(self, book_id, src_url):
+        """
+        Loads an unfinished journal for the same source, or starts a new one.
+        Returns the number of assets recorded by the previous run.
+        """
+        self.completed = {}
+        header = None
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-write
+                        continue
+                    if rec.get("op") == "begin":
+                        header = rec
+                    elif rec.get("op") == "asset" and rec.get("url"):
+                        self.completed[rec["url"]] = rec
+
+        if header and header.get("src_url") == src_url:
+            self._end_last_line()
+            self._fh = open(self.path, "a", encoding="utf-8")
+            logger.info(f"Resuming job: {len(self.completed)} assets already completed")
+        else:
+            self.completed = {}
+            self._fh = open(self.path, "w", encoding="utf-8")
+            self._append({"op": "begin", "book_id": book_id, "src_url": src_url}, sync=True)
+        return len(self.completed)
+
+    def _end_last_line(self):
+        """
+        Makes the file end with a newline before appending, so the next record
+        does not land on the end of a line a crashed run left unterminated.
+        A torn line is cut off; a complete last record just gets its newline.
+        """
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if not data or data.endswith(b"\n"):
+                return
+            cut = data.rfind(b"\n") + 1
+            try:
+                json.loads(data[cut:])
+                f.write(b"\n")
+            except ValueError:
+                f.truncate(cut)
+                logger.info("Dropped a torn record from the end of the journal")
+
+    def record(self, url, name, size, sha256, etag=None, last_modified=None):
+        rec = {"op": "asset", "url": url, "name": name, "size": size, "sha256": sha256,
+               "etag": etag, "last_modified": last_modified}
+        self.completed[url] = rec
+        self._append(rec)
+
+    def _append(self, rec, sync=False):
+        self._fh.write(json.dumps(rec) + "\n")
+        self._fh.flush()
+        if sync:
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+
+    def finish(self):
+        """Job complete: the journal is no longer needed."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def pending(output_dir):
+        """Returns [(epub_path, book_id), ...] for jobs that never finished."""
+        jobs = []
+        for path in glob.glob(os.path.join(output_dir, "*.epub.journal")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    header = json.loads(f.readline())
+                jobs.append((path[:-len(".journal")], header.get("book_id")))
+            except (OSError, ValueError):
+                continue
+        return jobs
@@ -0,0 +1,202 @@
+import re
+import logging
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DC_NS = "http://purl.org/dc/elements/1.1/"
+
+
+class ManifestItem:
+    __slots__ = ('id', 'href', 'media_type', 'properties')
+
+    def __init__(self, id, href, media_type=None, properties=None):
+        self.id = id
+        self.href = href
+        self.media_type = media_type
+        self.properties = properties
+
+    def __repr__(self):
+        return f"ManifestItem({self.id!r}, {self.href!r}, {self.media_type!r})"
+
+
+class OpfPackage:
+    """
+    Compact model of an OPF package document: manifest items (id/href/media-type),
+    spine order and the metadata fields we use. Built in one pass with an incremental
+    parser that drops each element once read, so huge manifests never sit in memory
+    as a tree. Edits (e.g. cover injection) are kept in the model and spliced into the
+    original bytes by serialize(); the document is never parsed or rewritten twice.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    # Large media first so it overlaps with the many small text fetches instead of
+    # being the last transfer left running
+    MEDIA_PREFIXES = ('audio/', 'video/')
+
+    def __init__(self):
+        self.version = None
+        self.items = []
+        self.by_id = {}
+        self.by_href = {}
+        self.spine = []
+        self.metadata = {}
+        self.meta = {}
+        self._raw = bytearray()
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._path = []
+        self._new_items = []
+        self._new_meta = []
+
+    @classmethod
+    def parse(cls, data):
+        """Builds the model from the complete OPF bytes."""
+        opf = cls()
+        for i in range(0, len(data), cls.CHUNK_SIZE):
+            opf.feed(data[i:i + cls.CHUNK_SIZE])
+        opf.close()
+        return opf
+
+    def feed(self, chunk):
+        """Incremental parsing: chunks can be fed as they arrive from the network."""
+        self._raw += chunk
+        self._parser.feed(chunk)
+        self._consume()
+
+    def close(self):
+        self._parser.close()
+        self._consume()
+        self._parser = None
+
+    def _consume(self):
+        for event, elem in self._parser.read_events():
+            tag = elem.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                self._path.append(tag)
+                if tag == 'package':
+                    self.version = elem.get('version')
+                continue
+            self._path.pop()
+            parent = self._path[-1] if self._path else None
+            if tag == 'item' and parent == 'manifest':
+                href = elem.get('href')
+                if href:
+                    self._add(ManifestItem(elem.get('id'), href, elem.get('media-type'), elem.get('properties')))
+            elif tag == 'itemref' and parent == 'spine':
+                if elem.get('idref'): self.spine.append(elem.get('idref'))
+            elif parent == 'metadata':
+                if tag == 'meta' and elem.get('name'):
+                    self.meta[elem.get('name')] = elem.get('content')
+                elif elem.tag.startswith('{' + DC_NS) and tag not in self.metadata and elem.text:
+                    self.metadata[tag] = elem.text.strip()
+            if tag != 'package':
+                # Done with this element: free it (and its children)
+                elem.clear()
+
+    def _add(self, item):
+        self.items.append(item)
+        if item.id: self.by_id[item.id] = item
+        self.by_href[item.href] = item
+
+    # --- Queries ---
+
+    @property
+    def hrefs(self):
+        return [item.href for item in self.items]
+
+    def media_type(self, href):
+        item = self.by_href.get(href)
+        return item.media_type if item else None
+
+    def spine_items(self):
+        """Manifest items in reading order."""
+        return [self.by_id[idref] for idref in self.spine if idref in self.by_id]
+
+    def fetch_order(self):
+        """
+        Hrefs in the order assets should be scheduled: audio/video first, then the
+        spine in reading order, then everything else in manifest order.
+        """
+        media = [i.href for i in self.items if (i.media_type or '').startswith(self.MEDIA_PREFIXES)]
+        seen = set(media)
+        order = list(media)
+        for item in self.spine_items() + self.items:
+            if item.href not in seen:
+                seen.add(item.href)
+                order.append(item.href)
+        return order
+
+    def cover_href(self):
+        """Existing cover image (EPUB 3 properties or EPUB 2 meta), or None."""
+        for item in self.items:
+            if item.properties and 'cover-image' in item.properties.split():
+                return item.href
+        cover = self.by_id.get(self.meta.get('cover'))
+        return cover.href if cover else None
+
+    # --- Edits ---
+
+    def add_item(self, id, href, media_type, properties=None):
+        """Adds a manifest item. Returns the item id actually used, or None if href exists."""
+        if href in self.by_href:
+            return None
+        base, n = id, 1
+        while id in self.by_id:
+            n += 1
+            id = f"{base}-{n}"
+        item = ManifestItem(id, href, media_type, properties)
+        self._add(item)
+        self._new_items.append(item)
+        return id
+
+    def add_meta(self, name, content):
+        self.meta[name] = content
+        self._new_meta.append((name, content))
+
+    def add_cover(self, href, media_type='image/jpeg'):
+        """Registers an injected cover image. Returns True if the model changed."""
+        cover_id = self.add_item("cover-image-injected", href, media_type)
+        if cover_id is None:
+            return False
+        self.add_meta('cover', cover_id)
+        return True
+
+    # --- Output ---
+
+    def serialize(self):
+        """The OPF bytes to write: the original document plus any edits, spliced in place."""
+        raw = bytes(self._raw)
+        if not self._new_items and not self._new_meta:
+            return raw
+        for section, elements in (('manifest', self._item_xml), ('metadata', self._meta_xml)):
+            name = section.encode()
+            matches = list(re.finditer(rb'</((?:[\w.-]+:)?)' + name + rb'\s*>', raw))
+            if matches:
+                m = matches[-1]
+                prefix = m.group(1).decode('ascii')
+                raw = raw[:m.start()] + elements(prefix).encode('utf-8') + raw[m.start():]
+                continue
+            # Empty section written as <metadata/>: expand it
+            m = re.search(rb'<((?:[\w.-]+:)?)' + name + rb'(\s[^>]*)?/>', raw)
+            if not m:
+                logger.warning(f"OPF has no {section} section, edits to it were dropped")
+                continue
+            prefix = m.group(1).decode('ascii')
+            tag = (prefix + section).encode()
+            raw = (raw[:m.start()] + b'<' + tag + (m.group(2) or b'') + b'>' +
+                   elements(prefix).encode('utf-8') + b'</' + tag + b'>' + raw[m.end():])
+        return raw
+
+    def _item_xml(self, prefix):
+        out = []
+        for item in self._new_items:
+            attrs = f"id={quoteattr(item.id)} href={quoteattr(item.href)} media-type={quoteattr(item.media_type)}"
+            if item.properties: attrs += f" properties={quoteattr(item.properties)}"
+            out.append(f"<{prefix}item {attrs}/>")
+        return "".join(out)
+
+    def _meta_xml(self, prefix):
+        return "".join(f"<{prefix}meta name={quoteattr(n)} content={quoteattr(c)}/>" for n, c in self._new_meta)
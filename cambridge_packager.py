@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import hashlib
+import shutil
+import time
+import logging
+import mimetypes
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_deflate_pool = None
+_deflate_pool_lock = threading.Lock()
+
+def _get_deflate_pool():
+    """Shared process pool for deflating text entries (created on first use)."""
+    global _deflate_pool
+    with _deflate_pool_lock:
+        if _deflate_pool is None:
+            try:
+                _deflate_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 2)
+            except Exception as e:
+                logger.warning(f"Process pool unavailable, deflating inline: {e}")
+                _deflate_pool = False
+        return _deflate_pool or None
+
+# _write_compressed appends pre-deflated entries through these ZipFile internals, as
+# ZipFile._open_to_write does in the CPython versions below. Elsewhere (or if any is
+# missing) entries are deflated by zipfile itself on the writer thread instead.
+_RAW_WRITE_VERSIONS = ((3, 8), (3, 13))
+_RAW_WRITE_INTERNALS = ('_lock', 'fp', 'start_dir', '_writecheck', '_didModify', 'filelist', 'NameToInfo')
+
+def _raw_writes_supported(zf):
+    return (_RAW_WRITE_VERSIONS[0] <= sys.version_info[:2] <= _RAW_WRITE_VERSIONS[1]
+            and all(hasattr(zf, attr) for attr in _RAW_WRITE_INTERNALS))
+
+def _deflate_batch(batch):
+    """Raw-deflates [(data, level), ...] -> [(compressed, crc32), ...]. Runs in a worker process."""
+    out = []
+    for data, level in batch:
+        c = zlib.compressobj(level, zlib.DEFLATED, -15)
+        out.append((c.compress(data) + c.flush(), zlib.crc32(data) & 0xffffffff))
+    return out
+
+
+class CompressionPolicy:
+    """
+    Picks STORED or DEFLATED (with a level) for an entry, based on its OPF media-type.
+    Falls back to the file extension when the manifest gives no media-type.
+    """
+
+    # Already compressed formats: deflate only burns CPU
+    STORED_TYPES = {
+        'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+        'font/woff', 'font/woff2', 'application/font-woff', 'application/font-woff2',
+        'application/zip', 'application/epub+zip',
+    }
+    STORED_PREFIXES = ('audio/', 'video/')
+    STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.woff', '.woff2',
+                         '.mp3', '.m4a', '.mp4', '.m4v', '.webm', '.ogg', '.zip')
+
+    TEXT_LEVEL = 6
+    DEFAULT_LEVEL = 6
+
+    def choose(self, name, media_type=None):
+        """Returns (compress_type, compresslevel)."""
+        media_type = (media_type or mimetypes.guess_type(name)[0] or '').lower()
+        if media_type in self.STORED_TYPES or media_type.startswith(self.STORED_PREFIXES):
+            return zipfile.ZIP_STORED, None
+        if name.lower().endswith(self.STORED_EXTENSIONS):
+            return zipfile.ZIP_STORED, None
+        if media_type.startswith('text/') or media_type.endswith(('xml', 'javascript', 'json')):
+            return zipfile.ZIP_DEFLATED, self.TEXT_LEVEL
+        return zipfile.ZIP_DEFLATED, self.DEFAULT_LEVEL
+
+
+class EpubPackager:
+    """
+    Streams a reconstructed EPUB straight into its ZIP container.
+    'mimetype' is written first (STORED) as the OCF spec requires, every other
+    entry is appended as soon as its body is handed over. Nothing is staged on disk.
+
+    STORED entries are written immediately. DEFLATED entries are batched and
+    compressed on a process pool, then written in submission order.
+    The archive is built as '<epub>.part' and only renamed into place on close(),
+    so an existing EPUB stays readable (and intact) until the new one is complete.
+    Every entry is hashed (sha256) as it goes in; manifest() returns the result for the sidecar.
+    """
+
+    MIMETYPE = "application/epub+zip"
+    BATCH_BYTES = 1024 * 1024
+    STREAM_BUFFER = 1024 * 1024
+    MAX_PENDING_BATCHES = (os.cpu_count() or 2) * 2
+
+    def __init__(self, epub_path, policy=None, parallel=True):
+        self.epub_path = epub_path
+        self.part_path = epub_path + ".part"
+        self.policy = policy or CompressionPolicy()
+        self.pool = _get_deflate_pool() if parallel else None
+        self.names = set()
+        self.digests = {}
+        self._batch = []
+        self._batch_bytes = 0
+        self._pending = deque()
+        self.zf = zipfile.ZipFile(self.part_path, 'w', zipfile.ZIP_DEFLATED)
+        self.raw_writes = _raw_writes_supported(self.zf)
+        if not self.raw_writes:
+            logger.info(f"Python {sys.version_info[0]}.{sys.version_info[1]}: deflating EPUB entries inline")
+        self.zf.writestr("mimetype", self.MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        self.names.add("mimetype")
+        self.digests["mimetype"] = hashlib.sha256(self.MIMETYPE.encode()).hexdigest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def add(self, name, data, media_type=None, sha256=None):
+        """
+        Appends one entry. Duplicate names are ignored (first body wins).
+        sha256 may be passed when the body's hash is already known (e.g. from the asset store).
+        """
+        name = name.replace(os.path.sep, '/').lstrip('/')
+        if name in self.names:
+            logger.info(f"Skipping duplicate entry: {name}")
+            return False
+        self.names.add(name)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if hasattr(data, 'open'):
+            # Large body kept on disk (BlobRef / ZipEntryRef): stream it, never load it whole
+            self.digests[name] = self._add_stream(name, data, media_type, sha256)
+            self._drain(block=False)
+            return True
+
+        self.digests[name] = sha256 or hashlib.sha256(data).hexdigest()
+
+        compress_type, level = self.policy.choose(name, media_type)
+        if compress_type == zipfile.ZIP_STORED or not data:
+            self.zf.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+        elif not self.raw_writes:
+            self.zf.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=level)
+        else:
+            self._batch.append((name, data, level))
+            self._batch_bytes += len(data)
+            if self._batch_bytes >= self.BATCH_BYTES:
+                self._flush_batch()
+        self._drain(block=False)
+        return True
+
+    def _add_stream(self, name, ref, media_type=None, sha256=None):
+        """Copies a streamed body into the archive. Returns its sha256 (hashed on the way through)."""
+        sha256 = sha256 or getattr(ref, 'sha256', None)
+        h = None if sha256 else hashlib.sha256()
+        compress_type, level = self.policy.choose(name, media_type)
+        zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = compress_type
+        if level is not None:
+            zinfo._compresslevel = level
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = len(ref)
+        with ref.open() as src, self.zf.open(zinfo, 'w') as dst:
+            if h is None:
+                shutil.copyfileobj(src, dst, self.STREAM_BUFFER)
+                return sha256
+            for block in iter(lambda: src.read(self.STREAM_BUFFER), b''):
+                h.update(block)
+                dst.write(block)
+        return h.hexdigest()
+
+    def add_container(self, opf_rel_path):
+        """Writes META-INF/container.xml pointing at the package document."""
+        container_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+    <rootfiles>
+        <rootfile full-path="{opf_rel_path.replace(os.path.sep, '/')}" media-type="application/oebps-package+xml"/>
+    </rootfiles>
+</container>"""
+        return self.add("META-INF/container.xml", container_xml, "application/xml")
+
+    def _flush_batch(self):
+        if not self._batch: return
+        batch = self._batch
+        self._batch = []
+        self._batch_bytes = 0
+
+        future = None
+        if self.pool:
+            try:
+                future = self.pool.submit(_deflate_batch, [(d, lvl) for _, d, lvl in batch])
+            except Exception as e:
+                logger.warning(f"Deflate pool submit failed, compressing inline: {e}")
+        self._pending.append((batch, future))
+        if len(self._pending) > self.MAX_PENDING_BATCHES:
+            self._drain(block=True, keep=self.MAX_PENDING_BATCHES)
+
+    def _drain(self, block, keep=0):
+        """Writes finished batches from the head of the queue, preserving order."""
+        while len(self._pending) > keep:
+            batch, future = self._pending[0]
+            if future is not None and not block and not future.done():
+                return
+            self._pending.popleft()
+            results = None
+            if future is not None:
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.warning(f"Parallel deflate failed, compressing inline: {e}")
+            if results is None:
+                results = _deflate_batch([(d, lvl) for _, d, lvl in batch])
+            for (name, data, _), (raw, crc) in zip(batch, results):
+                self._write_compressed(name, raw, crc, len(data))
+
+    def _write_compressed(self, name, raw, crc, file_size):
+        """
+        Appends an entry whose body is already raw-deflated (mirrors ZipFile._open_to_write).
+        Only used when _raw_writes_supported(zf); the caller falls back to writestr otherwise.
+        """
+        zf = self.zf
+        zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = file_size
+        zinfo.compress_size = len(raw)
+        zinfo.CRC = crc
+        with zf._lock:
+            zf.fp.seek(zf.start_dir)
+            zinfo.header_offset = zf.fp.tell()
+            zf._writecheck(zinfo)
+            zf._didModify = True
+            zf.fp.write(zinfo.FileHeader())
+            zf.fp.write(raw)
+            zf.start_dir = zf.fp.tell()
+            zf.filelist.append(zinfo)
+            zf.NameToInfo[zinfo.filename] = zinfo
+
+    def close(self):
+        self._flush_batch()
+        self._drain(block=True)
+        self.zf.close()
+        os.replace(self.part_path, self.epub_path)
+
+    def manifest(self):
+        """{name: {'sha256', 'size', 'crc32'}} for every entry written (complete after close())."""
+        return {info.filename: {'sha256': self.digests.get(info.filename), 'size': info.file_size,
+                                'crc32': info.CRC}
+                for info in self.zf.infolist()}
+
+    def abort(self):
+        """Closes and removes a half-written archive."""
+        self._batch = []
+        self._pending.clear()
+        try:
+            self.zf.close()
+        except Exception:
+            pass
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+
+class ZipEntryRef:
+    """An entry of an existing archive, copied into the new one by streaming (see EpubPackager.add)."""
+
+    def __init__(self, zf, name):
+        self.zf = zf
+        self.name = name
+        self.size = zf.getinfo(name).file_size
+
+    def __len__(self):
+        return self.size
+
+    def open(self):
+        return self.zf.open(self.name)
+
+
+class ArchiveSidecar:
+    """
+    Per-book JSON sidecar ('<title>.epub.json') describing where each archive entry came from.
+    Keeps the source URL, ETag/Last-Modified and size of every entry so a later
+    refresh can revalidate with conditional GETs instead of re-downloading.
+    'integrity' lists sha256/size/CRC-32 of every entry in the finished archive
+    (cambridge_verify.py checks archives against it). 'resources' does the same as
+    'entries' for the resource files kept next to the EPUB, keyed by file name.
+    """
+
+    VERSION = 2
+
+    def __init__(self, epub_path, book_id=None, src_url=None, entries=None, missing=None, integrity=None,
+                 resources=None):
+        self.epub_path = epub_path
+        self.book_id = book_id
+        self.src_url = src_url
+        self.entries = entries or {}
+        # Manifest items the server refused for good (e.g. 404): the archive is knowingly incomplete
+        self.missing = missing or []
+        self.integrity = integrity or {}
+        self.resources = resources or {}
+
+    @staticmethod
+    def path_for(epub_path):
+        return epub_path + ".json"
+
+    @classmethod
+    def load(cls, epub_path):
+        """Returns the sidecar for an existing EPUB, or None if missing/unreadable."""
+        try:
+            with open(cls.path_for(epub_path), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(epub_path, data.get("book_id"), data.get("src_url"), data.get("entries", {}),
+                       data.get("missing", []), data.get("integrity", {}), data.get("resources", {}))
+        except (OSError, ValueError):
+            return None
+
+    def record(self, name, url=None, etag=None, last_modified=None, size=None):
+        self.entries[name] = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": size,
+        }
+
+    def record_resource(self, name, url=None, etag=None, last_modified=None, size=None):
+        self.resources[name] = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": size,
+        }
+
+    def validators(self, name):
+        """Conditional request headers for an entry (empty if nothing was recorded)."""
+        entry = self.entries.get(name) or {}
+        headers = {}
+        if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def save(self):
+        path = self.path_for(self.epub_path)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": self.VERSION,
+                "book_id": self.book_id,
+                "src_url": self.src_url,
+                "entries": self.entries,
+                "missing": self.missing,
+                "integrity": self.integrity,
+                "resources": self.resources,
+            }, f, indent=1)
+        os.replace(tmp, path)
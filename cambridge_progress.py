@@ -0,0 +1,312 @@
+import sys
+import time
+import logging
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+def format_eta(seconds):
+    if seconds is None: return "--:--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressTracker:
+    """
+    Byte-accurate download progress for every book, published as one coalesced stream.
+    Downloaders report transfers (Content-Length when known, then streamed chunks);
+    units that have not started yet are estimated from the mean size of finished ones.
+    Subscribers get a snapshot dict at most once per `interval` seconds, however many
+    chunks arrived in between:
+        {'books': {book_id: {title, state, percent, bytes, remaining, rate, eta, in_flight}},
+         'bytes', 'remaining', 'rate', 'eta', 'in_flight', 'window', 'active', 'queued',
+         'done', 'total'}
+    Rates are bytes/second from the network (cache hits count as progress, not throughput).
+    A finished book is in one published snapshot (state 'done'/'failed') and then dropped;
+    'done' and 'total' count every book since the tracker was created.
+    """
+
+    INTERVAL = 0.25
+    SMOOTHING = 0.3
+    DEFAULT_SIZE = 64 * 1024
+
+    def __init__(self, interval=INTERVAL, in_flight=None, window=None):
+        self.interval = interval
+        # in_flight(book_id) -> fetches in flight for that book (None: all books)
+        self.in_flight = in_flight
+        # window() -> current concurrency (AIMD) window
+        self.window = window
+        self._lock = threading.Lock()
+        self._books = {}
+        self._sizes = {}
+        # Books dropped after being reported: [bytes of the successful ones, their count, all]
+        self._finished = [0, 0, 0]
+        self._subscribers = []
+        self._thread = None
+        self._dirty = False
+        self._rate = 0.0
+        self._net_bytes = 0
+        self._last_net = 0
+        self._last_tick = time.monotonic()
+
+    # --- Subscribers ---
+
+    def subscribe(self, callback):
+        """callback(snapshot) is called from the publisher thread. Returns callback."""
+        with self._lock:
+            self._subscribers.append(callback)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._publish_loop, name="progress", daemon=True)
+                self._thread.start()
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    # --- Reporting (called by downloaders, any thread) ---
+
+    def queue_books(self, books):
+        """Registers [(book_id, title), ...] waiting to start (counted in the global ETA)."""
+        with self._lock:
+            for book_id, title in books:
+                self._books[book_id] = self._new_book(title, 'queued')
+            self._dirty = True
+
+    def start_book(self, book_id, title=None):
+        with self._lock:
+            book = self._books.get(book_id)
+            if book is None or book['state'] != 'queued':
+                book = self._books[book_id] = self._new_book(title or str(book_id), 'running')
+            book['state'] = 'running'
+            book['title'] = title or book['title']
+            self._dirty = True
+
+    def busy(self):
+        """True while any book is queued or downloading."""
+        with self._lock:
+            return any(b['state'] in ('queued', 'running') for b in self._books.values())
+
+    def expect(self, book_id, kind, count):
+        """count more units of kind ('asset', 'resource') will be transferred for book_id."""
+        with self._lock:
+            book = self._books.get(book_id)
+            if book is None: return
+            book['expected'][kind] = book['expected'].get(kind, 0) + count
+            self._dirty = True
+
+    def transfer_started(self, book_id, kind, total=None):
+        """Starts one expected unit. Returns a token for transfer_bytes/transfer_done."""
+        token = {'book': book_id, 'kind': kind, 'total': total, 'done': 0}
+        with self._lock:
+            book = self._books.get(book_id)
+            if book is not None:
+                if book['expected'].get(kind, 0) > 0:
+                    book['expected'][kind] -= 1
+                book['active'].append(token)
+            self._dirty = True
+        return token
+
+    def transfer_bytes(self, token, nbytes, total=None, cached=False):
+        with self._lock:
+            if total: token['total'] = total
+            token['done'] += nbytes
+            book = self._books.get(token['book'])
+            if book is not None:
+                book['bytes'] += nbytes
+                if not cached:
+                    book['net_bytes'] += nbytes
+                    self._net_bytes += nbytes
+            self._dirty = True
+
+    def transfer_done(self, token):
+        with self._lock:
+            book = self._books.get(token['book'])
+            if book is not None and token in book['active']:
+                book['active'].remove(token)
+                if token['done']:
+                    size = self._sizes.setdefault(token['kind'], [0, 0])
+                    size[0] += token['done']
+                    size[1] += 1
+            self._dirty = True
+
+    def add_transfer(self, book_id, kind, nbytes, cached=False):
+        """One unit whose whole body arrived at once (e.g. a small asset)."""
+        token = self.transfer_started(book_id, kind, nbytes)
+        self.transfer_bytes(token, nbytes, cached=cached)
+        self.transfer_done(token)
+
+    def set_percent(self, book_id, percent):
+        """For sources without byte counts (e.g. offline extraction)."""
+        with self._lock:
+            book = self._books.get(book_id)
+            if book is not None:
+                book['percent_hint'] = percent
+            self._dirty = True
+
+    def finish_book(self, book_id, success=True):
+        with self._lock:
+            book = self._books.get(book_id)
+            if book is not None:
+                book['state'] = 'done' if success else 'failed'
+                book['expected'] = {}
+                book['active'] = []
+            self._dirty = True
+
+    # --- Snapshots ---
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot(time.monotonic(), tick=False)
+
+    @staticmethod
+    def _new_book(title, state):
+        return {'title': title, 'state': state, 'bytes': 0, 'net_bytes': 0, 'last_net': 0,
+                'rate': 0.0, 'expected': {}, 'active': [], 'percent_hint': None, 'shown': 0.0}
+
+    def _mean_size(self, kind):
+        size = self._sizes.get(kind)
+        if size and size[1]:
+            return size[0] / size[1]
+        return self.DEFAULT_SIZE
+
+    def _remaining(self, book):
+        remaining = sum(book['expected'].get(k, 0) * self._mean_size(k) for k in book['expected'])
+        for token in book['active']:
+            total = token['total'] or self._mean_size(token['kind'])
+            remaining += max(0, total - token['done'])
+        return remaining
+
+    def _snapshot(self, now, tick):
+        dt = max(now - self._last_tick, 1e-6)
+        books = {}
+        finished_bytes, finished_count = self._finished[0], self._finished[1]
+        for b in self._books.values():
+            if b['state'] == 'done' and b['bytes']:
+                finished_bytes += b['bytes']
+                finished_count += 1
+        mean_book = finished_bytes / finished_count if finished_count else None
+        total_bytes = total_remaining = 0
+        counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+
+        for book_id, book in self._books.items():
+            counts[book['state']] += 1
+            if tick:
+                book['rate'] = self._smooth(book['rate'], (book['net_bytes'] - book['last_net']) / dt)
+                book['last_net'] = book['net_bytes']
+            remaining = self._remaining(book) if book['state'] == 'running' else 0
+            if book['state'] == 'queued':
+                remaining = mean_book or 0
+            if book['state'] in ('done', 'failed'):
+                percent = 100.0
+            elif book['percent_hint'] is not None and not book['bytes']:
+                percent = float(book['percent_hint'])
+            elif book['bytes'] + remaining > 0:
+                percent = min(99.0, 100.0 * book['bytes'] / (book['bytes'] + remaining))
+            else:
+                percent = 0.0
+            # Sizes are learned as transfers start: never move a book's bar backwards
+            percent = book['shown'] = max(book['shown'], percent)
+            in_flight = len(book['active']) + (self.in_flight(book_id) if self.in_flight else 0)
+            books[book_id] = {
+                'title': book['title'], 'state': book['state'], 'percent': percent,
+                'bytes': book['bytes'], 'remaining': remaining, 'rate': book['rate'],
+                'eta': remaining / book['rate'] if book['rate'] > 0 and book['state'] == 'running' else None,
+                'in_flight': in_flight,
+            }
+            total_bytes += book['bytes']
+            total_remaining += remaining
+
+        if tick:
+            self._rate = self._smooth(self._rate, (self._net_bytes - self._last_net) / dt)
+            self._last_net = self._net_bytes
+            self._last_tick = now
+        return {
+            'books': books,
+            'bytes': total_bytes,
+            'remaining': total_remaining,
+            'rate': self._rate,
+            'eta': total_remaining / self._rate if self._rate > 0 and total_remaining else None,
+            'in_flight': self.in_flight(None) if self.in_flight else 0,
+            'window': self.window() if self.window else None,
+            'active': counts['running'],
+            'queued': counts['queued'],
+            'done': self._finished[2] + counts['done'] + counts['failed'],
+            'total': self._finished[2] + len(self._books),
+        }
+
+    def _drop_reported(self):
+        """Forgets finished books once a published snapshot has shown them."""
+        for book_id in [k for k, b in self._books.items() if b['state'] in ('done', 'failed')]:
+            book = self._books.pop(book_id)
+            if book['state'] == 'done' and book['bytes']:
+                self._finished[0] += book['bytes']
+                self._finished[1] += 1
+            self._finished[2] += 1
+
+    def _smooth(self, old, new):
+        return new if not old else (1 - self.SMOOTHING) * old + self.SMOOTHING * new
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+                running = any(b['state'] == 'running' for b in self._books.values())
+                if not (self._dirty or running):
+                    continue
+                self._dirty = False
+                snapshot = self._snapshot(time.monotonic(), tick=True)
+                self._drop_reported()
+                subscribers = list(self._subscribers)
+            for callback in subscribers:
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    logger.warning(f"Progress subscriber failed: {e}")
+
+
+class ProgressLogger:
+    """Subscriber that logs a one-line summary every `every` seconds while books are running."""
+
+    def __init__(self, every=10):
+        self.every = every
+        self._last = 0
+
+    def __call__(self, snapshot):
+        now = time.monotonic()
+        if not snapshot['active'] or now - self._last < self.every:
+            return
+        self._last = now
+        logger.info(f"Progress: {snapshot['active']} active, {snapshot['queued']} queued, "
+                    f"{format_bytes(snapshot['bytes'])} done, {format_bytes(snapshot['rate'])}/s, "
+                    f"{snapshot['in_flight']} in flight (window {snapshot['window']}), "
+                    f"ETA {format_eta(snapshot['eta'])}")
+
+
+class ConsoleProgress:
+    """Subscriber that redraws one status line on stderr (for the command line)."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+
+    def __call__(self, snapshot):
+        running = [b for b in snapshot['books'].values() if b['state'] == 'running']
+        current = ", ".join(f"{b['title'][:24]} {b['percent']:.0f}%" for b in running[:3])
+        line = (f"[{snapshot['done']}/{snapshot['total']}] {format_bytes(snapshot['rate'])}/s "
+                f"ETA {format_eta(snapshot['eta'])} | {snapshot['in_flight']}/{snapshot['window']} in flight | {current}")
+        self.stream.write("\r" + line[:119].ljust(119))
+        self.stream.flush()
@@ -0,0 +1,80 @@
+import re
+import logging
+import mimetypes
+import posixpath
+from urllib.parse import urljoin, urldefrag, urlsplit, unquote
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class ReferenceScanner:
+    """
+    Finds resources that book content refers to but the OPF manifest leaves out:
+    CSS url() and @import, XHTML/SVG src/poster/srcset/<link href>/xlink:href, and
+    asset-like string literals in scripts (widgets that load images at runtime).
+    Each asset body is scanned once as it arrives; scan() returns only hrefs that
+    resolve inside the book's OPF directory (same origin) and were not seen before.
+    """
+
+    SCANNED_TYPES = ('application/xhtml+xml', 'text/html', 'image/svg+xml', 'text/css',
+                     'application/javascript', 'text/javascript', 'application/x-javascript')
+    SCANNED_EXTENSIONS = ('.xhtml', '.html', '.htm', '.svg', '.css', '.js')
+    MAX_SCAN_BYTES = 16 * 1024 * 1024
+
+    CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)', re.I)
+    CSS_IMPORT = re.compile(r'@import\s+([\'"])([^\'"]+)\1', re.I)
+    ATTR = re.compile(r'\b(?:src|poster|data|xlink:href)\s*=\s*([\'"])([^\'"]+)\1', re.I)
+    LINK_HREF = re.compile(r'<link\b[^>]*?\bhref\s*=\s*([\'"])([^\'"]+)\1', re.I)
+    SRCSET = re.compile(r'\bsrcset\s*=\s*([\'"])([^\'"]+)\1', re.I)
+    SCRIPT_LITERAL = re.compile(
+        r'([\'"])([^\'"\s<>]+\.(?:png|jpe?g|gif|svg|webp|mp3|m4a|mp4|webm|json|css|js|woff2?|ttf|otf))\1', re.I)
+
+    def __init__(self, base_url, known=()):
+        # base_url is the OPF directory URL; hrefs are relative to it (like manifest hrefs)
+        self.base_url = base_url.rstrip('/') + '/'
+        self.seen = {posixpath.normpath(h) for h in known}
+
+    def wants(self, href, media_type=None):
+        media_type = (media_type or mimetypes.guess_type(href)[0] or '').lower()
+        return media_type in self.SCANNED_TYPES or href.lower().endswith(self.SCANNED_EXTENSIONS)
+
+    def scan(self, href, body, media_type=None):
+        """Returns new hrefs (relative to the OPF directory) referenced by this asset."""
+        if not body or not self.wants(href, media_type):
+            return []
+        if hasattr(body, 'open'):
+            # Streamed body kept on disk: scan its head (large text files are rare)
+            with body.open() as f:
+                body = f.read(self.MAX_SCAN_BYTES)
+        text = body.decode('utf-8', errors='replace')
+        refs = []
+        for pattern in (self.CSS_URL, self.CSS_IMPORT, self.ATTR, self.LINK_HREF):
+            refs.extend(m.group(2) for m in pattern.finditer(text))
+        for m in self.SRCSET.finditer(text):
+            refs.extend(part.strip().split()[0] for part in m.group(2).split(',') if part.strip())
+        if href.lower().endswith('.js') or '<script' in text:
+            refs.extend(m.group(2) for m in self.SCRIPT_LITERAL.finditer(text))
+
+        found = []
+        asset_url = urljoin(self.base_url, href)
+        for ref in refs:
+            new = self._resolve(asset_url, ref.strip())
+            if new and new not in self.seen:
+                self.seen.add(new)
+                found.append(new)
+        return found
+
+    def _resolve(self, asset_url, ref):
+        if not ref or ref.startswith(('#', 'data:', 'javascript:', 'mailto:', 'about:')):
+            return None
+        url = urldefrag(urljoin(asset_url, ref))[0]
+        parts = urlsplit(url)
+        url = f"{parts.scheme}://{parts.netloc}{parts.path}"
+        if not url.startswith(self.base_url):
+            # Other host, or outside the book's package directory
+            return None
+        href = posixpath.normpath(url[len(self.base_url):])
+        if href in ('', '.') or href.startswith('..') or not posixpath.splitext(unquote(href))[1]:
+            return None
+        return href
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from urllib.parse import urlsplit
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class UrlResolver:
+    """
+    Remembers which URL candidates actually work, per candidate kind and host/path prefix
+    (e.g. 'resource:alt_url@elevate-s3.cambridge.org/books_data'), across runs ('resolver.json').
+    - order() puts the kinds that succeeded most often first (ties keep the given order).
+    - is_dead() is True for a URL that failed within URL_TTL, or for a pattern that has
+      failed for DEAD_AFTER distinct books without a single success (repeated failures of
+      one book count once); dead patterns are re-probed once every PATTERN_TTL, so a
+      listing that comes back to life is noticed.
+    """
+
+    URL_TTL = 24 * 3600
+    PATTERN_TTL = 7 * 24 * 3600
+    DEAD_AFTER = 3
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._patterns = None
+        self._urls = None
+        self._dirty = False
+
+    @staticmethod
+    def pattern(kind, url):
+        parts = urlsplit(url)
+        segment = parts.path.strip('/').split('/', 1)[0]
+        return f"{kind}@{parts.netloc}/{segment}"
+
+    def _load(self):
+        # Called with the lock held; lazy so creating a CambridgeAPI does not touch the disk
+        if self._patterns is not None: return
+        self._patterns, self._urls = {}, {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._patterns = data.get("patterns", {})
+            now = time.time()
+            self._urls = {u: t for u, t in data.get("dead_urls", {}).items() if t > now}
+        except (OSError, ValueError):
+            pass
+
+    def is_dead(self, kind, url):
+        now = time.time()
+        with self._lock:
+            self._load()
+            if self._urls.get(url, 0) > now:
+                return True
+            stats = self._patterns.get(self.pattern(kind, url))
+            if not stats or stats['ok'] or len(stats.get('failed_books', ())) < self.DEAD_AFTER:
+                return False
+            if stats.get('probe_at', 0) > now:
+                return True
+            # Let this one through as the periodic probe
+            stats['probe_at'] = now + self.PATTERN_TTL
+            self._dirty = True
+            return False
+
+    def record(self, kind, url, ok, remember_url=True, book_id=None):
+        """
+        Counts one outcome for url's pattern; remember_url=False skips the per-URL negative entry.
+        book_id identifies the book the URL belongs to (default: the URL itself).
+        """
+        with self._lock:
+            self._load()
+            stats = self._patterns.setdefault(self.pattern(kind, url), {'ok': 0, 'fail': 0})
+            if ok:
+                stats['ok'] += 1
+                self._urls.pop(url, None)
+            else:
+                stats['fail'] += 1
+                if remember_url:
+                    self._urls[url] = time.time() + self.URL_TTL
+                # Distinct books that failed (only the first DEAD_AFTER are kept)
+                failed = stats.setdefault('failed_books', [])
+                key = str(url if book_id is None else book_id)
+                if key not in failed and len(failed) < self.DEAD_AFTER:
+                    failed.append(key)
+                    if not stats['ok'] and len(failed) == self.DEAD_AFTER:
+                        stats['probe_at'] = time.time() + self.PATTERN_TTL
+                        logger.info(f"Resolver: {self.pattern(kind, url)} never works, skipping it for now")
+            self._dirty = True
+
+    def order(self, candidates):
+        """Sorts [(kind, url), ...] best first (success rate of each pattern, smoothed)."""
+        with self._lock:
+            self._load()
+            def score(candidate):
+                stats = self._patterns.get(self.pattern(*candidate)) or {'ok': 0, 'fail': 0}
+                return -(stats['ok'] + 1) / (stats['ok'] + stats['fail'] + 2)
+            return sorted(candidates, key=score)
+
+    def save(self):
+        # Serialized under the lock (record() may run on other threads meanwhile), written outside it
+        with self._lock:
+            if not self._dirty: return
+            now = time.time()
+            text = json.dumps({"patterns": self._patterns,
+                               "dead_urls": {u: t for u, t in self._urls.items() if t > now}}, indent=1)
+            self._dirty = False
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save resolver state: {e}")
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
@@ -0,0 +1,128 @@
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class LibraryScheduler:
+    """
+    Downloads many books at once for bulk selections.
+    Up to max_books books run side by side; which book starts next is decided by
+    priority (lower runs first), then submission order. All running books draw
+    their asset fetches from the API's single AIMD window, which hands free slots
+    to the book with the fewest fetches in flight, so no book starves the others
+    and the network stays busy while any one book is in its serial tail
+    (OPF parse, resources, ZIP close).
+    """
+
+    HIGH = 0
+    NORMAL = 10
+    LOW = 20
+
+    def __init__(self, client, max_books=4):
+        self.client = client
+        self.max_books = max_books
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = set()
+        self._workers = []
+        self._closed = False
+
+    def submit(self, book_id, priority=NORMAL, progress_callback=None, refresh=False):
+        """
+        Queues one book. Returns a Future resolving to (success, message).
+        progress_callback(book_id, percent) is called from worker threads.
+        """
+        future = Future()
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._seq), book_id, progress_callback, refresh, future))
+            self._start_workers()
+            self._cond.notify()
+        return future
+
+    def run(self, book_ids, progress_callback=None, priority=NORMAL, refresh=False):
+        """
+        Downloads book_ids (earlier ids are started first) and blocks until all are done.
+        Returns [(book_id, success, message), ...] in the order given.
+        """
+        futures = [(bid, self.submit(bid, priority, progress_callback, refresh)) for bid in book_ids]
+        results = []
+        for bid, future in futures:
+            success, message = future.result()
+            results.append((bid, success, message))
+        return results
+
+    def _start_workers(self):
+        # Called with the lock held; workers are started lazily, up to max_books
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < min(self.max_books, len(self._heap) + len(self._running)):
+            w = threading.Thread(target=self._worker, name=f"book-worker-{len(self._workers)}", daemon=True)
+            self._workers.append(w)
+            w.start()
+
+    def _next_job(self):
+        """Pops the best job whose output file is not already being written by another worker."""
+        with self._cond:
+            while True:
+                if self._closed: return None
+                deferred = []
+                job = None
+                while self._heap:
+                    candidate = heapq.heappop(self._heap)
+                    if self._output_key(candidate[2]) in self._running:
+                        deferred.append(candidate)
+                        continue
+                    job = candidate
+                    break
+                for d in deferred:
+                    heapq.heappush(self._heap, d)
+                if job:
+                    self._running.add(self._output_key(job[2]))
+                    return job
+                if not self._heap and not self._running:
+                    return None
+                self._cond.wait(timeout=1.0)
+
+    def _output_key(self, book_id):
+        # Two books with the same title would write the same EPUB path
+        book = self.client.find_book(book_id)
+        title = (book or {}).get('title', str(book_id))
+        return "".join([c for c in title if c.isalpha() or c.isdigit() or c==' ']).strip()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            priority, _, book_id, progress_callback, refresh, future = job
+            callback = (lambda p, b=book_id: progress_callback(b, p)) if progress_callback else None
+            try:
+                result = self.client.download_book(book_id, progress_callback=callback, refresh=refresh)
+            except Exception as e:
+                logger.error(f"Download of book {book_id} crashed: {e}")
+                result = (False, str(e))
+                # It may have crashed before the API reported it: never leave it 'queued'
+                self.client.progress.finish_book(book_id, False)
+            finally:
+                with self._cond:
+                    self._running.discard(self._output_key(book_id))
+                    self._cond.notify_all()
+            future.set_result(result)
+
+    def close(self):
+        """
+        Stops workers after their current book; queued books are left unfinished
+        (reported as failed, so the progress tracker is no longer busy with them).
+        """
+        with self._cond:
+            self._closed = True
+            cancelled, self._heap = self._heap, []
+            self._cond.notify_all()
+        for job in cancelled:
+            self.client.progress.finish_book(job[2], False)
+            job[5].set_result((False, "Cancelled"))
@@ -0,0 +1,261 @@
+import os
+import re
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class BlobRef:
+    """A stored blob that is too large to hold in memory. len() is its size; open() streams it."""
+
+    def __init__(self, path, size, digest=None):
+        self.path = path
+        self.size = size
+        self.sha256 = digest
+
+    def __len__(self):
+        return self.size
+
+    def open(self):
+        return open(self.path, "rb")
+
+
+class AssetStore:
+    """
+    Local content-addressed store (sha256 -> blob) shared by every book and book version.
+    An SQLite index maps asset URLs (and their ETags) to blob hashes.
+    Blobs are evicted least-recently-used once the store grows past max_bytes; blobs
+    pinned by a BlobRef that is still waiting to be packaged are never evicted.
+    Large bodies are streamed into 'tmp/' (spool) and moved in with put_file().
+    """
+
+    SPOOL_MAX_AGE = 24 * 3600
+
+    # '.../9781108796606-54.1.1/OEBPS/x.css' and '.../9781108796606-54.1.2/OEBPS/x.css'
+    # share the peer key '.../9781108796606/OEBPS/x.css'
+    VERSION_SEGMENT = re.compile(r'-\d+(?:\.\d+)+(?=/)')
+
+    def __init__(self, root="asset_store", max_bytes=4 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = None
+        self._total = 0
+        self._pins = {}  # hash -> number of BlobRefs in use
+
+    def _conn(self):
+        # Lazy: creating a CambridgeAPI must not touch the disk
+        if self._db is None:
+            os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER, last_used REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT, etag TEXT, "
+                       "last_modified TEXT, peer_key TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS urls_peer ON urls (peer_key)")
+            db.execute("CREATE INDEX IF NOT EXISTS urls_etag ON urls (etag)")
+            db.execute("CREATE INDEX IF NOT EXISTS blobs_lru ON blobs (last_used)")
+            db.commit()
+            self._total = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            self._db = db
+            self._clean_spool()
+        return self._db
+
+    def _clean_spool(self):
+        # Spool files left by a crashed process (other processes may still be writing fresh ones)
+        spool_dir = os.path.join(self.root, "tmp")
+        if not os.path.isdir(spool_dir): return
+        cutoff = time.time() - self.SPOOL_MAX_AGE
+        for name in os.listdir(spool_dir):
+            path = os.path.join(spool_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def spool_path(self):
+        """A fresh temporary path on the store's filesystem, for streaming a large body to disk."""
+        self._conn()
+        spool_dir = os.path.join(self.root, "tmp")
+        os.makedirs(spool_dir, exist_ok=True)
+        return os.path.join(spool_dir, f"{uuid.uuid4().hex}.spool")
+
+    def peer_key(self, url):
+        return self.VERSION_SEGMENT.sub('', url)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def entry(self, url):
+        """Returns (hash, etag, last_modified) indexed for url, or None."""
+        with self._lock:
+            row = self._conn().execute("SELECT hash, etag, last_modified FROM urls WHERE url=?", (url,)).fetchone()
+        return tuple(row) if row else None
+
+    def lookup_peer(self, url):
+        """
+        Returns (hash, etag) of the same asset in another version of the book, if known.
+        Used for an If-None-Match probe: a 304 means the stored blob can be reused.
+        """
+        key = self.peer_key(url)
+        if key == url: return None
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT hash, etag FROM urls WHERE peer_key=? AND url<>? AND etag IS NOT NULL "
+                "ORDER BY rowid DESC LIMIT 1", (key, url)).fetchone()
+        return tuple(row) if row else None
+
+    def read(self, digest):
+        """Returns a blob's bytes (and marks it recently used), or None if it is missing or truncated."""
+        try:
+            with open(self.blob_path(digest), "rb") as f:
+                data = f.read()
+        except OSError:
+            self.discard(digest)
+            return None
+        with self._lock:
+            db = self._conn()
+            row = db.execute("SELECT size FROM blobs WHERE hash=?", (digest,)).fetchone()
+        if row and row[0] != len(data):
+            logger.warning(f"Asset store: blob {digest[:12]} has the wrong size, discarding")
+            self.discard(digest)
+            return None
+        with self._lock:
+            db = self._conn()
+            db.execute("UPDATE blobs SET last_used=? WHERE hash=?", (time.time(), digest))
+            db.commit()
+        return data
+
+    def load(self, digest, max_bytes):
+        """
+        Returns the blob as bytes, or as a BlobRef (nothing read) when it is larger than
+        max_bytes. None if it is missing or truncated. A BlobRef is pinned: unpin() it once
+        the body has been consumed.
+        """
+        with self._lock:
+            row = self._conn().execute("SELECT size FROM blobs WHERE hash=?", (digest,)).fetchone()
+        if row is None or row[0] <= max_bytes:
+            return self.read(digest)
+        # Pinned first: evict() drops the index row when it picks a victim, so a blob
+        # still indexed after the pin is no longer a candidate
+        self.pin(digest)
+        with self._lock:
+            indexed = self._conn().execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone()
+        if not indexed or not self.has(digest, row[0]):
+            self.unpin(digest)
+            self.discard(digest)
+            return None
+        with self._lock:
+            db = self._conn()
+            db.execute("UPDATE blobs SET last_used=? WHERE hash=?", (time.time(), digest))
+            db.commit()
+        return BlobRef(self.blob_path(digest), row[0], digest)
+
+    def pin(self, digest):
+        """Keeps a blob from being evicted until the matching unpin()."""
+        with self._lock:
+            self._pins[digest] = self._pins.get(digest, 0) + 1
+
+    def unpin(self, digest):
+        with self._lock:
+            count = self._pins.pop(digest, 0) - 1
+            if count > 0:
+                self._pins[digest] = count
+
+    def has(self, digest, size=None):
+        """True if the blob is present (and has the expected size, when given)."""
+        try:
+            return size is None or os.path.getsize(self.blob_path(digest)) == size
+        except OSError:
+            return False
+
+    def put(self, url, data, etag=None, last_modified=None):
+        """Stores data under its sha256 and indexes url -> hash. Returns the hash."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not self.has(digest, len(data)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename: a crash never leaves a truncated blob under its final name
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        self._register(url, digest, len(data), etag, last_modified)
+        return digest
+
+    def put_file(self, url, spool_path, digest, size, etag=None, last_modified=None):
+        """Moves a spooled body (hashed while it was written) into the store. Returns the hash."""
+        path = self.blob_path(digest)
+        if self.has(digest, size):
+            os.remove(spool_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(spool_path, path)
+        self._register(url, digest, size, etag, last_modified)
+        return digest
+
+    def _register(self, url, digest, size, etag, last_modified):
+        with self._lock:
+            db = self._conn()
+            if not db.execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone():
+                self._total += size
+            db.execute("INSERT OR REPLACE INTO blobs (hash, size, last_used) VALUES (?, ?, ?)",
+                       (digest, size, time.time()))
+            self._index(db, url, digest, etag, last_modified)
+            db.commit()
+        self.evict()
+
+    def link(self, url, digest, etag=None, last_modified=None):
+        """Points url at an existing blob (e.g. after a 304 against a peer's ETag)."""
+        with self._lock:
+            db = self._conn()
+            self._index(db, url, digest, etag, last_modified)
+            db.commit()
+
+    def _index(self, db, url, digest, etag, last_modified):
+        db.execute("INSERT OR REPLACE INTO urls (url, hash, etag, last_modified, peer_key) VALUES (?, ?, ?, ?, ?)",
+                   (url, digest, etag, last_modified, self.peer_key(url)))
+
+    def discard(self, digest):
+        """Drops a blob and every URL pointing at it (missing or corrupt blobs)."""
+        with self._lock:
+            db = self._conn()
+            row = db.execute("SELECT size FROM blobs WHERE hash=?", (digest,)).fetchone()
+            if row: self._total -= row[0]
+            db.execute("DELETE FROM blobs WHERE hash=?", (digest,))
+            db.execute("DELETE FROM urls WHERE hash=?", (digest,))
+            db.commit()
+        try:
+            os.remove(self.blob_path(digest))
+        except OSError:
+            pass
+
+    def evict(self):
+        """Drops least-recently-used blobs until the store fits in max_bytes."""
+        with self._lock:
+            db = self._conn()
+            if self._total <= self.max_bytes: return
+            victims = []
+            for digest, size in db.execute("SELECT hash, size FROM blobs ORDER BY last_used").fetchall():
+                if self._total <= self.max_bytes: break
+                if digest in self._pins: continue
+                victims.append(digest)
+                self._total -= size
+            for digest in victims:
+                db.execute("DELETE FROM blobs WHERE hash=?", (digest,))
+                db.execute("DELETE FROM urls WHERE hash=?", (digest,))
+            db.commit()
+        for digest in victims:
+            try:
+                os.remove(self.blob_path(digest))
+            except OSError:
+                pass
+        logger.info(f"Asset store: evicted {len(victims)} blobs")
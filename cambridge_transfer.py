@@ -0,0 +1,643 @@
+import os
+import re
+import copy
+import json
+import asyncio
+import hashlib
+import random
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
+from cambridge_validate import ContentRejected
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class TransferCancelled(Exception):
+    """Raised from an on_progress callback to abandon a transfer (e.g. the loser of a hedged race)."""
+
+
+class RangedDownloader:
+    """
+    Downloads a single (large) file into '<path>.part' with HTTP Range resume.
+    Progress is kept in '<path>.part.json', so a failed or interrupted transfer
+    continues from the last saved offset instead of byte zero.
+    Files above SEGMENT_THRESHOLD on servers that accept ranges are split into
+    SEGMENTS byte ranges fetched in parallel into the same preallocated file.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+    # First read of a fresh response: just enough for validate(), which then runs
+    # before the rest of the body (a full-size read blocks until CHUNK_SIZE arrived)
+    HEAD_BYTES = 1024
+    SEGMENT_THRESHOLD = 32 * 1024 * 1024
+    SEGMENTS = 4
+    SEGMENT_RETRIES = 3
+    SAVE_EVERY = 4 * 1024 * 1024
+    TIMEOUT = 30
+
+    CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+    def __init__(self, session):
+        self.session = session
+
+    def download(self, url, path, validate=None, on_progress=None, conditional=None, meta=None):
+        """
+        Fetches url into path. validate(response, first_chunk) -> bool is called on a
+        fresh (non-resumed) response before anything is written. Returns True on success.
+        on_progress(nbytes, total, cached=False) is called for every chunk written
+        (and once with cached=True for bytes kept from an earlier attempt). If it raises
+        TransferCancelled the partial file is removed and the exception propagates.
+        conditional: If-None-Match / If-Modified-Since headers describing the file already
+        at path; a 304 keeps that file (and counts as success).
+        meta (dict) receives 'etag', 'last_modified' and 'not_modified' of the result.
+        """
+        part_path = path + ".part"
+        if meta is None: meta = {}
+        try:
+            return self._download(url, path, part_path, validate, on_progress, conditional, meta)
+        except TransferCancelled:
+            self._discard(part_path)
+            raise
+
+    def _download(self, url, path, part_path, validate, on_progress, conditional, meta):
+        state = self._load_state(part_path, url)
+
+        if state is None:
+            state = self._start(url, part_path, validate, on_progress, conditional)
+            if state is None:
+                return False
+            if state.get('not_modified'):
+                return self._keep(url, path, state, on_progress, meta)
+            if state.get('complete'):
+                return self._finish(part_path, path, state, meta)
+        else:
+            done = sum(s[2] for s in state['segments'])
+            logger.info(f"Resuming {os.path.basename(path)} from {done} bytes")
+            if on_progress: on_progress(done, state.get('total'), cached=True)
+
+        if not self._run_segments(url, part_path, state, on_progress):
+            if state.get('restart'):
+                # Server ignored If-Range (file changed): start over once
+                self._discard(part_path)
+                state = self._start(url, part_path, validate, on_progress)
+                if state is None:
+                    return False
+                if state.get('complete'):
+                    return self._finish(part_path, path, state, meta)
+                if not self._run_segments(url, part_path, state, on_progress):
+                    return False
+            else:
+                return False
+        return self._finish(part_path, path, state, meta)
+
+    def _start(self, url, part_path, validate, on_progress=None, conditional=None):
+        """
+        Opens a fresh GET, validates it, then either streams it straight into the
+        .part file (small files) or lays out byte-range segments (large files).
+        Returns the transfer state, or None if the response was rejected.
+        """
+        with self.session.get(url, headers=conditional or None, stream=True, timeout=self.TIMEOUT) as r:
+            if r.status_code == 304 and conditional:
+                return {'not_modified': True, 'etag': r.headers.get('ETag') or conditional.get('If-None-Match'),
+                        'last_modified': r.headers.get('Last-Modified') or conditional.get('If-Modified-Since')}
+            if r.status_code != 200:
+                logger.warning(f"Resource request failed {r.status_code} for {url}")
+                return None
+            chunk_iter = self._chunks(r, self.HEAD_BYTES)
+            first_chunk = next(chunk_iter, None)
+            # The buffer is reused by the next read: keep a copy for validation and the first write
+            first_chunk = bytes(first_chunk) if first_chunk is not None else None
+            if validate and not validate(r, first_chunk):
+                return None
+
+            total = int(r.headers.get('Content-Length') or 0) or None
+            etag = r.headers.get('ETag')
+            last_modified = r.headers.get('Last-Modified')
+            ranged = r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+
+            if total and ranged and total >= self.SEGMENT_THRESHOLD:
+                # Large file: drop this stream and fetch SEGMENTS ranges in parallel
+                size = -(-total // self.SEGMENTS)
+                segments = [[start, min(start + size, total) - 1, 0] for start in range(0, total, size)]
+                state = {'url': url, 'etag': etag, 'last_modified': last_modified, 'total': total,
+                         'segments': segments}
+                with open(part_path, "wb") as f:
+                    f.truncate(total)
+                self._save_state(part_path, state)
+                logger.info(f"Segmented download: {total} bytes in {len(segments)} ranges")
+                return state
+
+            # Single stream (resumable if the server accepts ranges)
+            end = total - 1 if total else None
+            state = {'url': url, 'etag': etag, 'last_modified': last_modified, 'total': total,
+                     'segments': [[0, end, 0]]}
+            lock = threading.Lock()
+            with open(part_path, "wb") as f:
+                try:
+                    self._write_stream(f, state, state['segments'][0], [first_chunk], chunk_iter, part_path, lock, on_progress)
+                    if total and state['segments'][0][2] < total:
+                        raise IOError("connection closed early")
+                except TransferCancelled:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Transfer interrupted at {state['segments'][0][2]} bytes: {e}")
+                    if ranged:
+                        self._save_state(part_path, state)
+                        return state
+                    self._discard(part_path)
+                    return None
+            state['complete'] = True
+            return state
+
+    def _run_segments(self, url, part_path, state, on_progress=None):
+        pending = [seg for seg in state['segments'] if not self._segment_done(seg)]
+        if not pending:
+            return True
+        lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            results = list(executor.map(lambda seg: self._fetch_segment(url, part_path, state, seg, lock, on_progress), pending))
+        self._save_state(part_path, state)
+        return all(results)
+
+    def _fetch_segment(self, url, part_path, state, seg, lock, on_progress=None):
+        for attempt in range(self.SEGMENT_RETRIES):
+            if self._segment_done(seg):
+                return True
+            start, end, done = seg
+            headers = {'Range': f"bytes={start + done}-{'' if end is None else end}"}
+            if state.get('etag'):
+                headers['If-Range'] = state['etag']
+            try:
+                with self.session.get(url, headers=headers, stream=True, timeout=self.TIMEOUT) as r:
+                    if r.status_code == 200:
+                        state['restart'] = True
+                        return False
+                    if r.status_code != 206:
+                        logger.warning(f"Range request failed {r.status_code} for {url}")
+                        continue
+                    m = self.CONTENT_RANGE.match(r.headers.get('Content-Range', ''))
+                    if not m or int(m.group(1)) != start + done:
+                        logger.warning(f"Unexpected Content-Range '{r.headers.get('Content-Range')}' for {url}")
+                        continue
+                    with open(part_path, "r+b") as f:
+                        f.seek(start + done)
+                        self._write_stream(f, state, seg, [], self._chunks(r), part_path, lock, on_progress)
+                if end is None:
+                    # Open-ended stream that ended cleanly
+                    seg[1] = seg[0] + seg[2] - 1
+                if self._segment_done(seg):
+                    return True
+            except TransferCancelled:
+                raise
+            except Exception as e:
+                logger.warning(f"Segment {start}-{end} interrupted at {seg[2]} bytes (attempt {attempt + 1}): {e}")
+                with lock:
+                    self._save_state(part_path, state)
+        return self._segment_done(seg)
+
+    def _chunks(self, r, head_bytes=0):
+        """
+        Yields the body through one reusable buffer (readinto, no per-chunk allocation).
+        Each chunk is a view that is only valid until the next one is read.
+        With head_bytes, the first chunk is a separate small read of that many bytes.
+        """
+        encoded = r.headers.get('Content-Encoding', 'identity').lower() not in ('identity', '')
+        if head_bytes:
+            head = r.raw.read(head_bytes, decode_content=encoded)
+            if not head: return
+            yield head
+        if encoded:
+            # Compressed transfer: requests has to decode it
+            yield from r.iter_content(chunk_size=self.CHUNK_SIZE)
+            return
+        buf = bytearray(self.CHUNK_SIZE)
+        view = memoryview(buf)
+        while True:
+            n = r.raw.readinto(buf)
+            if not n: return
+            yield view[:n]
+
+    def _write_stream(self, f, state, seg, head, chunk_iter, part_path, lock, on_progress=None):
+        """Writes chunks for one segment, never past its end, saving progress periodically."""
+        unsaved = 0
+        for chunk in head or ():
+            if chunk:
+                f.write(chunk)
+                seg[2] += len(chunk)
+                if on_progress: on_progress(len(chunk), state.get('total'))
+        for chunk in chunk_iter:
+            if not chunk: continue
+            if seg[1] is not None:
+                chunk = chunk[:seg[1] - seg[0] + 1 - seg[2]]
+            f.write(chunk)
+            seg[2] += len(chunk)
+            if on_progress: on_progress(len(chunk), state.get('total'))
+            unsaved += len(chunk)
+            if unsaved >= self.SAVE_EVERY:
+                f.flush()
+                with lock:
+                    self._save_state(part_path, state)
+                unsaved = 0
+            if self._segment_done(seg):
+                break
+        f.flush()
+
+    @staticmethod
+    def _segment_done(seg):
+        start, end, done = seg
+        return end is not None and done >= end - start + 1
+
+    def _finish(self, part_path, path, state, meta):
+        os.replace(part_path, path)
+        try:
+            os.remove(part_path + ".json")
+        except OSError:
+            pass
+        meta.update(etag=state.get('etag'), last_modified=state.get('last_modified'), not_modified=False)
+        return True
+
+    def _keep(self, url, path, state, on_progress, meta):
+        """304 to a conditional GET: the copy already at path is current."""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            logger.warning(f"{url} is not modified but {path} is gone")
+            return False
+        if on_progress: on_progress(size, size, cached=True)
+        meta.update(etag=state.get('etag'), last_modified=state.get('last_modified'), not_modified=True)
+        return True
+
+    def _load_state(self, part_path, url):
+        if not os.path.exists(part_path):
+            return None
+        try:
+            with open(part_path + ".json", "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get('url') == url:
+                return state
+        except (OSError, ValueError):
+            pass
+        # Orphaned or foreign .part file: cannot be trusted
+        self._discard(part_path)
+        return None
+
+    def _save_state(self, part_path, state):
+        tmp = part_path + ".json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in state.items() if k in ('url', 'etag', 'last_modified', 'total', 'segments')}, f)
+        os.replace(tmp, part_path + ".json")
+
+    def _discard(self, part_path):
+        for p in (part_path, part_path + ".json"):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD window for in-flight asset fetches.
+    The window grows by one each second in which it was fully used and throughput
+    improved, and is cut multiplicatively on 429/5xx, connection errors, latency spikes
+    or Retry-After (which also pauses new fetches). `window` is safe to read for display.
+    Callers may pass a key (e.g. the book id): a free slot then goes to the waiting key
+    with the fewest fetches in flight, so books downloading side by side share fairly.
+    """
+
+    INCREASE = 1
+    DECREASE = 0.5
+    EPOCH = 1.0
+    SPIKE_FACTOR = 3.0
+    SPIKE_MAX_BYTES = 256 * 1024
+    MAX_RETRY_AFTER = 60
+
+    def __init__(self, initial=10, minimum=2, maximum=64):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = initial
+        self.in_flight = 0
+        self._cond = threading.Condition()
+        self._by_key = {}
+        self._waiting = {}
+        self._latency = None
+        self._paused_until = 0
+        self._last_cut = 0
+        self._epoch_start = time.monotonic()
+        self._epoch_bytes = 0
+        self._epoch_saturated = False
+        self._last_rate = 0
+
+    def acquire(self, key=None):
+        with self._cond:
+            self._waiting[key] = self._waiting.get(key, 0) + 1
+            try:
+                while True:
+                    wait = self._paused_until - time.monotonic()
+                    if wait <= 0 and self.in_flight < self.window and self._fair_turn(key):
+                        break
+                    if wait <= 0 and self.in_flight >= self.window:
+                        self._epoch_saturated = True
+                    self._cond.wait(timeout=max(wait, 0.05) if wait > 0 else 0.5)
+            finally:
+                self._waiting[key] -= 1
+                if not self._waiting[key]:
+                    del self._waiting[key]
+            self.in_flight += 1
+            self._by_key[key] = self._by_key.get(key, 0) + 1
+            if self.in_flight < self.window:
+                # Slots left over: let the next-fairest waiter re-check
+                self._cond.notify_all()
+
+    def in_flight_for(self, key=None):
+        """Fetches in flight for key, or for everyone when key is None."""
+        with self._cond:
+            return self.in_flight if key is None else self._by_key.get(key, 0)
+
+    def _fair_turn(self, key):
+        """True if no other waiting key has fewer fetches in flight than key."""
+        mine = self._by_key.get(key, 0)
+        return all(mine <= self._by_key.get(k, 0) for k in self._waiting)
+
+    def release(self, latency=None, nbytes=0, status=None, error=False, retry_after=None, key=None):
+        """Reports how a fetch went and frees its slot (key must match the acquire)."""
+        with self._cond:
+            self.in_flight -= 1
+            self._by_key[key] -= 1
+            if not self._by_key[key]:
+                del self._by_key[key]
+            now = time.monotonic()
+            congested = error or status == 429 or (status is not None and status >= 500)
+
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + min(retry_after, self.MAX_RETRY_AFTER))
+                congested = True
+
+            if latency is not None and nbytes <= self.SPIKE_MAX_BYTES:
+                if self._latency and latency > self.SPIKE_FACTOR * self._latency and latency > 1.0:
+                    congested = True
+                self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+
+            if congested:
+                # At most one cut per round trip, however many fetches report the same event
+                if now - self._last_cut >= (self._latency or 1.0) and self.window > self.minimum:
+                    self.window = max(self.minimum, int(self.window * self.DECREASE))
+                    self._last_cut = now
+                    self._last_rate = 0
+                    logger.info(f"Concurrency window cut to {self.window}")
+            else:
+                self._epoch_bytes += nbytes
+                elapsed = now - self._epoch_start
+                if elapsed >= self.EPOCH:
+                    rate = self._epoch_bytes / elapsed
+                    if self._epoch_saturated and rate >= self._last_rate and self.window < self.maximum:
+                        self.window += self.INCREASE
+                    self._last_rate = rate
+                    self._epoch_start = now
+                    self._epoch_bytes = 0
+                    self._epoch_saturated = False
+            self._cond.notify_all()
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Retry-After in seconds (delta-seconds or HTTP date), or None."""
+        if not value: return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class RetryPolicy:
+    """
+    Per-asset retry budget with capped exponential backoff and full jitter.
+    Throttling, 5xx and network errors are transient; other 4xx (403/404/410) are
+    final, so retrying them would only waste the budget.
+    """
+
+    RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, status=None, error=None, **_):
+        if status is None:
+            # No HTTP answer at all (timeout, reset, DNS): worth another try
+            return True
+        return status in self.RETRYABLE_STATUS
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt` (1-based); Retry-After wins if longer."""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if retry_after:
+            backoff = max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+
+class ByteBudget:
+    """
+    Global cap on response bytes held in memory, shared by every book.
+    A fetcher reserves a body's size before reading it and the ZIP writer releases it
+    once the body has been packaged; when the cap is reached new reads wait (backpressure).
+    A single reservation larger than the cap is let through once nothing else is held.
+    """
+
+    def __init__(self, limit=128 * 1024 * 1024):
+        self.limit = limit
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self, n):
+        with self._cond:
+            if self.in_use and self.in_use + n > self.limit:
+                return False
+            self.in_use += n
+            return True
+
+    def acquire(self, n):
+        with self._cond:
+            while self.in_use and self.in_use + n > self.limit:
+                self._cond.wait(timeout=0.5)
+            self.in_use += n
+
+    def hold(self, n):
+        """Counts n bytes that are already in memory (never waits, e.g. on the writer thread)."""
+        with self._cond:
+            self.in_use += n
+
+    async def acquire_async(self, n, poll=0.02):
+        """Event-loop version of acquire (never blocks the loop)."""
+        while not self.try_acquire(n):
+            await asyncio.sleep(poll)
+
+    def release(self, n):
+        if not n: return
+        with self._cond:
+            self.in_use -= n
+            self._cond.notify_all()
+
+
+class BodyReader:
+    """
+    Reads response bodies for the asset pipeline without unbounded buffering.
+    Bodies up to `threshold` bytes are read into memory after reserving their size in
+    the ByteBudget. Larger (or unknown-length bodies that grow past it) are streamed to a
+    spool file through one reusable buffer and hashed on the way, so memory stays at one
+    buffer per transfer regardless of the file size.
+    Returns (content, spool, held): content bytes or None, spool (path, size, sha256) or
+    None, and the number of budget bytes the caller must release.
+    With validate(headers, head) -> reason, the first HEAD_BYTES are checked as soon as
+    they arrive and ContentRejected is raised (nothing kept) if a reason comes back.
+    reporting(on_bytes) gives a reader for one transfer that calls on_bytes(n, total)
+    for every chunk, so a large body shows progress while it streams in.
+    """
+
+    BUFFER_SIZE = 1024 * 1024
+    HEAD_BYTES = 1024
+
+    def __init__(self, budget, spool_path, threshold=1024 * 1024):
+        self.budget = budget
+        # spool_path() -> fresh temporary file path
+        self.spool_path = spool_path
+        self.threshold = threshold
+        self.on_bytes = None
+
+    def reporting(self, on_bytes):
+        reader = copy.copy(self)
+        reader.on_bytes = on_bytes
+        return reader
+
+    def _expected(self, headers):
+        try:
+            return int(headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            return None
+
+    def read_sync(self, r, validate=None):
+        """requests.Response opened with stream=True."""
+        length = self._expected(r.headers)
+        held = 0
+        if length is None or length <= self.threshold:
+            held = min(length if length is not None else self.threshold, self.threshold)
+            self.budget.acquire(held)
+        encoded = r.headers.get('Content-Encoding', 'identity').lower() not in ('identity', '')
+        buf = bytearray(self.BUFFER_SIZE)
+        view = memoryview(buf)
+        sink = _Sink(self, validate, r.headers)
+        try:
+            # The first bytes on their own, so validate() runs as soon as they arrive
+            # (readinto() on the full buffer blocks until BUFFER_SIZE bytes or the end)
+            head = r.raw.read(self.HEAD_BYTES, decode_content=encoded)
+            if head:
+                sink.write(head)
+                if encoded:
+                    # Compressed transfer: let requests decode (large chunks, no per-KB iteration)
+                    for chunk in r.iter_content(chunk_size=self.BUFFER_SIZE):
+                        sink.write(chunk)
+                else:
+                    while True:
+                        n = r.raw.readinto(buf)
+                        if not n: break
+                        sink.write(view[:n])
+            content, spool = sink.finish()
+        except Exception:
+            sink.abort()
+            self.budget.release(held)
+            raise
+        if spool:
+            self.budget.release(held)
+            held = 0
+        return content, spool, held
+
+    async def read_async(self, r, validate=None):
+        """aiohttp.ClientResponse."""
+        length = r.content_length
+        held = 0
+        if length is None or length <= self.threshold:
+            held = min(length if length is not None else self.threshold, self.threshold)
+            await self.budget.acquire_async(held)
+        sink = _Sink(self, validate, r.headers)
+        try:
+            async for chunk in r.content.iter_chunked(self.BUFFER_SIZE):
+                sink.write(chunk)
+            content, spool = sink.finish()
+        except BaseException:
+            sink.abort()
+            self.budget.release(held)
+            raise
+        if spool:
+            self.budget.release(held)
+            held = 0
+        return content, spool, held
+
+
+class _Sink:
+    """Accumulates a body in memory and spills it to a spool file once it passes the threshold."""
+
+    def __init__(self, reader, validate=None, headers=None):
+        self.reader = reader
+        self.validate = validate
+        self.headers = headers
+        self.head = bytearray()
+        self.memory = bytearray()
+        self.file = None
+        self.path = None
+        self.size = 0
+        self.sha = None
+        # Content-Length counts encoded bytes, the chunks are decoded ones
+        encoded = (headers or {}).get('Content-Encoding', 'identity').lower() not in ('identity', '')
+        self.total = None if encoded or headers is None else reader._expected(headers)
+
+    def _check_head(self):
+        reason = self.validate(self.headers, bytes(self.head))
+        self.validate = None
+        if reason:
+            raise ContentRejected(reason)
+
+    def write(self, chunk):
+        if self.validate is not None:
+            self.head += chunk[:self.reader.HEAD_BYTES - len(self.head)]
+            if len(self.head) >= self.reader.HEAD_BYTES:
+                self._check_head()
+        self.size += len(chunk)
+        if self.reader.on_bytes:
+            self.reader.on_bytes(len(chunk), self.total)
+        if self.file is None and self.size <= self.reader.threshold:
+            self.memory += chunk
+            return
+        if self.file is None:
+            self.path = self.reader.spool_path()
+            self.file = open(self.path, "wb")
+            self.sha = hashlib.sha256(self.memory)
+            self.file.write(self.memory)
+            self.memory = None
+        self.sha.update(chunk)
+        self.file.write(chunk)
+
+    def finish(self):
+        if self.validate is not None:
+            # Body shorter than HEAD_BYTES
+            self._check_head()
+        if self.file is None:
+            return bytes(self.memory), None
+        self.file.close()
+        return None, (self.path, self.size, self.sha.hexdigest())
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
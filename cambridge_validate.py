@@ -0,0 +1,130 @@
+import os
+import logging
+import mimetypes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class ContentRejected(Exception):
+    """Raised while a body streams in, as soon as its first bytes fail validation."""
+
+
+# Error pages that come back with a 200 status
+S3_ERROR = b'<Error><Code>'
+ASPNET_ERROR = b"Server Error in '"
+EPUB_SIGNATURE = b'mimetypeapplication/epub+zip'
+
+def _markup(head):
+    return head.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'<')
+
+def _looks_like_html(head):
+    return head.lstrip(b'\xef\xbb\xbf \t\r\n')[:64].lower().startswith((b'<!doctype html', b'<html'))
+
+# Image files are often labelled with the wrong raster type (a PNG named .jpg)
+RASTER_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'BM',
+                     b'II*\x00', b'MM\x00*', b'\x00\x00\x01\x00')
+
+def _raster(head):
+    return head.startswith(RASTER_SIGNATURES) or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+
+def _zip(head):
+    return head.startswith((b'PK\x03\x04', b'PK\x05\x06', b'PK\x07\x08'))
+
+def _not_epub(head):
+    # The book itself served in place of a resource (its first entry is 'mimetype')
+    return EPUB_SIGNATURE not in head[:64]
+
+
+class ContentValidators:
+    """
+    Registry of first-bytes checks keyed by expected type ('pdf', 'zip', 'xhtml', ...).
+    The type comes from the OPF media-type when known, otherwise the file extension.
+    check() looks at the first HEAD_BYTES of a body (and its Content-Type) and returns a
+    reason string when the body is not what was asked for (error page served with a 200,
+    the book EPUB instead of an answer-key ZIP, ...), or None when it looks right.
+    Bodies of unregistered types only get the error-page checks. Register more with
+    register(kind, check, extensions, media_types, markup).
+    """
+
+    HEAD_BYTES = 1024
+
+    def __init__(self):
+        self._checks = {}
+        self._markup = set()
+        self._by_extension = {}
+        self._by_type = {}
+
+    @classmethod
+    def with_defaults(cls):
+        v = cls()
+        v.register('pdf', lambda h: b'%PDF-' in h[:1024], ('.pdf',), ('application/pdf',))
+        v.register('zip', lambda h: _zip(h) and _not_epub(h), ('.zip',),
+                   ('application/zip', 'application/x-zip-compressed'))
+        # Office Open XML files are ZIP packages
+        v.register('ooxml', lambda h: _zip(h) and _not_epub(h), ('.docx', '.pptx', '.xlsx'),
+                   ('application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+                    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'))
+        # Any known raster format is accepted for any image type (only pages and the book are refused)
+        v.register('image', _raster, ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff', '.ico'),
+                   ('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff',
+                    'image/x-icon', 'image/vnd.microsoft.icon'))
+        v.register('xhtml', _markup, ('.xhtml', '.html', '.htm'),
+                   ('application/xhtml+xml', 'text/html'), markup=True)
+        v.register('svg', _markup, ('.svg',), ('image/svg+xml',), markup=True)
+        v.register('xml', _markup, ('.xml', '.ncx', '.opf', '.smil'),
+                   ('application/xml', 'text/xml', 'application/x-dtbncx+xml',
+                    'application/oebps-package+xml', 'application/smil+xml'), markup=True)
+        v.register('text', lambda h: not _looks_like_html(h), ('.css', '.js'),
+                   ('text/css', 'application/javascript', 'text/javascript', 'application/x-javascript'))
+        # Anything binary without a signature of its own: only pages and the book are refused
+        v.register('binary', lambda h: True, (), ('application/octet-stream', 'binary/octet-stream'))
+        return v
+
+    def register(self, kind, check, extensions=(), media_types=(), markup=False):
+        """check(head: bytes) -> bool. markup=True: the type is itself HTML/XML (no HTML-page rejection)."""
+        self._checks[kind] = check
+        if markup: self._markup.add(kind)
+        for ext in extensions:
+            self._by_extension[ext.lower()] = kind
+        for media_type in media_types:
+            self._by_type[media_type.lower()] = kind
+
+    def kind_for(self, name, media_type=None):
+        kind = self._by_type.get((media_type or '').lower())
+        if kind is None:
+            kind = self._by_extension.get(os.path.splitext(name.split('?')[0])[1].lower())
+        if kind is None and not media_type:
+            kind = self._by_type.get((mimetypes.guess_type(name)[0] or '').lower())
+        return kind
+
+    def check(self, name, head, media_type=None, content_type=None):
+        """Returns why the body is not a valid `name`, or None."""
+        head = bytes(head[:self.HEAD_BYTES]) if head else b''
+        kind = self.kind_for(name, media_type)
+        content_type = (content_type or '').lower()
+        if S3_ERROR in head or ASPNET_ERROR in head:
+            return "server error page"
+        if kind is not None and kind not in self._markup and kind != 'text':
+            # A binary type: the server's own label is trusted when it says "page"
+            if 'html' in content_type:
+                return "Content-Type is html (likely error page)"
+            if 'epub' in content_type and kind != 'epub':
+                return "Content-Type is epub (likely book redirect)"
+        if kind not in self._markup:
+            if kind != 'text' and _looks_like_html(head):
+                return "HTML content detected"
+            if EPUB_SIGNATURE in head[:64] and kind != 'epub':
+                return "EPUB signature detected"
+        if kind is None:
+            return None
+        if not head:
+            return None if kind in self._markup or kind == 'text' else "empty body"
+        if not self._checks[kind](head):
+            return f"does not look like {kind}"
+        return None
+
+    def for_body(self, name, media_type=None):
+        """validate(headers, head) -> reason or None, for BodyReader."""
+        return lambda headers, head: self.check(name, head, media_type, headers.get('Content-Type'))
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import hashlib
+import logging
+import argparse
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cambridge_packager import ArchiveSidecar
+from cambridge_progress import format_bytes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+READ_BUFFER = 1024 * 1024
+# Local file header: 30 fixed bytes + name + extra field
+LOCAL_HEADER_SIZE = 30
+
+def verify_epub(epub_path, quick=False):
+    """
+    Checks one archive against the integrity manifest in its sidecar.
+    quick=True reads only the central directory: entry names, sizes and CRC-32s are
+    compared with the manifest and every entry must lie before the directory (catches
+    truncated or overwritten files). A full check also reads every entry, so zipfile
+    verifies its CRC-32, and compares the sha256 with the manifest.
+    Archives without a manifest (older downloads) get the structural and CRC checks only.
+    Returns {'path', 'ok', 'errors', 'entries', 'bytes', 'manifest'}.
+    """
+    result = {'path': epub_path, 'ok': False, 'errors': [], 'entries': 0, 'bytes': 0, 'manifest': False}
+    errors = result['errors']
+    sidecar = ArchiveSidecar.load(epub_path)
+    expected = sidecar.integrity if sidecar else {}
+    result['manifest'] = bool(expected)
+
+    try:
+        with zipfile.ZipFile(epub_path) as zf:
+            infos = zf.infolist()
+            result['entries'] = len(infos)
+
+            # 1. Central directory
+            if not infos or infos[0].filename != "mimetype" or infos[0].compress_type != zipfile.ZIP_STORED:
+                errors.append("mimetype is not the first (stored) entry")
+            for info in infos:
+                end = info.header_offset + LOCAL_HEADER_SIZE + len(info.filename.encode('utf-8')) + info.compress_size
+                if end > zf.start_dir:
+                    errors.append(f"{info.filename}: data runs past the central directory")
+
+            # 2. Against the manifest
+            if expected:
+                names = {info.filename for info in infos}
+                for name in sorted(set(expected) - names):
+                    errors.append(f"{name}: missing from archive")
+                for name in sorted(names - set(expected)):
+                    errors.append(f"{name}: not in manifest")
+                for info in infos:
+                    entry = expected.get(info.filename)
+                    if not entry: continue
+                    if entry.get('size') is not None and entry['size'] != info.file_size:
+                        errors.append(f"{info.filename}: size {info.file_size}, expected {entry['size']}")
+                    elif entry.get('crc32') is not None and entry['crc32'] != info.CRC:
+                        errors.append(f"{info.filename}: CRC-32 differs from manifest")
+
+            # 3. Entry bodies (CRC-32 is checked by zipfile at end of stream)
+            if not quick:
+                for info in infos:
+                    h = hashlib.sha256()
+                    try:
+                        with zf.open(info) as f:
+                            for block in iter(lambda: f.read(READ_BUFFER), b''):
+                                h.update(block)
+                    except (zipfile.BadZipFile, OSError, EOFError, zlib.error) as e:
+                        errors.append(f"{info.filename}: {e}")
+                        continue
+                    result['bytes'] += info.file_size
+                    digest = (expected.get(info.filename) or {}).get('sha256')
+                    if digest and digest != h.hexdigest():
+                        errors.append(f"{info.filename}: sha256 differs from manifest")
+    except (zipfile.BadZipFile, OSError) as e:
+        errors.append(f"unreadable archive: {e}")
+
+    result['ok'] = not errors
+    return result
+
+def find_epubs(root):
+    """Every .epub under root (a single file is returned as is)."""
+    if os.path.isfile(root):
+        return [root]
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        found.extend(os.path.join(dirpath, f) for f in filenames if f.lower().endswith(".epub"))
+    return found
+
+def verify_library(root, quick=False, workers=None, on_result=None):
+    """
+    Verifies every EPUB under root on a process pool (CRC and hashing are CPU bound,
+    one process per core keeps the disks busy). Largest archives are started first
+    so one big book does not finish alone at the end.
+    on_result(result) is called as each archive completes. Returns the list of results.
+    """
+    paths = find_epubs(root)
+    paths.sort(key=lambda p: os.path.getsize(p), reverse=True)
+    results = []
+    if not paths:
+        return results
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 2) as pool:
+        futures = {pool.submit(verify_epub, path, quick): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'path': futures[future], 'ok': False, 'errors': [f"verifier crashed: {e}"],
+                          'entries': 0, 'bytes': 0, 'manifest': False}
+            results.append(result)
+            if on_result: on_result(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify downloaded EPUBs against their integrity manifests.")
+    parser.add_argument("library", nargs="?", default="downloads", help="EPUB file or directory (default: downloads)")
+    parser.add_argument("--quick", action="store_true", help="Central directories only (no entry data is read)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    def report(result):
+        if not result['ok']:
+            logger.error(f"FAILED {result['path']}: {'; '.join(result['errors'][:5])}")
+
+    results = verify_library(args.library, args.quick, args.workers, report)
+    failed = [r for r in results if not r['ok']]
+    unmanifested = sum(1 for r in results if not r['manifest'])
+    elapsed = time.monotonic() - start
+    logger.info(f"Verified {len(results)} archives ({format_bytes(sum(r['bytes'] for r in results))} read) "
+                f"in {elapsed:.1f}s: {len(results) - len(failed)} ok, {len(failed)} failed"
+                + (f", {unmanifested} without manifest" if unmanifested else ""))
+    sys.exit(1 if failed else 0)
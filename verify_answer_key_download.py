@@ -35,7 +35,7 @@ def verify_answer_key():
     logger.info(f"Checking resources for: {target_book.get('title')}")
     
     # Manually check resources directly attached to book (which should include enrichments now)
-    resources = target_book.get('resources', [])
+    resources = api.resolve_resources(target_book)
     
     target_file = "asal_physics_wb_answers.zip"
     candidate = next((r for r in resources if target_file in r['name']), None)
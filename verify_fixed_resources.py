@@ -34,7 +34,7 @@ def verify_fixed_resources():
         
     logger.info(f"Target Book: {target_book.get('title')}")
     
-    resources = target_book.get('resources', [])
+    resources = api.resolve_resources(target_book)
     if not resources:
         logger.error("No resources found (did automatic enrichment fetch fail?)")
         return